@@ -0,0 +1,71 @@
+"""
+Packet codec benchmark.
+
+Encodes and decodes a mix of typical packets (events, messages, acks,
+heartbeats) and reports packets per second for each direction.
+
+Usage::
+
+    python benchmarks/codec.py --packets 200000
+"""
+
+from __future__ import print_function
+
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from socketio import packets
+
+
+SAMPLES = [
+    packets.EventPacket(None, None, None, "tick", [{"symbol": "ABC", "price": 101.25}]),
+    packets.EventPacket(7, "data", "/chat", "message", ["hello world"]),
+    packets.MessagePacket(None, None, None, "plain text message"),
+    packets.JSONPacket(None, None, "/chat", {"user": "alice", "online": True}),
+    packets.AckPacket(None, None, None, "7", ["ok"]),
+    packets.HeartbeatPacket(None, None, None),
+]
+
+
+def run(count):
+    encoded = [p.encode() for p in SAMPLES]
+    n = len(SAMPLES)
+    rounds = max(1, count // n)
+
+    started = time.time()
+    for i in range(rounds):
+        for packet in SAMPLES:
+            packet.encode()
+    encode_time = time.time() - started
+
+    started = time.time()
+    for i in range(rounds):
+        for data in encoded:
+            packets.Packet.decode(data)
+    decode_time = time.time() - started
+
+    total = rounds * n
+    return {"encode_per_s": total / encode_time, "decode_per_s": total / decode_time}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--packets", type=int, default=200000)
+    parser.add_argument("--json", action="store_true", help="print results as JSON")
+    args = parser.parse_args()
+
+    result = run(args.packets)
+    if args.json:
+        print(json.dumps(result))
+    else:
+        print("encode: %.0f packets/s" % result["encode_per_s"])
+        print("decode: %.0f packets/s" % result["decode_per_s"])
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,62 @@
+"""
+Run the benchmark suite under several Python interpreters.
+
+Each benchmark is run with ``--json`` under every interpreter given with
+``--python`` (for example CPython and PyPy, each with gevent installed),
+and the results are printed side by side::
+
+    python benchmarks/compare.py --python python2.7 --python pypy
+
+PyPy's JIT needs a while to warm up, so ``--repeat`` runs each benchmark
+several times and keeps the best result.
+"""
+
+from __future__ import print_function
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+BENCHMARKS = [
+    ("codec", ["codec.py", "--packets", "300000"]),
+    ("loopback", ["loopback_throughput.py", "--clients", "200", "--messages", "50000"]),
+    ("routing", ["routing.py", "--paths", "500000"]),
+    ("push", ["push_throughput.py", "--threads", "4", "--pushes", "20000"]),
+]
+
+
+def run(python, args, repeat):
+    best = {}
+    for i in range(repeat):
+        output = subprocess.check_output([python, os.path.join(HERE, args[0]), "--json"] + args[1:])
+        result = json.loads(output.decode("utf-8").strip().splitlines()[-1])
+        for name, value in result.items():
+            best[name] = max(best.get(name, 0), value)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--python", action="append", dest="pythons",
+                        help="interpreter to run the benchmarks with (repeatable)")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--only", help="run only the named benchmark")
+    args = parser.parse_args()
+    pythons = args.pythons or [sys.executable]
+
+    print("%-10s %-16s" % ("benchmark", "metric") + "".join("%16s" % os.path.basename(p) for p in pythons))
+    for name, bench_args in BENCHMARKS:
+        if args.only and name != args.only:
+            continue
+        results = [run(python, bench_args, args.repeat) for python in pythons]
+        for metric in sorted(results[0]):
+            print("%-10s %-16s" % (name, metric) +
+                  "".join("%16.0f" % result.get(metric, 0) for result in results))
+
+
+if __name__ == "__main__":
+    main()
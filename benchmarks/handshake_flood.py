@@ -0,0 +1,105 @@
+"""
+Handshake-only flood soak test.
+
+Starts a server in a child process and floods it with handshakes that
+are never followed by a transport request, like scanners and aborted
+page loads do. Prints the server's resident memory and session counts
+every second; with a handshake timeout they should stay flat.
+
+Usage::
+
+    python benchmarks/handshake_flood.py --duration 60 --handshake-timeout 2
+"""
+
+from __future__ import print_function
+
+from gevent import monkey; monkey.patch_all()
+
+import argparse
+import gc
+import json
+import os
+import subprocess
+import sys
+import time
+
+import gevent
+import gevent.pool
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from socketio.server import SocketIOServer
+
+
+def _rss_kb():
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1])
+    return 0
+
+
+def serve(port, handshake_timeout):
+    server = None
+
+    def app(environ, start_response):
+        gc.collect()
+        stats = {
+            "rss_kb": _rss_kb(),
+            "sessions": len(server._sessions),
+            "pending": len(server.pending_handshakes),
+        }
+        start_response("200 OK", [("Content-Type", "application/json")])
+        return [json.dumps(stats).encode("ascii")]
+
+    server = SocketIOServer(("127.0.0.1", port), app, policy_server=False, backlog=4096,
+                            handshake_timeout=handshake_timeout)
+    server.serve_forever()
+
+
+def _get(port, path):
+    import urllib2
+    return urllib2.urlopen("http://127.0.0.1:%d%s" % (port, path)).read()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--duration", type=float, default=60)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--handshake-timeout", type=float, default=2)
+    parser.add_argument("--port", type=int, default=8902)
+    parser.add_argument("--serve", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve:
+        return serve(args.port, args.handshake_timeout)
+
+    child = subprocess.Popen([sys.executable, os.path.abspath(__file__), "--serve",
+                              "--port", str(args.port),
+                              "--handshake-timeout", str(args.handshake_timeout)])
+    try:
+        gevent.sleep(1)
+        count = [0]
+        deadline = time.time() + args.duration
+
+        def flood():
+            while time.time() < deadline:
+                _get(args.port, "/socket.io/1/")
+                count[0] += 1
+
+        pool = gevent.pool.Pool(args.concurrency)
+        for i in range(args.concurrency):
+            pool.spawn(flood)
+        print("%6s %12s %10s %10s %10s" % ("time", "handshakes", "sessions", "pending", "rss KiB"))
+        started = time.time()
+        while not pool.join(timeout=1):
+            stats = json.loads(_get(args.port, "/stats"))
+            print("%6.0f %12d %10d %10d %10d" % (time.time() - started, count[0], stats["sessions"],
+                                                  stats["pending"], stats["rss_kb"]))
+    finally:
+        child.terminate()
+        child.wait()
+
+
+if __name__ == "__main__":
+    main()
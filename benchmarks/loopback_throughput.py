@@ -0,0 +1,83 @@
+"""
+Application throughput benchmark over the loopback transport.
+
+Drives many in-process clients against an event echo application with
+:class:`socketio.transports.LoopbackTransport`, so the numbers measure
+packet encoding, session queues and application code without any
+socket or HTTP overhead.
+
+Usage::
+
+    python benchmarks/loopback_throughput.py --clients 1000 --messages 100000
+"""
+
+from __future__ import print_function
+
+import argparse
+import json
+import os
+import sys
+import time
+
+import gevent
+import gevent.pool
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from socketio.packets import EventPacket
+from socketio.server import SocketIOServer
+from socketio.transports import LoopbackTransport
+
+
+def echo_events(environ, start_response):
+    io = environ["socketio"]
+    while True:
+        packet = io.receive()
+        if packet is None:
+            return []
+        if packet.kind == "event":
+            io.emit(packet.name, packet.args)
+
+
+def run_client(client, count):
+    for i in range(count):
+        client.send(EventPacket(None, None, None, "echo", [i, "payload"]))
+        client.receive()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--clients", type=int, default=1000)
+    parser.add_argument("--messages", type=int, default=100000)
+    parser.add_argument("--json", action="store_true", help="print results as JSON")
+    args = parser.parse_args()
+
+    server = SocketIOServer(("127.0.0.1", 0), echo_events, policy_server=False)
+    started = time.time()
+    clients = [LoopbackTransport(server) for i in range(args.clients)]
+    for client in clients:
+        client.connect()
+    gevent.sleep(0)
+    connect_time = time.time() - started
+
+    per_client = max(1, args.messages // args.clients)
+    pool = gevent.pool.Pool()
+    started = time.time()
+    for client in clients:
+        pool.spawn(run_client, client, per_client)
+    pool.join()
+    elapsed = time.time() - started
+
+    total = per_client * args.clients
+    if args.json:
+        print(json.dumps({"connects_per_s": args.clients / connect_time, "msgs_per_s": total / elapsed}))
+    else:
+        print("clients:       %d (%.0f connects/s)" % (args.clients, args.clients / connect_time))
+        print("round trips:   %d in %.2fs" % (total, elapsed))
+        print("throughput:    %.0f msgs/s" % (total / elapsed))
+    for client in clients:
+        client.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+"""
+Cross-thread push benchmark.
+
+Pushes packets from several OS threads to a room of loopback sessions
+through ``SocketIOServer.push`` and reports pushes per second and how
+many event loop wakeups they took.
+
+Usage::
+
+    python benchmarks/push_throughput.py --threads 4 --pushes 20000 --clients 10
+"""
+
+from __future__ import print_function
+
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import gevent
+
+from socketio import packets
+from socketio.server import SocketIOServer
+from socketio.transports import LoopbackTransport
+
+
+def idle_app(environ, start_response):
+    io = environ["socketio"]
+    while io.receive() is not None:
+        pass
+    return []
+
+
+def run(threads, pushes, clients):
+    server = SocketIOServer(("127.0.0.1", 0), idle_app, policy_server=False)
+    for i in range(clients):
+        session = LoopbackTransport(server).connect()
+        server.join(session, "room")
+    packet = packets.EventPacket(None, None, None, "tick", [1])
+
+    def pusher():
+        for i in range(pushes):
+            server.push(packet, room="room")
+
+    counters = server.metrics.counters
+    workers = [threading.Thread(target=pusher) for i in range(threads)]
+    started = time.time()
+    for worker in workers:
+        worker.start()
+    total = threads * pushes
+    while counters["push.delivered"] < total:
+        gevent.sleep(0.001)
+    elapsed = time.time() - started
+    for worker in workers:
+        worker.join()
+    server.push_queue.close()
+    return {"pushes_per_s": total / elapsed, "wakeups": counters["push.wakeups"]}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--threads", type=int, default=4)
+    parser.add_argument("--pushes", type=int, default=20000, help="pushes per thread")
+    parser.add_argument("--clients", type=int, default=10)
+    parser.add_argument("--json", action="store_true", help="print results as JSON")
+    args = parser.parse_args()
+
+    result = run(args.threads, args.pushes, args.clients)
+    if args.json:
+        print(json.dumps(result))
+    else:
+        print("%.0f pushes/s, %d loop wakeups" % (result["pushes_per_s"], result["wakeups"]))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,54 @@
+"""
+Replay captured production traffic against a local server.
+
+Record traffic by starting the server with ``capture="traffic.cap"``,
+then replay the inbound side of every captured session against an
+application running in this process::
+
+    python benchmarks/replay_capture.py traffic.cap myproject.app:application --speed 4
+
+``--speed`` divides the recorded timing (``0`` sends as fast as
+possible). Latency is measured from each message a client sends to the
+next message the application sends back to it.
+"""
+
+from __future__ import print_function
+
+import argparse
+import importlib
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from socketio.capture import read_capture, replay
+from socketio.server import SocketIOServer
+
+
+def load_application(spec):
+    module, _, name = spec.partition(":")
+    return getattr(importlib.import_module(module), name or "application")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("capture", help="capture file written by the server")
+    parser.add_argument("application", help="WSGI application as module:callable")
+    parser.add_argument("--speed", type=float, default=1.0)
+    args = parser.parse_args()
+
+    server = SocketIOServer(("127.0.0.1", 0), load_application(args.application), policy_server=False)
+    result = replay(server, read_capture(args.capture), speed=args.speed)
+
+    latency = result.latency
+    print("messages sent:     %d" % result.sent)
+    print("messages received: %d" % result.received)
+    print("elapsed:           %.2fs" % result.elapsed)
+    print("throughput:        %.0f msgs/s" % result.throughput)
+    print("latency:           mean %.2fms, max %.2fms" % (latency.mean * 1000, (latency.max or 0) * 1000))
+    for bound, count in latency.snapshot()["buckets"]:
+        print("  %-8s %d" % ("<= %gs" % bound if bound is not None else "more", count))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+"""
+Request routing benchmark.
+
+Routes a mix of request paths (transport requests, handshakes, client
+library and application paths) with the segment trie of
+``socketio.router.Router`` and with the prefix check and regular
+expressions the handler used before, and reports paths per second for
+each.
+
+Usage::
+
+    python benchmarks/routing.py --paths 500000 --resources 4
+"""
+
+from __future__ import print_function
+
+import argparse
+import json
+import os
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from socketio.router import Resource, Router
+
+
+TRANSPORTS = {"websocket": object(), "xhr-polling": object()}
+
+RE_REQUEST_URL = re.compile(r"""
+    ^/(?P<namespace>[^/]+)
+     /(?P<protocol_version>[^/]+)
+     /(?P<transport_id>[^/]+)
+     /(?P<session_id>[^/]+)/?$
+     """, re.X)
+RE_HANDSHAKE_URL = re.compile(r"^/(?P<namespace>[^/]+)/1/$", re.X)
+RE_CLIENT_URL = re.compile(r"^/(?P<namespace>[^/]+)/(?P<filename>socket\.io(\.min)?\.js)$")
+
+
+def regex_route(namespaces, path):
+    """The handler's routing before the router, extended to several namespaces."""
+    request_tokens = RE_REQUEST_URL.match(path)
+    stripped = path.lstrip("/")
+    for namespace in namespaces:
+        if stripped.startswith(namespace):
+            break
+    else:
+        return None
+    client_tokens = RE_CLIENT_URL.match(path)
+    if client_tokens:
+        return client_tokens.groupdict()
+    if request_tokens:
+        tokens = request_tokens.groupdict()
+        tokens["transport"] = TRANSPORTS.get(tokens["transport_id"])
+        return tokens
+    handshake_tokens = RE_HANDSHAKE_URL.match(path)
+    return handshake_tokens.groupdict() if handshake_tokens else None
+
+
+def sample_paths(namespaces):
+    paths = []
+    for namespace in namespaces:
+        for i in range(8):
+            paths.append("/%s/1/xhr-polling/%032x" % (namespace, i))
+            paths.append("/%s/1/websocket/%032x" % (namespace, i))
+        paths.append("/%s/1/" % namespace)
+        paths.append("/%s/socket.io.js" % namespace)
+    paths += ["/", "/index.html", "/static/app.js"]
+    return paths
+
+
+def run(count, resources):
+    namespaces = ["socket.io"] + ["app%d" % i for i in range(1, resources)]
+    router = Router(TRANSPORTS)
+    for namespace in namespaces:
+        router.add(Resource(namespace))
+    paths = sample_paths(namespaces)
+    rounds = max(1, count // len(paths))
+
+    match = router.match
+    started = time.time()
+    for i in range(rounds):
+        for path in paths:
+            match(path)
+    trie_time = time.time() - started
+
+    started = time.time()
+    for i in range(rounds):
+        for path in paths:
+            regex_route(namespaces, path)
+    regex_time = time.time() - started
+
+    total = rounds * len(paths)
+    return {"trie_per_s": total / trie_time, "regex_per_s": total / regex_time}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--paths", type=int, default=500000)
+    parser.add_argument("--resources", type=int, default=4)
+    parser.add_argument("--json", action="store_true", help="print results as JSON")
+    args = parser.parse_args()
+
+    result = run(args.paths, args.resources)
+    if args.json:
+        print(json.dumps(result))
+    else:
+        print("trie:  %.0f paths/s" % result["trie_per_s"])
+        print("regex: %.0f paths/s" % result["regex_per_s"])
+
+
+if __name__ == "__main__":
+    main()
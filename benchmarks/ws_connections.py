@@ -0,0 +1,149 @@
+"""
+Websocket connection scaling benchmark.
+
+Starts an echo server in a child process, opens many websocket
+connections to it and reports, for the server process:
+
+* resident memory per connection,
+* greenlets per connection,
+* greenlet switches per echoed message.
+
+Usage::
+
+    python benchmarks/ws_connections.py --connections 50000 --messages 100000
+
+Large runs need a high open files limit (``ulimit -n``) on both sides.
+Client connections are spread over several 127.0.0.x source addresses to
+stay clear of the ephemeral port range.
+"""
+
+from __future__ import print_function
+
+from gevent import monkey; monkey.patch_all()
+
+import argparse
+import gc
+import json
+import os
+import resource
+import subprocess
+import sys
+import time
+
+import gevent
+import gevent.pool
+import greenlet
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from socketio.server import SocketIOServer
+from socketio.tests.handler import WebSocketClient
+
+
+def _raise_fd_limit():
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+
+
+def _rss_kb():
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1])
+    return 0
+
+
+def serve(port):
+    _raise_fd_limit()
+    switches = [0]
+
+    def trace(event, args):
+        if event == "switch":
+            switches[0] += 1
+
+    greenlet.settrace(trace)
+
+    def app(environ, start_response):
+        io = environ.get("socketio")
+        if io is None:
+            gc.collect()
+            stats = {
+                "rss_kb": _rss_kb(),
+                "greenlets": sum(1 for o in gc.get_objects() if isinstance(o, greenlet.greenlet)),
+                "switches": switches[0],
+            }
+            start_response("200 OK", [("Content-Type", "application/json")])
+            return [json.dumps(stats).encode("ascii")]
+        while True:
+            packet = io.receive()
+            if packet is None:
+                return []
+            io.send_data(packet.data)
+
+    server = SocketIOServer(("127.0.0.1", port), app, policy_server=False, backlog=4096)
+    server.serve_forever()
+
+
+def _stats(port):
+    import urllib2
+    return json.loads(urllib2.urlopen("http://127.0.0.1:%d/stats" % port).read())
+
+
+def _connect(port, index):
+    import urllib2
+    source = "127.0.0.%d" % (2 + index // 20000)
+    body = urllib2.urlopen("http://127.0.0.1:%d/socket.io/1/" % port).read()
+    session_id = body.split(b":")[0].decode("ascii")
+    client = WebSocketClient(port, "/socket.io/1/websocket/%s" % session_id, source=source)
+    client.receive()  # connect packet
+    return client
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--connections", type=int, default=50000)
+    parser.add_argument("--messages", type=int, default=100000)
+    parser.add_argument("--concurrency", type=int, default=500)
+    parser.add_argument("--port", type=int, default=8901)
+    parser.add_argument("--serve", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve:
+        return serve(args.port)
+
+    _raise_fd_limit()
+    child = subprocess.Popen([sys.executable, os.path.abspath(__file__), "--serve", "--port", str(args.port)])
+    try:
+        gevent.sleep(1)
+        base = _stats(args.port)
+
+        pool = gevent.pool.Pool(args.concurrency)
+        started = time.time()
+        clients = pool.map(lambda i: _connect(args.port, i), range(args.connections))
+        connect_time = time.time() - started
+        connected = _stats(args.port)
+
+        started = time.time()
+        for i in range(args.messages):
+            client = clients[i % len(clients)]
+            client.send(b"3:::ping")
+            client.receive()
+        echo_time = time.time() - started
+        echoed = _stats(args.port)
+
+        n = float(args.connections)
+        print("connections:              %d (%.1f/s)" % (args.connections, n / connect_time))
+        print("server RSS per connection: %.1f KiB" % ((connected["rss_kb"] - base["rss_kb"]) / n))
+        print("greenlets per connection:  %.2f" % ((connected["greenlets"] - base["greenlets"]) / n))
+        print("echo round trips:          %d (%.0f/s)" % (args.messages, args.messages / echo_time))
+        print("switches per message:      %.2f" % (
+            (echoed["switches"] - connected["switches"]) / float(args.messages)))
+        for client in clients:
+            client.close()
+    finally:
+        child.terminate()
+        child.wait()
+
+
+if __name__ == "__main__":
+    main()
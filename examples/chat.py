@@ -1,4 +1,5 @@
 from gevent import monkey; monkey.patch_all()
+import os.path
 from socketio import SocketIOServer
 
 
@@ -16,15 +17,13 @@ class Application(object):
             start_response('200 OK', [('Content-Type', 'text/html')])
             return ['<h1>Welcome. Try the <a href="/chat.html">chat</a> example.</h1>']
 
-        if path in ['socket.io.js', 'chat.html', 'stylesheets/style.css']:
+        if path in ['chat.html', 'stylesheets/style.css']:
             try:
                 data = open(path).read()
             except Exception:
                 return not_found(start_response)
 
-            if path.endswith(".js"):
-                content_type = "text/javascript"
-            elif path.endswith(".css"):
+            if path.endswith(".css"):
                 content_type = "text/css"
             else:
                 content_type = "text/html"
@@ -70,4 +69,6 @@ if __name__ == '__main__':
     print "Listening on port 8080"
     import logging
     logging.basicConfig(level=logging.DEBUG)
-    SocketIOServer(('127.0.0.1', 8080), Application(), namespace="socket.io", policy_server=False).serve_forever()
+    # socket.io.js is served by the server itself, from this directory
+    SocketIOServer(('127.0.0.1', 8080), Application(), namespace="socket.io", policy_server=False,
+                   client_dist=os.path.dirname(os.path.abspath(__file__))).serve_forever()
@@ -0,0 +1,179 @@
+"""
+Capture of raw session traffic and its replay for load tests.
+
+A capture file is a sequence of records, each a fixed header followed by
+the raw payload::
+
+    !dIBI  offset in seconds since the capture started, session number,
+           record kind, payload length
+
+Sessions are numbered in the order they first show up; a ``NEW_SESSION``
+record carrying the session id precedes any traffic of a session. Binary
+websocket frames have the ``BINARY`` bit set in their kind. The
+file is only ever appended to, so an interrupted capture stays readable
+up to its last complete record.
+"""
+
+from __future__ import absolute_import, unicode_literals
+
+import struct
+
+import gevent
+import gevent.pool
+
+from socketio import packets
+from socketio.clock import monotonic
+from socketio.metrics import Histogram
+
+
+from logging import getLogger
+logger = getLogger("socketio.capture")
+
+
+NEW_SESSION = 0
+INBOUND = 1
+OUTBOUND = 2
+BINARY = 0x80
+
+RECORD = struct.Struct(b"!dIBI")
+
+
+class CaptureWriter(object):
+    """Appends the traffic of every session to ``path``."""
+
+    def __init__(self, path, clock=monotonic):
+        self.path = path
+        self.clock = clock
+        self.started = clock()
+        self.file = open(path, "ab")
+        self._sessions = {}
+
+    def _session_number(self, session_id):
+        number = self._sessions.get(session_id)
+        if number is None:
+            number = self._sessions[session_id] = len(self._sessions)
+            self._write(number, NEW_SESSION, session_id.encode("ascii"))
+        return number
+
+    def _write(self, number, kind, data):
+        self.file.write(RECORD.pack(self.clock() - self.started, number, kind, len(data)))
+        self.file.write(data)
+
+    def record(self, session, kind, data):
+        """
+        Record ``data`` sent (``OUTBOUND``) or received (``INBOUND``) on
+        ``session``, or'ed with ``BINARY`` for binary frames.
+        """
+        if self.file is None:
+            return
+        if not isinstance(data, (bytes, bytearray)):
+            data = data.encode("utf-8")
+        self._write(self._session_number(session.session_id), kind, bytes(data))
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+
+def read_capture(path):
+    """
+    Yield ``(offset, session_id, kind, data)`` for every record in a
+    capture file, ``session_id`` being the id of the captured session.
+    """
+    sessions = {}
+    with open(path, "rb") as f:
+        while True:
+            header = f.read(RECORD.size)
+            if len(header) < RECORD.size:
+                return
+            offset, number, kind, length = RECORD.unpack(header)
+            data = f.read(length)
+            if len(data) < length:
+                return
+            if kind == NEW_SESSION:
+                sessions[number] = data.decode("ascii")
+            yield offset, sessions[number], kind, data
+
+
+class ReplayResult(object):
+    """Latency and throughput of a replayed capture."""
+
+    def __init__(self):
+        self.latency = Histogram((0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5))
+        self.sent = 0
+        self.received = 0
+        self.elapsed = 0.0
+
+    @property
+    def throughput(self):
+        return (self.sent + self.received) / self.elapsed if self.elapsed else 0.0
+
+
+class _ReplayedSession(object):
+
+    def __init__(self, client, result):
+        self.client = client
+        self.result = result
+        self.pending = []  # send times of messages still waiting for a reply
+
+    def send(self, kind, data):
+        self.pending.append(monotonic())
+        if kind & BINARY:
+            self.client.session.packet_received(packets.MessagePacket.decode_binary(data), len(data))
+        else:
+            self.client.send_raw(data.decode("utf-8"))
+        self.result.sent += 1
+
+    def drain(self):
+        while True:
+            packet = self.client.receive()
+            if packet is None:
+                return
+            self.result.received += 1
+            if self.pending:
+                self.result.latency.observe(monotonic() - self.pending.pop(0))
+
+
+def replay(server, records, speed=1.0, settle=1.0):
+    """
+    Drive the inbound traffic of captured ``records`` (as returned by
+    :func:`read_capture`) against ``server`` through loopback clients,
+    keeping the original timing divided by ``speed``; a ``speed`` of 0
+    sends everything as fast as possible. Sessions are closed once no
+    replies are outstanding, or after ``settle`` more seconds.
+
+    Latency is measured from each inbound message to the next message
+    the application sends to that session.
+    """
+    from socketio.transports import LoopbackTransport
+
+    result = ReplayResult()
+    sessions = {}
+    readers = gevent.pool.Group()
+    started = monotonic()
+    for offset, session_id, kind, data in records:
+        if speed:
+            delay = offset / speed - (monotonic() - started)
+            if delay > 0:
+                gevent.sleep(delay)
+        else:
+            gevent.sleep(0)
+        if kind == NEW_SESSION:
+            client = LoopbackTransport(server)
+            client.connect()
+            replayed = sessions[session_id] = _ReplayedSession(client, result)
+            readers.spawn(replayed.drain)
+        elif kind & ~BINARY == INBOUND and session_id in sessions:
+            replayed = sessions[session_id]
+            if replayed.client.session.connected:
+                replayed.send(kind, data)
+    deadline = monotonic() + settle
+    while monotonic() < deadline and any(r.pending for r in sessions.values()):
+        gevent.sleep(0.001)
+    for replayed in sessions.values():
+        replayed.client.close()
+    readers.join()
+    result.elapsed = monotonic() - started
+    return result
+
@@ -0,0 +1,68 @@
+"""
+Clocks used for session liveness and timing measurements.
+"""
+
+from __future__ import absolute_import, unicode_literals
+
+import sys
+import time
+
+import gevent
+
+
+def _posix_monotonic():
+    import ctypes
+    import ctypes.util
+
+    class timespec(ctypes.Structure):
+        _fields_ = [("tv_sec", ctypes.c_long), ("tv_nsec", ctypes.c_long)]
+
+    libc = ctypes.CDLL(ctypes.util.find_library("rt") or ctypes.util.find_library("c"), use_errno=True)
+    clock_gettime = libc.clock_gettime
+    clock_gettime.argtypes = [ctypes.c_int, ctypes.POINTER(timespec)]
+    clock_id = 6 if sys.platform == "darwin" else 1  # CLOCK_MONOTONIC
+    ts = timespec()
+
+    def monotonic():
+        if clock_gettime(clock_id, ctypes.byref(ts)) != 0:
+            raise OSError(ctypes.get_errno(), "clock_gettime failed")
+        return ts.tv_sec + ts.tv_nsec * 1e-9
+
+    monotonic()  # fail early if the clock is unusable
+    return monotonic
+
+try:
+    monotonic = time.monotonic
+except AttributeError:
+    try:
+        monotonic = _posix_monotonic()
+    except (OSError, AttributeError, TypeError):
+        monotonic = time.time
+
+
+class CoarseClock(object):
+    """
+    Monotonic clock cached for the duration of one event loop iteration.
+
+    The first :meth:`now` call in an iteration reads ``source`` and schedules
+    a callback that drops the cached value, so any number of calls made while
+    handling the same batch of events costs a single system call.
+    """
+
+    def __init__(self, source=monotonic):
+        self.source = source
+        self._now = None
+
+    def now(self):
+        if self._now is None:
+            self._now = self.source()
+            gevent.get_hub().loop.run_callback(self._reset)
+        return self._now
+
+    def _reset(self):
+        self._now = None
+
+    def precise(self):
+        """Read the underlying clock, bypassing the cache."""
+        return self.source()
+
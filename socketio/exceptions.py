@@ -8,3 +8,24 @@ class DecodeError(Exception):
     """
     Raised when received data cannot be decoded by Socket.IO protocol.
     """
+
+
+class OffloadQueueFull(Exception):
+    """
+    Raised when work is submitted to a server's offload pool that already
+    has ``offload_queue_limit`` calls pending.
+    """
+
+
+class PacketConflated(Exception):
+    """
+    Set on the ack result of a packet that was replaced by a newer packet
+    with the same conflation key before it was sent.
+    """
+
+
+class PacketTooLarge(Exception):
+    """
+    Raised while reading a websocket message or request body that exceeds
+    the server's ``max_packet_size`` or ``max_payload_size``.
+    """
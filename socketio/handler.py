@@ -1,11 +1,11 @@
 from __future__ import absolute_import, unicode_literals
 
 import sys
-import re
 import gevent
 import urlparse
 
-from socketio import transports, protocol
+from socketio import transports, protocol, packets
+from socketio.router import HANDSHAKE, CLIENT
 from geventwebsocket.handler import WebSocketHandler
 
 
@@ -19,14 +19,6 @@ class SessionGreenlet(gevent.Greenlet):
 
 
 class SocketIOHandler(WebSocketHandler):
-    RE_REQUEST_URL = re.compile(r"""
-        ^/(?P<namespace>[^/]+)
-         /(?P<protocol_version>[^/]+)
-         /(?P<transport_id>[^/]+)
-         /(?P<session_id>[^/]+)/?$
-         """, re.X)
-    RE_HANDSHAKE_URL = re.compile(r"^/(?P<namespace>[^/]+)/1/$", re.X)
-
     handler_types = {
         'websocket': transports.WebsocketTransport,
         #'htmlfile': transports.HTMLFileTransport,
@@ -37,38 +29,77 @@ class SocketIOHandler(WebSocketHandler):
 
     def __init__(self, socket, addr, server, *args, **kwargs):
         self.allowed_paths = None
+        self.resource = None  # the socket.io resource the request is for
         super(SocketIOHandler, self).__init__(socket, addr, server, *args, **kwargs)
 
-    def _do_handshake(self, tokens):
-        if tokens["namespace"] != self.server.namespace:
-            self.log_error("Namespace mismatch")
+    def start_response(self, status, headers, exc_info=None):
+        # gevent >= 1.0 requires native strings in the status and headers
+        status = str(status)
+        headers = [(str(name), str(value)) for name, value in headers]
+        return super(SocketIOHandler, self).start_response(status, headers, exc_info)
+
+    def _do_handshake(self):
+        if self.server.draining:
+            self.write_smart("Server is shutting down", "503 Service Unavailable")
         else:
-            session = self.server.create_session(self.environ)
+            retry_after = self.server.admit_handshake()
+            if retry_after is not None:
+                self.write_smart("Too many connections", "503 Service Unavailable",
+                                 [("Retry-After", bytes(retry_after))])
+                return
+            session = self.server.create_session(self.environ, self.resource)
             self.write_smart(session.handshake_string())
 
+    def _serve_client(self, filename):
+        """
+        Serve the socket.io client library from memory, without calling
+        the WSGI application.
+        """
+        static = self.server.client_file(filename)
+        if static is None:
+            return WSGIHandler.handle_one_response(self)
+        status, headers, body = static.serve(self.environ)
+        self.start_response(status, headers)
+        self.result = [body]
+        self.process_result()
+
+    def _reject_unknown_session(self, session_id):
+        """
+        Cheap answer for a request with an unknown or expired session ID:
+        an error packet advising the client to reconnect, plus a backoff
+        hint so that a wave of such clients does not retry in lockstep.
+        """
+        logger.debug("Rejecting request for unknown session %r", session_id)
+        self.server.metrics.incr("session.unknown_rejected")
+        error = packets.ErrorPacket(None, None, None, "client not handshaken", "reconnect")
+        self.write_smart(error.encode(), headers=[("Retry-After", bytes(self.server.reconnect_backoff()))])
+
     def write_jsonp_result(self, data, wrapper="0"):
         self.start_response("200 OK", [
             ("Content-Type", "application/javascript"),
         ])
         self.result = ['io.j[%s]("%s");' % (wrapper, data)]
 
-    def write_plain_result(self, data):
-        headers = [("Content-Type", "text/plain")]
-        if self.server.cors_domain:
+    def write_plain_result(self, data, status="200 OK", headers=()):
+        headers = [("Content-Type", "text/plain")] + list(headers)
+        cors = self.server.cors_domain
+        if self.resource is not None and self.resource.cors is not None:
+            cors = self.resource.cors
+        if cors:
             headers += [
-                ("Access-Control-Allow-Origin", self.server.cors_domain),
+                ("Access-Control-Allow-Origin", cors),
                 ("Access-Control-Allow-Credentials", "true"),
             ]
-        self.start_response("200 OK", headers)
+        self.start_response(status, headers)
         self.result = [data]
 
-    def write_smart(self, data):
+    def write_smart(self, data, status="200 OK", headers=()):
         args = urlparse.parse_qs(self.environ.get("QUERY_STRING"))
 
         if "jsonp" in args:
             self.write_jsonp_result(data, args["jsonp"][0])
         else:
-            self.write_plain_result(data)
+            self.write_plain_result(data, status, headers)
 
         self.process_result()
 
@@ -83,59 +114,52 @@ class SocketIOHandler(WebSocketHandler):
 
         logger.info("REQUEST: %s @ %s", self.environ["SERVER_PORT"], path)
         request_method = self.environ.get("REQUEST_METHOD")
-        request_tokens = self.RE_REQUEST_URL.match(path)
 
         # Kick non-socket.io requests to our superclass
-        if not path.lstrip('/').startswith(self.server.namespace):
+        route = self.server.router.match(path)
+        if route is None:
             return WSGIHandler.handle_one_response(self)
 
-        # Parse request URL and QUERY_STRING and do handshake
-        if request_tokens:
-            request_tokens = request_tokens.groupdict()
-        else:
-            handshake_tokens = self.RE_HANDSHAKE_URL.match(path)
-
-            if handshake_tokens:
-                return self._do_handshake(handshake_tokens.groupdict())
-            else:
-                # This is no socket.io request. Let the WSGI app handle it.
-                return WSGIHandler.handle_one_response(self)
+        self.resource = route.resource
+        if route.kind is CLIENT:
+            return self._serve_client(route.filename)
+        if route.kind is HANDSHAKE:
+            return self._do_handshake()
 
         # Setup the transport and session
-        transport = self.handler_types.get(request_tokens["transport_id"])
-        session_id = request_tokens["session_id"]
-        session = self.server.get_session(session_id)
+        transport = route.transport
+        session_id = route.session_id
+        session = self.server.get_session(session_id, route.resource)
+        if session is None:
+            return self._reject_unknown_session(session_id)
         logger.debug("Handshake for session %r, transport %r", session.session_id, transport)
 
         # Make the session object available for WSGI apps
         self.environ['socketio'] = protocol.PySocketProtocol(session)
 
         if transport is transports.WebsocketTransport:
-            # fake application
-            try:
-                _tmp, self.application = self.application, lambda *args: None
-                logger.debug("Initializing websocket.")
-                WebSocketHandler.handle_one_response(self)
-            finally:
-                self.application = _tmp
-
-        # Create a transport and handle the request likewise
-        logger.debug("Connecting transport: %r", transport)
-        transport(self).connect(session, request_method)
-
-        if session.wsgi_app_greenlet is not None:
-            if not session.wsgi_app_greenlet:
-                logger.debug("Joining finalized greenlet %r -> %r", self, session.wsgi_app_greenlet)
-                session.wsgi_app_greenlet.join()
-                session.wsgi_app_greenlet = None
-
-        if not session.wsgi_app_greenlet:
+            # upgrade the connection, but don't let WebSocketHandler run the app
+            logger.debug("Initializing websocket.")
+            self.prevent_wsgi_call = True
+            WebSocketHandler.run_application(self)
+            if self.environ.get('wsgi.websocket') is None:
+                logger.debug("Websocket upgrade failed for session %r", session)
+                if session.transport == "xhr-polling":
+                    self.server.metrics.incr("upgrade.attempted")
+                    self.server.metrics.incr("upgrade.failed")
+                return
+
+        # The application runs once per session, in its own greenlet
+        if session.wsgi_app_greenlet is None:
             start_response = lambda status, headers, exc = None: None
             logger.debug("Spawning new greenlet for session: %r", session)
-            session_greenlet = SessionGreenlet.spawn(self.application, self.environ, start_response)
-            session_greenlet.join()
-            logger.debug("Session greenlet joined: %r", session)
-            del session
+            application = self.resource.application or self.application
+            session.wsgi_app_greenlet = SessionGreenlet.spawn(application, self.environ, start_response)
+
+        # Create a transport and handle the request likewise; the websocket
+        # transport serves the connection from this greenlet until it closes
+        logger.debug("Connecting transport: %r", transport)
+        transport(self).connect(session, request_method)
 
     def handle_bad_request(self):
         self.close_connection = True
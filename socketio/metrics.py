@@ -0,0 +1,74 @@
+"""
+Lightweight in-process metrics for the Socket.IO server.
+"""
+
+from __future__ import absolute_import, unicode_literals
+
+import bisect
+
+from collections import defaultdict
+
+
+class Histogram(object):
+    """
+    Fixed-bucket histogram. Buckets are upper bounds; values larger than
+    the last bucket are counted in the overflow slot.
+    """
+
+    DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+    def __init__(self, buckets=None):
+        self.buckets = tuple(buckets or self.DEFAULT_BUCKETS)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = None
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.total += value
+        if self.max is None or value > self.max:
+            self.max = value
+
+    @property
+    def mean(self):
+        return self.total / self.count if self.count else 0.0
+
+    def snapshot(self):
+        return {
+            "buckets": list(zip(self.buckets + (None,), self.counts)),
+            "count": self.count,
+            "mean": self.mean,
+            "max": self.max,
+        }
+
+
+class Metrics(object):
+    """
+    Registry of counters, gauges and histograms kept by a server.
+    """
+
+    def __init__(self):
+        self.counters = defaultdict(int)
+        self.gauges = {}
+        self.histograms = {}
+
+    def incr(self, name, value=1):
+        self.counters[name] += value
+
+    def gauge(self, name, value):
+        self.gauges[name] = value
+
+    def observe(self, name, value, buckets=None):
+        histogram = self.histograms.get(name)
+        if histogram is None:
+            histogram = self.histograms[name] = Histogram(buckets)
+        histogram.observe(value)
+
+    def snapshot(self):
+        return {
+            "counters": dict(self.counters),
+            "gauges": dict(self.gauges),
+            "histograms": dict((k, v.snapshot()) for k, v in self.histograms.items()),
+        }
@@ -0,0 +1,130 @@
+"""
+Event loop lag monitoring and load shedding.
+"""
+
+from __future__ import absolute_import, unicode_literals
+
+import bisect
+import sys
+import traceback
+
+import gevent
+import greenlet
+
+from socketio.clock import monotonic
+
+
+from logging import getLogger
+logger = getLogger("socketio.monitor")
+
+
+# shedding stages, each one including the ones before it
+SHED_NONE = 0
+SHED_HANDSHAKES = 1  # refuse new handshakes
+SHED_VOLATILE = 2  # drop volatile packets
+SHED_POLLS = 3  # hold back polling requests
+
+STAGE_NAMES = ("none", "handshakes", "volatile", "polls")
+
+
+class LagMonitor(object):
+    """
+    Measures how late the hub wakes up a greenlet sleeping ``interval``
+    seconds. Every sample goes to the ``loop.lag`` histogram and moves the
+    shedding :attr:`stage`: it rises as soon as the lag crosses the
+    corresponding entry of ``thresholds``, and falls one stage at a time
+    after ``recovery`` consecutive samples below it.
+
+    With ``trace``, every greenlet switch is timed, and a greenlet that ran
+    ``stall_threshold`` seconds or more without yielding is logged with
+    the stack it yielded from.
+    """
+
+    def __init__(self, metrics, interval=0.05, thresholds=(0.05, 0.1, 0.25), recovery=20,
+                 stall_threshold=0.1, trace=True, poll_delay=1.0, clock=monotonic):
+        assert len(thresholds) == len(STAGE_NAMES) - 1, "one threshold per shedding stage"
+        self.metrics = metrics
+        self.interval = interval
+        self.thresholds = tuple(thresholds)
+        self.recovery = recovery
+        self.stall_threshold = stall_threshold
+        self.trace = trace
+        self.shed_poll_delay = poll_delay
+        self.clock = clock
+        self.stage = SHED_NONE
+        self.lag = 0.0
+        self._calm = 0  # samples in a row below the current stage
+        self._greenlet = None
+        self._previous_trace = None
+        self._switched_at = None
+
+    @property
+    def poll_delay(self):
+        """Seconds to hold back a polling request before serving it."""
+        return self.shed_poll_delay if self.stage >= SHED_POLLS else 0
+
+    def start(self):
+        if self._greenlet is not None:
+            return
+        if self.trace:
+            self._switched_at = self.clock()
+            self._previous_trace = greenlet.settrace(self._trace)
+        self._greenlet = gevent.spawn(self._run)
+
+    def stop(self):
+        if self._greenlet is None:
+            return
+        if self.trace and greenlet.gettrace() == self._trace:
+            greenlet.settrace(self._previous_trace)
+        self._previous_trace = None
+        self._greenlet.kill(block=False)
+        self._greenlet = None
+
+    def _run(self):
+        while True:
+            expected = self.clock() + self.interval
+            gevent.sleep(self.interval)
+            self.observe(max(self.clock() - expected, 0.0))
+
+    def observe(self, lag):
+        """Record one lag sample and update the shedding stage."""
+        self.lag = lag
+        self.metrics.observe("loop.lag", lag)
+        stage = bisect.bisect_right(self.thresholds, lag)
+        if stage > self.stage:
+            self._set_stage(stage)
+        elif stage < self.stage:
+            self._calm += 1
+            if self._calm >= self.recovery:
+                self._set_stage(self.stage - 1)
+        else:
+            self._calm = 0
+
+    def _set_stage(self, stage):
+        if stage > self.stage:
+            logger.warning("Event loop lag %.3fs, shedding %s", self.lag, STAGE_NAMES[stage])
+            self.metrics.incr("loop.shed.%s" % STAGE_NAMES[stage])
+        else:
+            logger.info("Event loop lag recovered, shedding %s", STAGE_NAMES[stage])
+        self.stage = stage
+        self._calm = 0
+        self.metrics.gauge("loop.shed_stage", stage)
+
+    def _trace(self, event, args):
+        if event in ("switch", "throw"):
+            now = self.clock()
+            ran = now - self._switched_at
+            if ran >= self.stall_threshold:
+                self._stalled(args[0], ran)
+                now = self.clock()  # don't count the logging against the next greenlet
+            self._switched_at = now
+        if self._previous_trace is not None:
+            self._previous_trace(event, args)
+
+    def _stalled(self, origin, duration):
+        self.metrics.incr("loop.stalls")
+        self.metrics.observe("loop.stall", duration)
+        # by the time the trace function runs, the origin is suspended
+        frame = getattr(origin, "gr_frame", None) or sys._getframe(2)
+        stack = "".join(traceback.format_stack(frame, limit=8))
+        logger.warning("%r ran %.3fs without yielding, until:\n%s", origin, duration, stack)
@@ -0,0 +1,88 @@
+"""
+Offloading of CPU-bound work out of session greenlets.
+"""
+
+from __future__ import absolute_import, unicode_literals
+
+from gevent.threadpool import ThreadPool
+from socketio.clock import monotonic
+from socketio.exceptions import OffloadQueueFull
+
+from logging import getLogger
+logger = getLogger("socketio.offload")
+
+
+class OffloadExecutor(object):
+    """
+    Runs callables in a pool of OS threads or processes. The calling
+    greenlet blocks, but the hub keeps serving other connections until
+    the result is ready.
+
+    ``mode`` is either ``"thread"`` or ``"process"``. In process mode the
+    callable and its arguments must be picklable. ``queue_limit`` caps the
+    number of submitted, not yet finished calls; ``None`` means no limit.
+    """
+
+    MODES = ("thread", "process")
+
+    def __init__(self, size=4, queue_limit=None, mode="thread", metrics=None, clock=None):
+        if mode not in self.MODES:
+            raise ValueError("Unknown offload mode: %r" % mode)
+        self.size = size
+        self.queue_limit = queue_limit
+        self.mode = mode
+        self.metrics = metrics
+        self._timer = clock.precise if clock is not None else monotonic
+        self.pending = 0
+        self._threads = ThreadPool(size)
+        self._processes = None
+
+    def _process_pool(self):
+        if self._processes is None:
+            import multiprocessing
+            self._processes = multiprocessing.Pool(self.size)
+        return self._processes
+
+    def _record(self, name, value=1):
+        if self.metrics is not None:
+            self.metrics.incr(name, value)
+
+    def _update_gauges(self):
+        if self.metrics is not None:
+            self.metrics.gauge("offload.pending", self.pending)
+            self.metrics.gauge("offload.utilization", min(self.pending, self.size) / float(self.size))
+
+    def apply(self, func, *args, **kwargs):
+        """
+        Run ``func(*args, **kwargs)`` in the pool and return its result.
+        Exceptions raised by ``func`` are re-raised in the caller.
+        """
+        if self.queue_limit is not None and self.pending >= self.queue_limit:
+            self._record("offload.rejected")
+            raise OffloadQueueFull("Offload queue is full (%d pending)" % self.pending)
+
+        self.pending += 1
+        self._record("offload.submitted")
+        self._update_gauges()
+        started = self._timer()
+        try:
+            if self.mode == "process":
+                result = self._threads.apply(self._process_pool().apply, (func, args, kwargs))
+            else:
+                result = self._threads.apply(func, args, kwargs)
+        except Exception:
+            self._record("offload.failed")
+            raise
+        finally:
+            self.pending -= 1
+            self._update_gauges()
+            if self.metrics is not None:
+                self.metrics.observe("offload.duration", self._timer() - started)
+        self._record("offload.completed")
+        return result
+
+    def close(self):
+        self._threads.kill()
+        if self._processes is not None:
+            self._processes.terminate()
+            self._processes = None
@@ -9,27 +9,19 @@ from socketio.exceptions import DecodeError
 import urllib
 
 
-class NamedInt(int):
-    __slots__ = ("description")
-
-    def __new__(self, value, description):
-        x = int.__new__(self, value)
-        x.description = description
-        return x
-
-    def __repr__(self):
-        return "<{0} = 0>".format(self.description)
-
-    def __eq__(self, other):
-        if isinstance(other, basestring):
-            return self.description == other
-        return int.__eq__(self, other)
-
 BASE_FIELDS = ("id", "ack", "endpoint")
 
 
 class Packet(object):
+    """
+    Base of all packet types. Every concrete type sets ``TYPE``, its number
+    on the wire, and ``KIND``, its name; both are plain class attributes so
+    that encoding and dispatching on them stays cheap (and constant for
+    PyPy's JIT).
+    """
     __slots__ = ()
+    TYPE = None
+    KIND = None
     _PACKET_RE = re.compile(br"^(?P<type>\d{1,3}):(?P<id>[0-9]+)?(?P<ack>[+])?:(?P<endpoint>[^:]+)?:?(?P<data>.+)?$", re.DOTALL)
 
     @classmethod
@@ -50,35 +42,40 @@ class Packet(object):
         m = cls._PACKET_RE.match(rawdata)
         if m is None:
             raise DecodeError("Malformed packet {0!r}".format(rawdata))
-        data = m.groupdict()
-        type_ = int(data.pop("type"))
-        try:
-            packet_cls = PACKET_TYPES[type_]
-        except IndexError:
+        type_, id, ack, endpoint, data = m.groups()
+        type_ = int(type_)
+        if type_ >= len(PACKET_TYPES):
             raise DecodeError("Unknown packet type: %d" % type_)
-        return packet_cls.from_data(**data)
+        return PACKET_TYPES[type_].from_data(id, ack, endpoint, data)
 
     def encode(self):
-        parts = []
-        parts.append(bytes(PACKET_TYPES.index(type(self))))
-        parts.append(bytes(self.id or b'') + ('+' if self.ack == "data" else b''))
-        parts.append(self.endpoint)
+        id_ = bytes(self.id) if self.id else b''
+        if self.ack == "data":
+            id_ += b'+'
+        endpoint = bytes(self.endpoint) if self.endpoint else b''
         data = self._encoded_data()
-        if data is not None:
-            parts.append(data)
-        return b":".join(bytes(x) if x else b'' for x in parts)
+        if data is None:
+            return b":".join((bytes(self.TYPE), id_, endpoint))
+        return b":".join((bytes(self.TYPE), id_, endpoint, bytes(data) if data else b''))
 
     def _encoded_data(self):
         return None
 
     @property
     def kind(self):
-        return NAME_FOR_PACKET[type(self)]
+        return self.KIND
+
+    @staticmethod
+    def _header(id, ack, endpoint):
+        """Convert the decoded ``id``, ``ack`` and ``endpoint`` fields."""
+        return (id, ("data" if ack else True) if id else None,
+                endpoint.decode('utf-8') if endpoint else None)
 
     @classmethod
-    def from_data(cls, id, ack, endpoint, *args, **kwargs):
-        return cls(id, ("data" if ack else True) if id else None,
-                   endpoint.decode('utf-8') if endpoint else None, *args)
+    def from_data(cls, id, ack, endpoint, data):
+        """Build a packet from the raw fields matched by :meth:`decode`."""
+        id, ack, endpoint = cls._header(id, ack, endpoint)
+        return cls(id, ack, endpoint)
 
     @staticmethod
     def _plus_split(data):
@@ -108,12 +105,14 @@ class Packet(object):
 
 class ErrorPacket(Packet, namedtuple("_ErrorPacket", BASE_FIELDS + ("reason", "advice"))):
     __slots__ = ()
+    TYPE, KIND = 7, "error"
 
     # Error reasons
     REASONS = [
         "transport not supported",
         "client not handshaken",
         "unauthorized",
+        "packet too large",
     ]
 
     ADVICES = [
@@ -128,12 +127,16 @@ class ErrorPacket(Packet, namedtuple("_ErrorPacket", BASE_FIELDS + ("reason", "a
             advice = cls.ADVICES[int(advice)] if advice else ''
         else:
             reason, advice = '', ''
-        return super(ErrorPacket, cls).from_data(id, ack, endpoint, reason, advice)
+        id, ack, endpoint = cls._header(id, ack, endpoint)
+        return cls(id, ack, endpoint, reason, advice)
 
     def _encoded_data(self):
         reason = self.REASONS.index(self.reason) if self.reason else None
         advice = self.ADVICES.index(self.advice) if self.advice else None
-        return b'+'.join(bytes(x) for x in (reason, advice) if x is not None) or None
+        if advice is None:
+            return bytes(reason) if reason is not None else None
+        # "+0" alone: without the plus the advice would be read as a reason
+        return (bytes(reason) if reason is not None else b'') + b'+' + bytes(advice)
 
 
 class DataPacket(Packet, namedtuple("_DataPacket", BASE_FIELDS + ("data",))):
@@ -141,11 +144,13 @@ class DataPacket(Packet, namedtuple("_DataPacket", BASE_FIELDS + ("data",))):
 
     @classmethod
     def from_data(cls, id, ack, endpoint, data):
-        return super(DataPacket, cls).from_data(id, ack, endpoint, cls._parse_data(data))
+        id, ack, endpoint = cls._header(id, ack, endpoint)
+        return cls(id, ack, endpoint, cls._parse_data(data))
 
 
 class JSONPacket(DataPacket):
     __slots__ = ()
+    TYPE, KIND = 4, "json"
 
     @classmethod
     def _parse_data(cls, data):
@@ -156,6 +161,7 @@ class JSONPacket(DataPacket):
 
 class MessagePacket(DataPacket):
     __slots__ = ()
+    TYPE, KIND = 3, "message"
 
     @classmethod
     def _parse_data(cls, data):
@@ -164,13 +170,44 @@ class MessagePacket(DataPacket):
     def _encoded_data(self):
         return self.data
 
+    def encode_binary(self):
+        """
+        Encode the packet for a binary websocket frame: the usual
+        ``3:{id}:{endpoint}:`` header followed by the raw payload bytes,
+        which are never decoded or escaped.
+        """
+        header = b":".join((b"3", bytes(self.id or b'') + (b'+' if self.ack == "data" else b''),
+                            (self.endpoint or '').encode('utf-8'), b''))
+        return header + bytes(self.data)
+
+    @classmethod
+    def decode_binary(cls, rawdata):
+        """
+        Decode a binary websocket frame produced by :meth:`encode_binary`.
+        The payload is returned as ``bytes``.
+        """
+        type_end = rawdata.find(b":")
+        id_end = rawdata.find(b":", type_end + 1)
+        endpoint_end = rawdata.find(b":", id_end + 1)
+        if type_end < 0 or id_end < 0 or endpoint_end < 0 or bytes(rawdata[:type_end]) != b"3":
+            raise DecodeError("Malformed binary packet {0!r}".format(bytes(rawdata[:64])))
+        id_ = bytes(rawdata[type_end + 1:id_end])
+        ack = id_.endswith(b"+")
+        if ack:
+            id_ = id_[:-1]
+        endpoint = bytes(rawdata[id_end + 1:endpoint_end])
+        data = memoryview(rawdata)[endpoint_end + 1:].tobytes()
+        return cls.from_data(id_ or None, ack or None, endpoint or None, data)
+
 class ConnectPacket(Packet, namedtuple("_ConnectPacket", BASE_FIELDS + ("qs",))):
     __slots__ = ()
+    TYPE, KIND = 1, "connect"
 
     @classmethod
     def from_data(cls, id, ack, endpoint, data):
         qs = urlparse.parse_qs(data.decode('utf-8')[1:]) if data else {}
-        return super(ConnectPacket, cls).from_data(id, ack, endpoint, qs)
+        id, ack, endpoint = cls._header(id, ack, endpoint)
+        return cls(id, ack, endpoint, qs)
 
     def _encoded_data(self):
         if not self.qs:
@@ -180,6 +217,7 @@ class ConnectPacket(Packet, namedtuple("_ConnectPacket", BASE_FIELDS + ("qs",)))
 
 class AckPacket(Packet, namedtuple("_AckPacket", BASE_FIELDS + ("ackid", "args"))):
     __slots__ = ()
+    TYPE, KIND = 6, "ack"
 
     @classmethod
     def from_data(cls, id, ack, endpoint, data):
@@ -188,7 +226,8 @@ class AckPacket(Packet, namedtuple("_AckPacket", BASE_FIELDS + ("ackid", "args")
             args = cls._load_json(args)
         else:
             args = []
-        return super(AckPacket, cls).from_data(id, ack, endpoint, ackid, args)
+        id, ack, endpoint = cls._header(id, ack, endpoint)
+        return cls(id, ack, endpoint, ackid, args)
 
     def _encoded_data(self):
         data = bytes(self.ackid)
@@ -199,10 +238,12 @@ class AckPacket(Packet, namedtuple("_AckPacket", BASE_FIELDS + ("ackid", "args")
 
 class EventPacket(Packet, namedtuple("_EventPacket", BASE_FIELDS + ("name", "args"))):
     __slots__ = ()
+    TYPE, KIND = 5, "event"
 
     @classmethod
     def from_data(cls, id, ack, endpoint, data):
         event_data = cls._load_json(data)
+        id, ack, endpoint = cls._header(id, ack, endpoint)
         return cls(id, ack, endpoint, event_data["name"], event_data.get("args", []))
 
     def _encoded_data(self):
@@ -218,14 +259,17 @@ _SimplePacket = namedtuple("_SimplePacket", BASE_FIELDS)
 
 class DisconnectPacket(Packet, _SimplePacket):
     __slots__ = ()
+    TYPE, KIND = 0, "disconnect"
 
 
 class HeartbeatPacket(Packet, _SimplePacket):
     __slots__ = ()
+    TYPE, KIND = 2, "heartbeat"
 
 
 class NoopPacket(Packet, _SimplePacket):
     __slots__ = ()
+    TYPE, KIND = 8, "noop"
 
 
 PACKET_TYPES = (
@@ -240,5 +284,7 @@ PACKET_TYPES = (
     NoopPacket,
 )
 
-PACKET_BY_NAME = dict((cls.__name__[:-6].lower(), cls) for cls in PACKET_TYPES)
-NAME_FOR_PACKET = dict((cls, cls.__name__[:-6].lower()) for cls in PACKET_TYPES)
+assert all(cls.TYPE == i for i, cls in enumerate(PACKET_TYPES))
+
+PACKET_BY_NAME = dict((cls.KIND, cls) for cls in PACKET_TYPES)
+NAME_FOR_PACKET = dict((cls, cls.KIND) for cls in PACKET_TYPES)
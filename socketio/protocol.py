@@ -17,11 +17,13 @@ class PySocketProtocol(object):
     def session(self):
         return self._session
 
-    def send(self, packet):
+    def send(self, packet, priority=None, conflate=None, volatile=False):
         """
-        Send a prepared packet.
+        Send a prepared packet. See :meth:`emit` for the keyword arguments.
         """
-        return self._session.send(packet)
+        if conflate is not None:
+            conflate = (packet.endpoint, conflate)
+        return self._session.send(packet, priority=priority, conflate=conflate, volatile=volatile)
 
     def ack(self, packet, *args):
         """
@@ -29,9 +31,48 @@ class PySocketProtocol(object):
         """
         return self._session.ack(packet, *args)
 
+    @property
+    def rtt(self):
+        """
+        Smoothed round-trip time to the client in seconds, measured with
+        heartbeats, or ``None`` before the first heartbeat reply. Heartbeats
+        are skipped while other packets flow, so on a busy session this can
+        be as old as the last quiet period.
+        """
+        return self._session.rtt
+
+    @property
+    def endpoint(self):
+        return self._endpoint
+
+    def of(self, endpoint):
+        """
+        Return a protocol object bound to another endpoint (namespace) of
+        the same session. From then on the endpoint's packets go to its
+        :meth:`receive` and client connections to it are confirmed.
+        """
+        if not self._session.closed:
+            self._session.endpoint_queue(endpoint)
+        return type(self)(self._session, endpoint)
+
+    def join(self, room):
+        """Join ``room``, so packets pushed to it reach this session."""
+        self._session.server.join(self._session, room)
+
+    def leave(self, room):
+        self._session.server.leave(self._session, room)
+
     def receive(self, timeout=None):
-        """Wait for incoming messages."""
-        return self._session.receive(timeout=timeout)
+        """Wait for incoming messages sent to this protocol's endpoint."""
+        return self._session.receive(self._endpoint, timeout=timeout)
+
+    def offload(self, func, *args, **kwargs):
+        """
+        Run a CPU-bound ``func(*args, **kwargs)`` in the server's offload
+        pool. The calling greenlet waits for the result while other sessions
+        keep being served.
+        """
+        return self._session.server.offload(func, *args, **kwargs)
 
     def _base_args(self, need_ack):
         if not need_ack:
@@ -39,17 +80,33 @@ class PySocketProtocol(object):
         else:
             return self.session.packet_id(), "data", self._endpoint
 
-    def emit(self, event, args=None, ack=False):
-        """Emit an event."""
-        return self.send(packets.EventPacket(*self._base_args(ack) + (event, args)))
+    def emit(self, event, args=None, ack=False, priority=None, conflate=None, volatile=False):
+        """
+        Emit an event.
+
+        ``priority`` selects the outbound queue level: ``PRIORITY_CONTROL``,
+        ``PRIORITY_NORMAL`` (the default) or ``PRIORITY_LOW`` from
+        :mod:`socketio.queues`.
+
+        With a ``conflate`` key, the packet replaces one with the same key
+        on this endpoint that is still waiting to be sent, so slow clients
+        only get the latest value. It takes over the replaced packet's
+        position and priority, and waiting for the replaced packet's ack
+        raises :class:`socketio.exceptions.PacketConflated`. ``volatile`` packets are dropped unless
+        the client can receive them right away.
+        """
+        return self.send(packets.EventPacket(*self._base_args(ack) + (event, args)),
+                         priority, conflate, volatile)
 
-    def send_data(self, data, ack=False):
+    def send_data(self, data, ack=False, priority=None, conflate=None, volatile=False):
         """Sends data to the client."""
-        return self.send(packets.MessagePacket(*self._base_args(ack) + (data,)))
+        return self.send(packets.MessagePacket(*self._base_args(ack) + (data,)),
+                         priority, conflate, volatile)
 
-    def send_json(self, json, ack=False):
+    def send_json(self, json, ack=False, priority=None, conflate=None, volatile=False):
         """Send raw JSON to the client."""
-        return self.send(packets.JSONPacket(*self._base_args(ack) + (json,)))
+        return self.send(packets.JSONPacket(*self._base_args(ack) + (json,)),
+                         priority, conflate, volatile)
 
     def disconnect(self, reason="booted"):
         return self.send(packets.DisconnectPacket(None, None, self._endpoint))
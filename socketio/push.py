@@ -0,0 +1,99 @@
+"""
+Delivery of packets pushed from threads other than the hub's.
+"""
+
+from __future__ import absolute_import, unicode_literals
+
+from collections import deque
+
+import gevent
+
+
+from logging import getLogger
+logger = getLogger("socketio.push")
+
+
+class PushQueue(object):
+    """
+    Packets pushed from any thread to a session, a room or every session
+    of ``server``.
+
+    Pushes are appended to a deque, whose ``append`` and ``popleft`` are
+    atomic, so pushing threads never take a lock or touch gevent objects.
+    Only the push that finds no wakeup pending signals the hub's async
+    watcher; a greenlet then delivers everything queued by then, yielding
+    every ``batch`` packets. Many pushes thus cost a few loop wakeups.
+
+    Must be created in the hub's thread.
+    """
+
+    def __init__(self, server, batch=256):
+        self.server = server
+        self.batch = batch
+        self._requests = deque()
+        self._wakeup_pending = False
+        self._drainer = None
+        loop = gevent.get_hub().loop
+        self._watcher = (getattr(loop, "async_", None) or getattr(loop, "async"))()  # renamed in gevent 1.3
+        self._watcher.ref = False  # pushes alone don't keep the loop running
+        self._watcher.start(self._wakeup)
+
+    def push(self, packet, session_id=None, room=None, priority=None, conflate=None, volatile=False):
+        """
+        Queue ``packet`` for the session ``session_id``, the sessions in
+        ``room``, or without either, all sessions. Safe to call from any
+        thread; the packet is delivered later from the hub.
+        """
+        if packet.ack is not None:
+            raise ValueError("Pushed packets can't ask for an ack")
+        self._requests.append((packet, session_id, room, priority, conflate, volatile))
+        if not self._wakeup_pending:
+            # once a wakeup is pending, the drainer will get here too: it
+            # clears the flag before taking requests
+            self._wakeup_pending = True
+            self._watcher.send()
+
+    def _wakeup(self):
+        self.server.metrics.incr("push.wakeups")
+        if self._drainer is None:
+            self._drainer = gevent.spawn(self._drain)
+
+    def _drain(self):
+        requests = self._requests
+        metrics = self.server.metrics
+        try:
+            while True:
+                self._wakeup_pending = False
+                if not requests:
+                    return
+                for i in range(self.batch):
+                    if not requests:
+                        break
+                    self._deliver(*requests.popleft())
+                    metrics.incr("push.delivered")
+                gevent.sleep(0)
+        finally:
+            self._drainer = None
+
+    def _deliver(self, packet, session_id, room, priority, conflate, volatile):
+        server = self.server
+        if conflate is not None:
+            conflate = (packet.endpoint, conflate)
+        if session_id is not None:
+            session_ids = (session_id,)
+        elif room is not None:
+            session_ids = list(server.rooms.get(room, ()))
+        else:
+            session_ids = list(server._sessions)
+        for session_id in session_ids:
+            session = server._sessions.get(session_id)
+            if session is None or not session.connected:
+                server.metrics.incr("push.dropped")
+                continue
+            try:
+                session.send_async(packet, priority, conflate, volatile)
+            except Exception:
+                logger.exception("Failed to push %r to %r", packet, session)
+
+    def close(self):
+        self._watcher.stop()
@@ -0,0 +1,245 @@
+"""
+Outbound packet queues.
+"""
+
+from __future__ import absolute_import, unicode_literals
+
+from collections import deque
+
+from gevent.queue import Queue
+from socketio import packets
+from socketio.spill import SegmentQueue
+
+
+PRIORITY_CONTROL = 0
+PRIORITY_NORMAL = 1
+PRIORITY_LOW = 2
+
+CONTROL_PACKETS = (
+    packets.DisconnectPacket,
+    packets.ConnectPacket,
+    packets.HeartbeatPacket,
+    packets.AckPacket,
+    packets.ErrorPacket,
+    packets.NoopPacket,
+)
+
+
+def default_priority(packet):
+    """Control packets go first, everything else gets normal priority."""
+    if packet is None or isinstance(packet, CONTROL_PACKETS):
+        return PRIORITY_CONTROL
+    return PRIORITY_NORMAL
+
+
+class _Conflated(object):
+    """Queue slot of a conflated packet, refilled by newer packets with the same key."""
+
+    __slots__ = ("key", "packet")
+
+    def __init__(self, key, packet):
+        self.key = key
+        self.packet = packet
+
+
+def _unwrap(entry):
+    return entry.packet if type(entry) is _Conflated else entry
+
+
+_TEXT, _RAW = b"t", b"r"
+
+
+def _spill_encode(packet):
+    if isinstance(packet, packets.MessagePacket) and isinstance(packet.data, unicode):
+        return _TEXT + packet._replace(data=packet.data.encode("utf-8")).encode()
+    return _RAW + packet.encode()
+
+
+def _spill_decode(data):
+    packet = packets.Packet.decode(data[1:])
+    if data[:1] == _TEXT:
+        packet = packet._replace(data=packet.data.decode("utf-8"))
+    return packet
+
+
+class PacketLevel(object):
+    """
+    FIFO of one priority level. Once ``max_memory`` packets are waiting in
+    memory, further packets are encoded and spilled to a
+    :class:`socketio.spill.SegmentQueue` until the backlog is drained.
+    """
+
+    def __init__(self):
+        self.memory = deque()
+        self.spilled = None
+        self.max_memory = None
+
+    def __len__(self):
+        return len(self.memory) + (len(self.spilled) if self.spilled is not None else 0)
+
+    def __iter__(self):
+        for entry in self.memory:
+            yield _unwrap(entry)
+        if self.spilled is not None:
+            for data in self.spilled:
+                yield _spill_decode(data)
+
+    @property
+    def spilling(self):
+        return self.max_memory is not None and (len(self.memory) >= self.max_memory or bool(self.spilled))
+
+    def append(self, entry):
+        if self.spilling:
+            self.spilled.append(_spill_encode(entry))
+        else:
+            self.memory.append(entry)
+
+    def popleft(self):
+        if self.memory:
+            return self.memory.popleft()
+        return _spill_decode(self.spilled.popleft())
+
+    def peek(self):
+        if self.memory:
+            return self.memory[0]
+        return _spill_decode(self.spilled.peek())
+
+    def close(self):
+        if self.spilled is not None:
+            self.spilled.close()
+
+
+class PacketLevels(object):
+    """
+    Storage behind :class:`PacketQueue`: one :class:`PacketLevel` per
+    priority.
+
+    Control packets always go first. While low priority packets are
+    waiting, every ``low_priority_share``-th packet taken is a low priority
+    one, so bulk traffic cannot starve them completely.
+
+    A packet appended with a conflation key replaces a still queued packet
+    with the same key in place, keeping that packet's position and
+    priority; the priority it was appended with is ignored. Packets
+    spilled to disk are not conflated any more.
+    """
+
+    def __init__(self, low_priority_share=8):
+        self.levels = (PacketLevel(), PacketLevel(), PacketLevel())
+        self.low_priority_share = low_priority_share
+        self.conflated = {}
+        self._since_low = 0
+
+    def __len__(self):
+        return sum(len(level) for level in self.levels)
+
+    def __iter__(self):
+        for level in self.levels:
+            for packet in level:
+                yield packet
+
+    def spill(self, max_memory, directory=None, segment_size=4 << 20):
+        """
+        Keep at most ``max_memory`` normal and low priority packets each in
+        memory and spill the rest to segment files in ``directory``.
+        """
+        for level in self.levels[PRIORITY_NORMAL:]:
+            level.max_memory = max_memory
+            level.spilled = SegmentQueue(directory, segment_size)
+
+    def append(self, item):
+        priority, packet, key = item
+        level = self.levels[priority]
+        if key is not None:
+            slot = self.conflated.get(key)
+            if slot is not None:
+                slot.packet = packet
+                return
+            if not level.spilling:
+                slot = self.conflated[key] = _Conflated(key, packet)
+                level.memory.append(slot)
+                return
+        level.append(packet)
+
+    def _next_level(self):
+        control, normal, low = self.levels
+        if control:
+            return control
+        if low and (not normal or self._since_low >= self.low_priority_share):
+            return low
+        return normal
+
+    def popleft(self):
+        level = self._next_level()
+        packet = level.popleft()
+        if type(packet) is _Conflated:
+            del self.conflated[packet.key]
+            packet = packet.packet
+        if level is self.levels[PRIORITY_LOW]:
+            self._since_low = 0
+        elif level is self.levels[PRIORITY_NORMAL] and self.levels[PRIORITY_LOW]:
+            self._since_low += 1
+        return packet
+
+    def peek(self):
+        return _unwrap(self._next_level().peek())
+
+    def close(self):
+        for level in self.levels:
+            level.close()
+
+
+class PacketQueue(Queue):
+    """
+    Queue of packets waiting to be sent to the client, ordered by
+    priority and conflated by key (see :class:`PacketLevels`).
+    """
+
+    def __init__(self, low_priority_share=8):
+        self.low_priority_share = low_priority_share
+        self.on_put = None  # called after every put, e.g. to wake up a transport
+        Queue.__init__(self)
+
+    def _create_queue(self, items=()):
+        return PacketLevels(self.low_priority_share)
+
+    def _put(self, item):
+        self.queue.append(item)
+        if self.on_put is not None:
+            self.on_put()
+
+    def _get(self):
+        return self.queue.popleft()
+
+    def _peek(self):
+        return self.queue.peek()
+
+    def put(self, packet, block=True, timeout=None, priority=None, conflate=None):
+        if priority is None:
+            priority = default_priority(packet)
+        Queue.put(self, (priority, packet, conflate), block, timeout)
+
+    def put_nowait(self, packet, priority=None, conflate=None):
+        self.put(packet, False, priority=priority, conflate=conflate)
+
+    def conflates(self, key):
+        """Whether a packet put with conflation ``key`` would replace a queued one."""
+        return key in self.queue.conflated
+
+    def conflated_packet(self, key):
+        """The queued packet a packet put with conflation ``key`` would replace, or ``None``."""
+        slot = self.queue.conflated.get(key)
+        return slot.packet if slot is not None else None
+
+    def spill(self, max_memory, directory=None, segment_size=4 << 20):
+        """See :meth:`PacketLevels.spill`."""
+        self.queue.spill(max_memory, directory, segment_size)
+
+    @property
+    def spilled(self):
+        """Number of packets currently spilled to disk."""
+        return sum(len(level.spilled) for level in self.queue.levels if level.spilled is not None)
+
+    def close(self):
+        """Release the spill files; packets still on disk are lost."""
+        self.queue.close()
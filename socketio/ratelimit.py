@@ -0,0 +1,95 @@
+"""
+Rate limiting primitives.
+"""
+
+from __future__ import absolute_import, unicode_literals
+
+
+class TokenBucket(object):
+    """
+    Classic token bucket: ``rate`` tokens are added per second, up to
+    ``burst`` tokens in total.
+    """
+
+    def __init__(self, rate, burst=None, clock=None):
+        self.rate = float(rate)
+        self.burst = float(burst if burst is not None else rate)
+        self.clock = clock
+        self.tokens = self.burst
+        self.updated = clock.now()
+
+    def _refill(self):
+        now = self.clock.now()
+        if now > self.updated:
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+
+    def consume(self, amount=1):
+        """Take ``amount`` tokens if available and return whether it did."""
+        self._refill()
+        if self.tokens >= amount:
+            self.tokens -= amount
+            return True
+        return False
+
+    def delay(self, amount=1):
+        """Seconds until ``amount`` tokens will be available."""
+        self._refill()
+        if self.tokens >= amount:
+            return 0.0
+        return (amount - self.tokens) / self.rate if self.rate else float("inf")
+
+
+class InboundLimiter(object):
+    """
+    Limits on what one client may send: packets and bytes per second for
+    the whole session, and packets per second for each endpoint. Each
+    limit is a ``(rate, burst)`` pair or ``None``.
+
+    Endpoint names come from the client, so only the first
+    ``max_endpoints`` endpoints get a bucket of their own; packets for any
+    other endpoint share one more bucket.
+
+    ``action`` tells the session what to do with a packet over the limit:
+    ``"throttle"`` waits until it fits, which also stops reading from the
+    client; ``"drop"`` discards it; ``"disconnect"`` kills the session.
+    """
+
+    ACTIONS = ("throttle", "drop", "disconnect")
+
+    def __init__(self, clock, packets=None, bytes=None, endpoint_packets=None, action="throttle",
+                 max_endpoints=16):
+        if action not in self.ACTIONS:
+            raise ValueError("Unknown inbound limit action %r" % (action,))
+        self.clock = clock
+        self.action = action
+        self.packets = TokenBucket(packets[0], packets[1], clock) if packets else None
+        self.bytes = TokenBucket(bytes[0], bytes[1], clock) if bytes else None
+        self.endpoint_packets = endpoint_packets
+        self.max_endpoints = max_endpoints
+        self.endpoints = {}
+        self.other_endpoints = TokenBucket(endpoint_packets[0], endpoint_packets[1], clock) \
+            if endpoint_packets else None
+
+    def _buckets(self, endpoint, size):
+        if self.packets is not None:
+            yield self.packets, 1
+        if self.bytes is not None:
+            yield self.bytes, min(size, self.bytes.burst)
+        if self.endpoint_packets is not None:
+            bucket = self.endpoints.get(endpoint)
+            if bucket is None:
+                if len(self.endpoints) < self.max_endpoints:
+                    rate, burst = self.endpoint_packets
+                    bucket = self.endpoints[endpoint] = TokenBucket(rate, burst, self.clock)
+                else:
+                    bucket = self.other_endpoints
+            yield bucket, 1
+
+    def delay(self, endpoint, size):
+        """Seconds until a packet of ``size`` bytes for ``endpoint`` fits all limits."""
+        return max([bucket.delay(amount) for bucket, amount in self._buckets(endpoint, size)] or [0.0])
+
+    def consume(self, endpoint, size):
+        for bucket, amount in self._buckets(endpoint, size):
+            bucket.consume(amount)
@@ -0,0 +1,87 @@
+"""
+Replay buffers for resuming sessions after a short disconnect.
+"""
+
+from __future__ import absolute_import, unicode_literals
+
+from collections import deque, namedtuple
+
+
+ReplayEntry = namedtuple("ReplayEntry", ("seq", "timestamp", "size", "packet"))
+
+
+class ReplayBuffer(object):
+    """
+    Bounded ring of recent outbound data packets, numbered with increasing
+    sequence numbers. Entries are evicted when there are more than
+    ``max_packets`` of them, when together they encode to more than
+    ``max_bytes``, or when they are older than ``ttl`` seconds.
+
+    ``delivered_seq`` is the sequence number of the last packet written by
+    a transport; packets appended with ``delivered=False`` (the ones still
+    queued when a session dies) are numbered but not counted as delivered.
+
+    Only message, JSON and event packets are numbered, so that clients
+    can number the packets they receive the same way: the first such
+    packet of a session is 1, the next 2 and so on. A resumed session
+    continues the numbering of the session it replaces.
+    """
+
+    def __init__(self, clock, max_packets=256, max_bytes=1 << 20, ttl=60.0, seq=0):
+        self.clock = clock
+        self.max_packets = max_packets
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.entries = deque()
+        self.size = 0
+        self.last_seq = seq  # numbering continues after seq
+        self.delivered_seq = seq
+
+    def __len__(self):
+        return len(self.entries)
+
+    def append(self, packet, delivered=True, size=None):
+        """
+        Number and keep ``packet``. ``size`` is its encoded length, if the
+        caller already knows it.
+        """
+        self.last_seq += 1
+        if delivered:
+            self.delivered_seq = self.last_seq
+        if size is None:
+            size = len(packet.encode())
+        self.entries.append(ReplayEntry(self.last_seq, self.clock.now(), size, packet))
+        self.size += size
+        self.evict()
+        return self.last_seq
+
+    def evict(self):
+        entries = self.entries
+        oldest = self.clock.now() - self.ttl
+        while entries and (len(entries) > self.max_packets or self.size > self.max_bytes
+                           or entries[0].timestamp < oldest):
+            self.size -= entries.popleft().size
+
+    def since(self, seq):
+        """
+        Return the packets sent after ``seq``, or ``None`` if some of them
+        are no longer in the buffer and the client has to start over.
+        """
+        self.evict()
+        first_seq = self.entries[0].seq if self.entries else self.last_seq + 1
+        if seq > self.last_seq or seq + 1 < first_seq:
+            return None
+        return [entry.packet for entry in self.entries if entry.seq > seq]
+
+    def rewind(self, seq):
+        """
+        Like :meth:`since`, but also drop the returned packets and continue
+        numbering after ``seq``. The packets are queued again by the caller
+        and get the same sequence numbers back when they are redelivered.
+        """
+        missed = self.since(seq)
+        if missed is not None:
+            while self.entries and self.entries[-1].seq > seq:
+                self.size -= self.entries.pop().size
+            self.last_seq = self.delivered_seq = seq
+        return missed
@@ -0,0 +1,101 @@
+"""
+Routing of requests to the socket.io resources of a server.
+"""
+
+from __future__ import absolute_import, unicode_literals
+
+from collections import namedtuple
+
+from socketio.static import CLIENT_FILES
+
+
+HANDSHAKE = "handshake"
+TRANSPORT = "transport"
+CLIENT = "client"
+
+Route = namedtuple("Route", ("kind", "resource", "transport", "session_id", "filename"))
+
+
+class Resource(object):
+    """
+    A socket.io resource served under the path ``name`` (e.g.
+    ``"socket.io"`` or ``"games/socket.io"``): the WSGI application run for
+    its sessions, the transports offered to its clients and the settings
+    of its sessions. ``application``, ``cors`` and ``binary_messages``
+    default to those of the server.
+    """
+
+    def __init__(self, name, application=None, transports=("websocket", "xhr-polling"),
+                 cors=None, binary_messages=None, heartbeat=15, expire=10):
+        self.name = name.strip("/")
+        self.application = application
+        self.transports = tuple(transports)
+        self.cors = cors
+        self.binary_messages = binary_messages
+        self.heartbeat = heartbeat
+        self.expire = expire
+
+    def __repr__(self):
+        return "<Resource /%s>" % self.name
+
+
+class Router(object):
+    """
+    Maps request paths to resources with a trie of path segments, built
+    when resources are added. :meth:`match` walks the path once and picks
+    the resource, the kind of request and, for transport requests, the
+    transport class and session ID.
+    """
+
+    def __init__(self, transport_types):
+        self.transport_types = transport_types
+        self.resources = {}
+        self._trie = {}
+
+    def add(self, resource):
+        if resource.name in self.resources:
+            raise ValueError("Resource %r already exists" % resource.name)
+        unknown = [name for name in resource.transports if name not in self.transport_types]
+        if unknown:
+            raise ValueError("Unknown transports %r" % (unknown,))
+        node = self._trie
+        for segment in resource.name.split("/"):
+            node = node.setdefault(segment, {})
+        # segments are strings, so None can't clash with a child
+        node[None] = resource, dict((name, self.transport_types[name]) for name in resource.transports)
+        self.resources[resource.name] = resource
+        return resource
+
+    def match(self, path):
+        """Return the :class:`Route` for ``path``, or ``None`` if no resource serves it."""
+        segments = path.split("/")
+        if segments[0]:
+            return None
+        node = self._trie
+        found = None
+        count = len(segments)
+        i = 1
+        while i < count:
+            node = node.get(segments[i])
+            if node is None:
+                break
+            i += 1
+            if None in node:
+                found, rest = node[None], i  # the longest match wins
+
+        if found is None:
+            return None
+        resource, transports = found
+        left = count - rest
+        if left == 1:
+            if segments[rest] in CLIENT_FILES:
+                return Route(CLIENT, resource, None, None, segments[rest])
+        elif left == 2:
+            if segments[rest] == "1" and not segments[rest + 1]:
+                return Route(HANDSHAKE, resource, None, None, None)
+        elif left == 3 or (left == 4 and not segments[rest + 3]):
+            # /<protocol version>/<transport>/<session id>[/]
+            transport = transports.get(segments[rest + 1])
+            if transport is not None and segments[rest] and segments[rest + 2]:
+                return Route(TRANSPORT, resource, transport, segments[rest + 2], None)
+        return None
@@ -1,10 +1,27 @@
 from __future__ import absolute_import, unicode_literals
 
 
+import os
+import random
+import gevent
+import anyjson as json
+
 from gevent.pywsgi import WSGIServer
 
 from socketio.handler import SocketIOHandler
 from socketio.session import Session
+from socketio.capture import CaptureWriter
+from socketio.clock import CoarseClock
+from socketio.metrics import Metrics
+from socketio.monitor import LagMonitor, SHED_HANDSHAKES
+from socketio.offload import OffloadExecutor
+from socketio.push import PushQueue
+from socketio.queues import PRIORITY_LOW
+from socketio.ratelimit import TokenBucket, InboundLimiter
+from socketio.replay import ReplayBuffer
+from socketio.router import Resource, Router
+from socketio.static import StaticFile, CLIENT_DIST, CLIENT_FILES
+from socketio import packets
 
 import urlparse
 
@@ -21,27 +38,369 @@ class SocketIOServer(WSGIServer):
     def __init__(self, *args, **kwargs):
         self._sessions = {}
         self.namespace = kwargs.pop('namespace', 'socket.io')
+        resources = kwargs.pop('resources', ())
         self.cors_domain = kwargs.pop('cors', '')
+        self.metrics = Metrics()
+        self.clock = kwargs.pop('clock', None) or CoarseClock()
+
+        self.offload_pool_size = kwargs.pop('offload_pool_size', 4)
+        self.offload_queue_limit = kwargs.pop('offload_queue_limit', None)
+        self.offload_mode = kwargs.pop('offload_mode', 'thread')
+        self._offload = None
+        self.draining = False
+        self.binary_messages = kwargs.pop('binary_messages', True)
+        self.client_dist = kwargs.pop('client_dist', CLIENT_DIST)
+        self.client_max_age = kwargs.pop('client_max_age', 365 * 24 * 3600)
+
+        self.replay_buffer = kwargs.pop('replay_buffer', 0)
+        self.replay_buffer_bytes = kwargs.pop('replay_buffer_bytes', 1 << 20)
+        self.replay_ttl = kwargs.pop('replay_ttl', 60.0)
+        self._replay_buffers = {}
+
+        # spill outbound packets beyond this many per session to disk
+        self.spill_threshold = kwargs.pop('spill_threshold', None)
+        self.spill_dir = kwargs.pop('spill_dir', None)
+        self.spill_segment_size = kwargs.pop('spill_segment_size', 4 << 20)
+
+        capture = kwargs.pop('capture', None)
+        self.capture = CaptureWriter(capture) if capture else None
+
+        self.max_sessions = kwargs.pop('max_sessions', None)
+        self.handshake_timeout = kwargs.pop('handshake_timeout', 10)
+        self.max_pending_handshakes = kwargs.pop('max_pending_handshakes', None)
+        self.pending_handshakes = set()  # IDs of sessions no transport has connected to yet
+        self.reconnect_delay = kwargs.pop('reconnect_delay', 5)
+        # seconds a websocket taking over a polling session waits for its open polls
+        self.upgrade_timeout = kwargs.pop('upgrade_timeout', 5.0)
+        handshake_rate = kwargs.pop('handshake_rate', None)
+        handshake_burst = kwargs.pop('handshake_burst', None)
+        self.handshake_bucket = None
+        if handshake_rate is not None:
+            self.handshake_bucket = TokenBucket(handshake_rate, handshake_burst, self.clock)
+
+        # inbound limits, each a (rate, burst) pair
+        self.inbound_packet_limit = kwargs.pop('inbound_packet_limit', None)
+        self.inbound_byte_limit = kwargs.pop('inbound_byte_limit', None)
+        self.endpoint_packet_limit = kwargs.pop('endpoint_packet_limit', None)
+        self.inbound_limit_action = kwargs.pop('inbound_limit_action', 'throttle')
+        if self.inbound_limit_action not in InboundLimiter.ACTIONS:
+            raise ValueError("Unknown inbound_limit_action %r" % (self.inbound_limit_action,))
+        self.inbound_yield_every = kwargs.pop('inbound_yield_every', 32)
+
+        # size limits in bytes on a websocket message and on a POST body
+        self.max_packet_size = kwargs.pop('max_packet_size', 1 << 20)
+        self.max_payload_size = kwargs.pop('max_payload_size', 1 << 20)
+
+        # event loop lag monitoring and load shedding
+        self.monitor = None
+        if kwargs.pop('lag_monitor', False):
+            self.monitor = LagMonitor(self.metrics,
+                                      interval=kwargs.pop('lag_interval', 0.05),
+                                      thresholds=kwargs.pop('lag_thresholds', (0.05, 0.1, 0.25)),
+                                      stall_threshold=kwargs.pop('stall_threshold', 0.1),
+                                      trace=kwargs.pop('trace_stalls', True),
+                                      poll_delay=kwargs.pop('shed_poll_delay', 1.0))
 
         kwargs.pop('policy_server')
         kwargs.setdefault('handler_class', SocketIOHandler)
         super(SocketIOServer, self).__init__(*args, **kwargs)
 
+        self.rooms = {}  # room name -> IDs of the sessions in it
+        self.push_queue = PushQueue(self)
+
+        self.router = Router(self.handler_class.handler_types)
+        self.resource = None  # served under ``namespace`` with the server's application
+        if self.namespace is not None:
+            self.resource = self.add_resource(Resource(self.namespace))
+        for resource in resources:
+            self.add_resource(resource)
+
+    def add_resource(self, resource):
+        """
+        Serve the :class:`socketio.router.Resource` ``resource`` besides
+        the ones already there. Returns it.
+        """
+        return self.router.add(resource)
+
+    @property
+    def offload_executor(self):
+        """The pool used by :meth:`offload`, created on first use."""
+        if self._offload is None:
+            self._offload = OffloadExecutor(self.offload_pool_size,
+                                            self.offload_queue_limit,
+                                            self.offload_mode,
+                                            metrics=self.metrics,
+                                            clock=self.clock)
+        return self._offload
+
+    def offload(self, func, *args, **kwargs):
+        """
+        Run a CPU-bound callable outside the hub and wait for its result
+        without blocking other greenlets.
+        """
+        return self.offload_executor.apply(func, *args, **kwargs)
+
+    def start(self):
+        super(SocketIOServer, self).start()
+        if self.monitor is not None:
+            self.monitor.start()
+
+    def stop(self, *args, **kwargs):
+        super(SocketIOServer, self).stop(*args, **kwargs)
+        if self.monitor is not None:
+            self.monitor.stop()
+        if self._offload is not None:
+            self._offload.close()
+            self._offload = None
+        if self.capture is not None:
+            self.capture.close()
+        self.push_queue.close()
+
+    def push(self, packet, session_id=None, room=None, priority=None, conflate=None, volatile=False):
+        """
+        Send ``packet`` to the session ``session_id``, to the sessions in
+        ``room``, or to all sessions. Unlike ``Session.send``, this can be
+        called from any thread. See :class:`socketio.push.PushQueue`.
+        """
+        self.push_queue.push(packet, session_id, room, priority, conflate, volatile)
+
+    def join(self, session, room):
+        """Add ``session`` to ``room``; it leaves all rooms when it dies."""
+        self.rooms.setdefault(room, set()).add(session.session_id)
+        session.rooms.add(room)
+
+    def leave(self, session, room):
+        session.rooms.discard(room)
+        members = self.rooms.get(room)
+        if members is not None:
+            members.discard(session.session_id)
+            if not members:
+                del self.rooms[room]
+
+    def reconnect_backoff(self):
+        """
+        Whole seconds a rejected client should wait before retrying,
+        randomized so rejected clients do not come back all at once.
+        """
+        return int(self.reconnect_delay * (1 + random.random()))
+
+    def admit_handshake(self):
+        """
+        Admission control for new sessions. Returns ``None`` if a handshake
+        may proceed, otherwise the number of seconds the client should wait.
+        """
+        if self.max_sessions is not None and len(self._sessions) >= self.max_sessions:
+            self.metrics.incr("handshake.rejected_capacity")
+            return self.reconnect_backoff()
+        if self.max_pending_handshakes is not None and \
+                len(self.pending_handshakes) >= self.max_pending_handshakes:
+            self.metrics.incr("handshake.rejected_pending")
+            return self.reconnect_backoff()
+        if self.monitor is not None and self.monitor.stage >= SHED_HANDSHAKES:
+            self.metrics.incr("handshake.rejected_lag")
+            return self.reconnect_backoff()
+        if self.handshake_bucket is not None and not self.handshake_bucket.consume():
+            self.metrics.incr("handshake.rejected_rate")
+            return max(int(self.handshake_bucket.delay()) + 1, self.reconnect_backoff())
+        self.metrics.incr("handshake.accepted")
+        return None
+
+    def client_file(self, filename):
+        """
+        The socket.io client file served under the path of each resource, or
+        ``None`` if it is not available in ``client_dist``.
+        """
+        if filename not in CLIENT_FILES:
+            return None
+        return StaticFile.load(os.path.join(self.client_dist, filename), max_age=self.client_max_age)
 
-    def get_session(self, sid):
-        """Return an existing or new client Session."""
+    def get_session(self, sid, resource=None):
+        """
+        Return an existing client Session, or ``None``. With ``resource``,
+        sessions of other resources are not returned.
+        """
         session = self._sessions.get(sid, None)
+        if session is not None and resource is not None and session.resource is not resource:
+            return None
         if session is not None:
             session.touch()  # Touch the session as used
         return session
 
-    def create_session(self, environ):
+    def create_session(self, environ, resource=None):
         """
-        Create a new session on the server.
+        Create a new session on the server, for ``resource`` or by default
+        the one served under ``namespace``.
         """
+        resource = resource or self.resource
         handshake_data = {
             "query": dict(urlparse.parse_qsl(environ["QUERY_STRING"]))
         }
-        session = Session(self, handshake_data)
+        session = Session(self, handshake_data, expire=resource.expire, heartbeat=resource.heartbeat,
+                          handshake_timeout=self.handshake_timeout)
+        self._setup_session(session, resource)
+        binary_messages = self.binary_messages if resource.binary_messages is None else resource.binary_messages
+        session.binary = binary_messages and handshake_data["query"].get("binary") == "1"
         self._sessions[session.session_id] = session
+        self.pending_handshakes.add(session.session_id)
+        if self.replay_buffer:
+            self._resume(session, handshake_data)
         return session
+
+    def _setup_session(self, session, resource, seq=0):
+        """
+        Attach ``session`` to ``resource`` and give it the inbound limits,
+        spilling and replay buffer configured on the server. Replay numbering
+        continues after ``seq``.
+        """
+        session.resource = resource
+        if self.inbound_packet_limit or self.inbound_byte_limit or self.endpoint_packet_limit:
+            session.limiter = InboundLimiter(self.clock, self.inbound_packet_limit,
+                                             self.inbound_byte_limit, self.endpoint_packet_limit,
+                                             self.inbound_limit_action)
+        if self.spill_threshold is not None:
+            session.client_queue.spill(self.spill_threshold, self.spill_dir, self.spill_segment_size)
+        if self.replay_buffer:
+            session.replay = ReplayBuffer(self.clock, self.replay_buffer, self.replay_buffer_bytes,
+                                          self.replay_ttl, seq)
+
+    def retain_replay(self, session_id, replay):
+        """
+        Keep the replay buffer of a dead session for ``replay_ttl`` seconds,
+        so the client can resume it.
+        """
+        self._replay_buffers[session_id] = replay
+        gevent.spawn_later(self.replay_ttl, self._drop_replay, session_id, replay)
+
+    def _drop_replay(self, session_id, replay):
+        if self._replay_buffers.get(session_id) is replay:
+            del self._replay_buffers[session_id]
+
+    def _resume(self, session, handshake_data):
+        """
+        If the client of a new session asked to resume an earlier session
+        (``?resume=<session id>&seq=<last seen>``), queue the packets it
+        missed and record in ``handshake_info["resumed"]`` whether that was
+        possible; if not, the application has to send the client its full
+        state again.
+
+        ``seq`` is the number of message, JSON and event packets the client
+        received on the sessions it resumes (see
+        :class:`socketio.replay.ReplayBuffer`). A resumed session ends its
+        handshake with ``:resumed``; then the client keeps counting from
+        ``seq``, otherwise it starts over from 0.
+        """
+        query = handshake_data["query"]
+        old_id = query.get("resume")
+        replay = None
+        if old_id:
+            old = self._sessions.get(old_id)
+            if old is not None:
+                old.kill()
+            replay = self._replay_buffers.pop(old_id, None)
+
+        missed = None
+        if replay is not None:
+            try:
+                seq = int(query["seq"])
+            except (KeyError, ValueError):
+                seq = None  # the server can't tell what the client missed
+            if seq is not None:
+                missed = replay.rewind(seq)
+
+        if old_id:
+            handshake_data["resumed"] = missed is not None
+            self.metrics.incr("replay.resumed" if missed is not None else "replay.resume_failed")
+
+        if missed is not None:
+            self.metrics.incr("replay.replayed_packets", len(missed))
+            for packet in missed:
+                session.client_queue.put_nowait(packet)
+            session.replay = replay
+
+    def save_sessions(self, path):
+        """
+        Write all live sessions, with their undelivered packets, to ``path``
+        (one JSON document per line).
+        """
+        count = 0
+        with open(path, "wb") as f:
+            for session in list(self._sessions.values()):
+                if not session.connected:
+                    continue
+                f.write(json.dumps(session.snapshot()).encode("utf-8") + b"\n")
+                count += 1
+        self.metrics.incr("drain.sessions_saved", count)
+        logger.info("Saved %d sessions to %s", count, path)
+        return count
+
+    def restore_sessions(self, path):
+        """
+        Load sessions written by :meth:`save_sessions`, so clients of the
+        previous process resume them without a new handshake.
+        """
+        count = 0
+        with open(path, "rb") as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                data = json.loads(line.decode("utf-8"))
+                session = Session.from_snapshot(self, data, handshake_timeout=self.handshake_timeout)
+                self._setup_session(session, self.router.resources.get(data.get("resource"), self.resource),
+                                    data.get("replay_seq") or 0)
+                self._sessions[session.session_id] = session
+                count += 1
+        self.metrics.incr("drain.sessions_restored", count)
+        logger.info("Restored %d sessions from %s", count, path)
+        return count
+
+    def _advise_reconnect(self, session_id, deadline):
+        """
+        Tell a client to reconnect once the packets queued for it are
+        delivered, or at ``deadline``: an error packet is a control packet
+        and would otherwise jump ahead of them, and the client leaves as
+        soon as it gets the advice.
+        """
+        session = self._sessions.get(session_id)
+        while session is not None and session.connected and session.client_queue.qsize() \
+                and self.clock.precise() < deadline:
+            gevent.sleep(0.05)
+        if session is None or not session.connected:
+            return
+        session.send(packets.ErrorPacket(None, None, None, "", "reconnect"), priority=PRIORITY_LOW)
+        self.metrics.incr("drain.reconnect_advised")
+
+    def _wait_for_flush(self, deadline):
+        while self.clock.precise() < deadline:
+            if not any(s.pending_packets() for s in self._sessions.values()):
+                return True
+            gevent.sleep(0.05)
+        return False
+
+    def drain(self, timeout=30.0, stagger=10.0, snapshot_path=None):
+        """
+        Shut the server down without dropping every client at once.
+
+        New handshakes are refused right away. With ``snapshot_path``, the
+        queued packets get up to ``timeout`` seconds to be delivered and the
+        remaining session state is saved there for the replacement process
+        (see :meth:`restore_sessions`). Without it, clients are told to
+        reconnect, spread evenly over ``stagger`` seconds, each once its
+        queue is flushed or ``timeout`` runs out.
+        """
+        self.draining = True
+        deadline = self.clock.precise() + timeout
+        logger.info("Draining %d sessions", len(self._sessions))
+
+        if snapshot_path is None:
+            session_ids = list(self._sessions)
+            step = stagger / len(session_ids) if session_ids else 0
+            advisers = [gevent.spawn_later(i * step, self._advise_reconnect, session_id, deadline)
+                        for i, session_id in enumerate(session_ids)]
+            gevent.joinall(advisers, timeout=max(0, deadline - self.clock.precise()))
+
+        if not self._wait_for_flush(deadline):
+            logger.warning("Drain deadline reached with undelivered packets")
+
+        if snapshot_path is not None:
+            self.save_sessions(snapshot_path)
+        self.stop()
@@ -1,12 +1,16 @@
 from __future__ import absolute_import, unicode_literals
 
+import base64
 import uuid
 import weakref
 import gevent
-import time
 
+from gevent.event import Event
 from gevent.queue import Queue
 from socketio import packets
+from socketio.exceptions import PacketConflated
+from socketio.monitor import SHED_VOLATILE
+from socketio.queues import PacketQueue, CONTROL_PACKETS, PRIORITY_CONTROL
 
 
 from logging import getLogger
@@ -34,14 +38,29 @@ class SessionExpireGreenlet(gevent.Greenlet):
             if session is None: # session was deleted
                 return
 
-            delta = time.clock() - session.timestamp
-            if delta > self.expire:
-                logger.info("Session %r expired. Delta is %r, expected less then %r", session, delta, self.expire)
-                session.kill()
+            remaining = self.check(session)
+            if remaining is None:
                 return
 
             # session is alive, go to sleep
-            gevent.sleep(session.timestamp + self.expire - max(0, delta))
+            del session
+            gevent.sleep(remaining)
+
+    def check(self, session):
+        """
+        Kill the session if it has expired. Otherwise return the number of
+        seconds left until it would expire.
+        """
+        if session.state == session.STATE_NEW:
+            limit = session.handshake_timeout  # handshaken, but no transport connected yet
+        else:
+            limit = self.expire
+        delta = session.clock.now() - session.timestamp
+        if delta > limit:
+            logger.info("Session %r expired. Delta is %r, expected less then %r", session, delta, limit)
+            session.kill()
+            return None
+        return limit - max(0, delta)
 
 
 class Session(object):
@@ -55,72 +74,151 @@ class Session(object):
     STATE_DISCONNECTING = "DISCONNECTING"
     STATE_DISCONNECTED = "DISCONNECTED"
 
-    def __init__(self, server, handshake_info, expire=10, heartbeat=15):
+    def __init__(self, server, handshake_info, expire=10, heartbeat=15, session_id=None,
+                 handshake_timeout=None):
         self.handshake_info = handshake_info  # Info sent in handshake data
 
         self._server = weakref.ref(server)
+        self.clock = server.clock
         self.__packetid = 1
         self._acks = weakref.WeakValueDictionary()
 
-        self.session_id = uuid.uuid1().hex
+        self.session_id = session_id or uuid.uuid1().hex
 
         self.state = "NEW"
         self.connection_confirmed = False
-        self.timestamp = time.clock()
+        self.transport = None  # name of the transport delivering packets
+        self.resource = None  # the socketio.router.Resource the session belongs to
+        self.rooms = set()  # names of the rooms the session joined on the server
+        self.binary = False  # binary websocket frames negotiated at handshake
+        self.replay = None  # optional ReplayBuffer of delivered packets
+        self.limiter = None  # optional InboundLimiter for packets from the client
+
+        # round-trip time estimate from heartbeats, in seconds; it is not
+        # updated while traffic suppresses heartbeats (see next_heartbeat)
+        self.rtt = None
+        self.rtt_jitter = None
+        self._heartbeat_sent = None  # when the last heartbeat was handed to a transport
+        self.last_sent = self.clock.now()  # when a packet was last handed to a transport
+        self.timestamp = self.clock.now()
         self.wsgi_app_greenlet = None
 
         self.expire = expire
         self.heartbeat = heartbeat
-
-        self.client_queue = Queue()  # queue for messages to client
+        # how long the session may wait for its first transport request
+        self.handshake_timeout = expire if handshake_timeout is None else handshake_timeout
+
+        self.client_queue = PacketQueue()  # queue for messages to client
+        self._polling = 0  # transports blocked in _fetch_client
+        self._open_polls = 0  # polling requests not answered yet
+        self._polls_idle = Event()
+        self._polls_idle.set()
         self.server_queue = Queue()  # queue for messages to server
+        self._endpoint_queues = {None: self.server_queue}  # per-endpoint server queues
 
         self.expire_greenlet = SessionExpireGreenlet(expire, self)
-        self.expire_greenlet.start_later(expire)
-
+        self.expire_greenlet.start_later(min(expire, self.handshake_timeout))
 
+    @classmethod
+    def from_snapshot(cls, server, data, **kwargs):
+        """
+        Recreate a session saved by :meth:`snapshot`, possibly in another
+        process. The client can keep using its session ID. ``kwargs`` go to
+        the constructor; settings that come from the server, like the
+        inbound limits or the replay buffer, are up to the caller.
+        """
+        session = cls(server, data["handshake_info"], expire=data["expire"],
+                      heartbeat=data["heartbeat"], session_id=data["session_id"], **kwargs)
+        session.binary = data.get("binary", False)
+        session.state = cls.STATE_CONNECTED
+        session.connection_confirmed = True
+        for raw in data["packets"]:
+            if isinstance(raw, dict):
+                raw = base64.b64decode(raw["base64"])
+            else:
+                raw = raw.encode("utf-8")
+            session.client_queue.put_nowait(packets.Packet.decode(raw))
+        return session
 
     def __repr__(self):
         return "<Session {s.session_id}, timestamp={s.timestamp}, state={s.state}>".format(s=self)
 
+    @property
+    def server(self):
+        return self._server()
+
     @property
     def connected(self):
         return self.state == self.STATE_CONNECTED
 
+    @property
+    def closed(self):
+        return self.state in (self.STATE_DISCONNECTING, self.STATE_DISCONNECTED)
+
     def touch(self):
-        self.timestamp = max(time.clock(), self.timestamp)
+        self.timestamp = max(self.clock.now(), self.timestamp)
         if self.state == "NEW":
             self.state = self.STATE_CONNECTED
+            server = self._server()
+            if server is not None:
+                server.pending_handshakes.discard(self.session_id)
 
     def clear_disconnect_timeout(self):
         self.touch()
 
     def kill(self):
-        if self.connected:
+        if self.connected or self.state == self.STATE_NEW:
+            if self.replay is not None:
+                for packet in self.pending_packets():
+                    if not isinstance(packet, CONTROL_PACKETS):
+                        self.replay.append(packet, delivered=False)
             self.state = self.STATE_DISCONNECTING
-            self.server_queue.put_nowait(None)
+            for queue in self._endpoint_queues.values():
+                queue.put_nowait(None)
             self.client_queue.put_nowait(None)
-            self.expire_greenlet.kill()
+            self.client_queue.close()
+            if self.expire_greenlet is not gevent.getcurrent():  # it may be what expires us
+                self.expire_greenlet.kill()
 
             del self.expire_greenlet
             del self.wsgi_app_greenlet
             del self.client_queue
             del self.server_queue
+            del self._endpoint_queues
 
             # unregister from server
             server = self._server()
             if server is not None:
                 del server._sessions[self.session_id]
+                server.pending_handshakes.discard(self.session_id)
+                for room in list(self.rooms):
+                    server.leave(self, room)
+                if self.replay is not None:
+                    server.retain_replay(self.session_id, self.replay)
         else:
             pass # Fail silently
 
-    def receive(self, **kwargs):
-        msg = self.server_queue.get(**kwargs)
+    def endpoint_queue(self, endpoint):
+        """
+        Return the queue of packets received for ``endpoint``, creating it
+        on the first call. Only consumers call this: packets for endpoints
+        without a queue go to the default queue, so clients can't make the
+        session allocate queues for names of their choosing.
+        """
+        queue = self._endpoint_queues.get(endpoint)
+        if queue is None:
+            queue = self._endpoint_queues[endpoint] = Queue()
+        return queue
+
+    def receive(self, endpoint=None, block=True, timeout=None):
+        if self.closed:
+            return None
+        msg = self.endpoint_queue(endpoint).get(block, timeout)
         assert msg is None or isinstance(msg, packets.Packet), "Got SERVER message which is not a packet %r" % msg
         return msg
 
     def ack(self, packet, *args):
-        self.send(packets.AckPacket(None, None, None, packet.id, args))
+        self.send(packets.AckPacket(None, None, packet.endpoint, packet.id, args))
 
     def packet_id(self):
         """
@@ -129,53 +227,279 @@ class Session(object):
         id_, self.__packetid = self.__packetid, self.__packetid + 1
         return id_
 
-    def send(self, packet, timeout=None):
+    def send(self, packet, timeout=None, priority=None, conflate=None, volatile=False):
+        """
+        Queue a packet for the client. ``priority`` is one of the
+        ``socketio.queues.PRIORITY_*`` levels; by default control packets
+        get ``PRIORITY_CONTROL`` and everything else ``PRIORITY_NORMAL``.
+
+        A packet with a ``conflate`` key replaces a still queued packet with
+        the same key, taking over its position and priority (``priority``
+        is then ignored). If the replaced packet asked for an ack, its ack
+        result raises :class:`socketio.exceptions.PacketConflated`. A
+        ``volatile`` packet is dropped unless a transport is
+        ready to deliver it right away.
+
+        If the packet asks for an ack, wait for it and return its arguments.
+        """
+        acked = self.send_async(packet, priority, conflate, volatile)
+        if acked is None:
+            return None
+        return acked.get(timeout=timeout)
+
+    def send_async(self, packet, priority=None, conflate=None, volatile=False):
+        """
+        Like :meth:`send`, but return right away. For a packet that asks for
+        an ack, the result is an ``AsyncResult`` set to the ack arguments;
+        the caller has to keep a reference to it for the ack to be recorded.
+        """
         assert isinstance(packet, packets.Packet), "Trying to enqueue CLIENT message that is not a packet %r" % packet
+        if self.closed:
+            logger.debug("Dropping packet for closed session %r: %r", self, packet)
+            return None
         self.touch()
 
+        queue = self.client_queue
+        if volatile and not (self.writable and self._volatile_allowed()):
+            self.server.metrics.incr("packets.volatile_dropped")
+            return None
+        if conflate is not None:
+            displaced = queue.conflated_packet(conflate)
+            if displaced is not None:
+                self.server.metrics.incr("packets.conflated")
+                if displaced.ack is not None:
+                    displaced_ack = self._acks.pop(unicode(displaced.id), None)
+                    if displaced_ack is not None:
+                        displaced_ack.set_exception(PacketConflated(displaced))
+
         # No ack
         if packet.ack is None:
-            self.client_queue.put_nowait(packet)
+            queue.put_nowait(packet, priority, conflate)
             return None
 
         # Needs an ack
         acked = gevent.event.AsyncResult()
         self._acks[unicode(packet.id)] = acked
-        self.client_queue.put_nowait(packet)
-        return acked.get(timeout=timeout)
+        queue.put_nowait(packet, priority, conflate)
+        return acked
+
+    def _volatile_allowed(self):
+        monitor = self.server.monitor
+        return monitor is None or monitor.stage < SHED_VOLATILE
 
-    def _fetch_client(self, **kwargs):
-        msg = self.client_queue.get(**kwargs)
+    @property
+    def writable(self):
+        """
+        Whether a transport is waiting for packets with none queued, so a
+        packet sent now goes out right away.
+        """
+        queue = self.client_queue
+        return (self._polling > 0 or queue.on_put is not None) and queue.empty()
+
+    def _fetch_client(self, block=True, timeout=None):
+        if block:
+            self._polling += 1
+            try:
+                msg = self.client_queue.get(True, timeout)
+            finally:
+                self._polling -= 1
+        else:
+            msg = self.client_queue.get(False)
         assert msg is None or isinstance(msg, packets.Packet), "Got CLIENT message which is not a packet %r" % msg
+        if msg is not None:
+            self.last_sent = self.clock.now()
+        if isinstance(msg, packets.HeartbeatPacket):
+            # heartbeats carry no ID, so a reply is matched to the latest
+            # one; a lost reply then costs a sample instead of skewing one
+            self._heartbeat_sent = self.clock.precise()
         return msg
 
-    def handshake_string(self):
-        return "{0.session_id}:{0.heartbeat}:{0.expire}:websocket,xhr-polling".format(self)
+    def next_heartbeat(self):
+        """
+        Send a heartbeat if nothing was sent to the client for half the
+        heartbeat timeout. Any packet resets the client's heartbeat timer,
+        so while real traffic flows heartbeats are skipped, and with them
+        the samples of :attr:`rtt`. Returns the number of seconds until the
+        next check.
+        """
+        interval = self.heartbeat / 2.0
+        quiet = self.clock.now() - self.last_sent
+        server = self._server()
+        if quiet < interval:
+            if server is not None:
+                server.metrics.incr("heartbeat.suppressed")
+            return interval - quiet
+        logger.debug("Sending heartbeat for %r", self)
+        self.send(packets.HeartbeatPacket(None, None, None))
+        if server is not None:
+            server.metrics.incr("heartbeat.sent")
+        return interval
+
+    def update_rtt(self, sample):
+        """
+        Fold a round-trip time sample into the smoothed estimate and its
+        jitter, the same way TCP does (RFC 6298).
+        """
+        if self.rtt is None:
+            self.rtt = sample
+            self.rtt_jitter = sample / 2
+        else:
+            self.rtt_jitter = 0.75 * self.rtt_jitter + 0.25 * abs(self.rtt - sample)
+            self.rtt = 0.875 * self.rtt + 0.125 * sample
+        server = self._server()
+        if server is not None:
+            server.metrics.observe("session.rtt", sample)
+
+    def begin_poll(self):
+        self._open_polls += 1
+        self._polls_idle.clear()
+
+    def end_poll(self):
+        self._open_polls -= 1
+        if not self._open_polls:
+            self._polls_idle.set()
+
+    def upgrade(self, transport, timeout=None):
+        """
+        Move delivery to ``transport`` (e.g. a websocket opened for a session
+        that was polling): polls still waiting for packets are answered with
+        a noop, and polls from now on are answered right away without taking
+        packets. Returns whether the outstanding polls were answered within
+        ``timeout`` seconds; if not, polling remains the transport.
+        """
+        previous, self.transport = self.transport, transport
+        for i in range(self._polling):
+            self.client_queue.put_nowait(packets.NoopPacket(None, None, None), PRIORITY_CONTROL)
+        if not self._polls_idle.wait(timeout):
+            self.transport = previous
+            return False
+        return True
+
+    def requeue(self, packet):
+        """
+        Put back a packet taken by a transport that failed to deliver it,
+        ahead of everything else queued.
+        """
+        if self.closed:
+            return
+        self.client_queue.put_nowait(packet, PRIORITY_CONTROL)
+
+    def record_sent(self, packet, size):
+        """
+        Called by transports once they wrote ``packet``, ``size`` bytes
+        encoded, to the client.
+        """
+        if self.replay is not None and not isinstance(packet, CONTROL_PACKETS):
+            self.replay.append(packet, size=size)
+
+    def pending_packets(self):
+        """Packets queued for the client but not yet delivered."""
+        if not self.connected:
+            return []
+        return [p for p in self.client_queue.queue if p is not None]
+
+    def snapshot(self):
+        """
+        Return a JSON-serializable dict describing the session, including
+        the packets still waiting to be delivered. Packets that are not
+        valid UTF-8, like binary messages, are saved as
+        ``{"base64": <encoded packet>}``.
+        """
+        saved = []
+        for packet in self.pending_packets():
+            raw = packet.encode()
+            try:
+                saved.append(raw.decode("utf-8"))
+            except UnicodeDecodeError:
+                saved.append({"base64": base64.b64encode(raw).decode("ascii")})
+        return {
+            "session_id": self.session_id,
+            "handshake_info": self.handshake_info,
+            "expire": self.expire,
+            "heartbeat": self.heartbeat,
+            "resource": self.resource.name if self.resource is not None else None,
+            "binary": self.binary,
+            "replay_seq": self.replay.last_seq if self.replay is not None else None,
+            "packets": saved,
+        }
 
-    def packet_received(self, packet):
+    def handshake_string(self):
+        transports = ",".join(self.resource.transports) if self.resource is not None else "websocket,xhr-polling"
+        handshake = "{0.session_id}:{0.heartbeat}:{0.expire}:{1}".format(self, transports)
+        if self.binary:
+            handshake += ":binary"
+        if self.handshake_info.get("resumed"):
+            handshake += ":resumed"
+        return handshake
+
+    def _admit_inbound(self, packet, size):
+        """
+        Apply the inbound rate limits to a packet from the client. Returns
+        whether the packet should be handled.
+        """
+        limiter = self.limiter
+        delay = limiter.delay(packet.endpoint, size)
+        if delay:
+            action = limiter.action
+            self.server.metrics.incr("inbound.limited.%s" % action)
+            if action == "drop":
+                return False
+            if action == "disconnect":
+                logger.warning("Session %r exceeded its inbound rate limit, disconnecting", self)
+                self.kill()
+                return False
+            gevent.sleep(delay)
+            if not self.connected:
+                return False
+        limiter.consume(packet.endpoint, size)
+        return True
+
+    def packet_received(self, packet, size=0):
+        """
+        Handle a packet from the client; ``size`` is its encoded length in
+        bytes, used by the inbound rate limits.
+        """
         assert isinstance(packet, packets.Packet), "Trying to enqueue SERVER message that is not a packet %r" % packet
+        kind = packet.KIND
+
+        if kind == "disconnect":
+            if packet.endpoint is None:
+                logger.info("Client is disconnecting from session %r", self)
+                self.kill()
+            else:
+                logger.info("Client is disconnecting from endpoint %r of session %r", packet.endpoint, self)
+                self._endpoint_queues.get(packet.endpoint, self.server_queue).put_nowait(packet)
+            return
 
-        if packet.kind == "disconnect":
-            logger.info("Client is disconnecting from session %r", self)
-            self.kill()
+        if self.limiter is not None and not self._admit_inbound(packet, size):
             return
 
         # clear the timeout
         self.touch()
 
-        if packet.kind == "heartbeat":
+        if kind == "heartbeat":
+            if self._heartbeat_sent is not None:
+                self.update_rtt(self.clock.precise() - self._heartbeat_sent)
+                self._heartbeat_sent = None
             return
 
-        if packet.kind == "ack":
+        if kind == "ack":
             # user is waiting for an ack
             ack_event = self._acks.get(packet.ackid)
             if ack_event is not None:
                 ack_event.set(packet.args)
             return
 
+        queue = self._endpoint_queues.get(packet.endpoint, self.server_queue)
+        if kind == "connect" and packet.endpoint is not None and queue is not self.server_queue:
+            # confirm a namespace the application serves, so the client
+            # marks it as connected; others are up to the default consumer
+            self.send(packets.ConnectPacket(None, None, packet.endpoint, None))
+
         if packet.id is not None:
             if packet.ack is True: # != None, "+"
                 self.ack(packet)
 
-        return self.server_queue.put_nowait(packet)
+        # packets for endpoints nobody consumes end up in the default queue
+        return queue.put_nowait(packet)
 
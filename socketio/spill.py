@@ -0,0 +1,139 @@
+"""
+Disk-backed FIFOs for outbound packets that do not fit in memory.
+"""
+
+from __future__ import absolute_import, unicode_literals
+
+import mmap
+import os
+import struct
+import tempfile
+
+from collections import deque
+
+
+RECORD_HEADER = struct.Struct(b"!I")
+
+
+class Segment(object):
+    """
+    One append-only file of length-prefixed records, read back through a
+    memory map. The file is unlinked right after it is created, so its
+    space is given back as soon as it is closed, even after a crash.
+    """
+
+    def __init__(self, directory=None):
+        fd, path = tempfile.mkstemp(prefix="socketio-spill-", dir=directory)
+        os.unlink(path)
+        self.file = os.fdopen(fd, "w+b")
+        self.map = None
+        self.size = 0  # bytes written
+        self.offset = 0  # bytes consumed
+
+    def __iter__(self):
+        offset = self.offset
+        while offset < self.size:
+            data, offset = self._record(offset)
+            yield data
+
+    @property
+    def drained(self):
+        return self.offset >= self.size
+
+    def append(self, data):
+        self.file.write(RECORD_HEADER.pack(len(data)))
+        self.file.write(data)
+        self.size += RECORD_HEADER.size + len(data)
+
+    def _remap(self):
+        """Map everything written so far."""
+        self.file.flush()
+        if self.map is not None:
+            self.map.close()
+        self.map = mmap.mmap(self.file.fileno(), self.size, access=mmap.ACCESS_READ)
+
+    def _record(self, offset):
+        # records appended since the last remap are only mapped once the
+        # reader gets to them, so interleaved appends and reads don't remap
+        # on every read
+        start = offset + RECORD_HEADER.size
+        if self.map is None or start > len(self.map):
+            self._remap()
+        length, = RECORD_HEADER.unpack_from(self.map, offset)
+        if start + length > len(self.map):
+            self._remap()
+        return self.map[start:start + length], start + length
+
+    def peek(self):
+        return self._record(self.offset)[0]
+
+    def read(self):
+        data, self.offset = self._record(self.offset)
+        return data
+
+    def reset(self):
+        """Drop all records, truncating the file."""
+        if self.map is not None:
+            self.map.close()
+            self.map = None
+        self.file.seek(0)
+        self.file.truncate()
+        self.size = self.offset = 0
+
+    def close(self):
+        if self.map is not None:
+            self.map.close()
+            self.map = None
+        self.file.close()
+
+
+class SegmentQueue(object):
+    """
+    FIFO of byte strings stored in :class:`Segment` files of about
+    ``segment_size`` bytes each. Fully read segments are closed, and the
+    last one is truncated once drained, so disk usage follows the backlog.
+    """
+
+    def __init__(self, directory=None, segment_size=4 << 20):
+        self.directory = directory
+        self.segment_size = segment_size
+        self.segments = deque()
+        self.count = 0
+
+    def __len__(self):
+        return self.count
+
+    def __iter__(self):
+        for segment in self.segments:
+            for data in segment:
+                yield data
+
+    @property
+    def size(self):
+        """Bytes on disk not yet read."""
+        return sum(segment.size - segment.offset for segment in self.segments)
+
+    def append(self, data):
+        if not self.segments or self.segments[-1].size >= self.segment_size:
+            self.segments.append(Segment(self.directory))
+        self.segments[-1].append(data)
+        self.count += 1
+
+    def peek(self):
+        return self.segments[0].peek()
+
+    def popleft(self):
+        segment = self.segments[0]
+        data = segment.read()
+        self.count -= 1
+        if segment.drained:
+            if len(self.segments) > 1:
+                self.segments.popleft().close()
+            else:
+                segment.reset()
+        return data
+
+    def close(self):
+        while self.segments:
+            self.segments.popleft().close()
+        self.count = 0
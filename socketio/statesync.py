@@ -0,0 +1,174 @@
+"""
+Delta-encoded state updates.
+
+A :class:`StateChannel` holds a JSON document that many sessions follow.
+Instead of the full document, each session is sent a JSON merge patch
+(RFC 7386) from the last version it acknowledged. Every update is an
+event named after the channel with one argument, either::
+
+    {"v": <version>, "state": <full document>}
+
+or::
+
+    {"v": <version>, "base": <version the patch applies to>, "patch": <merge patch>}
+
+The client acknowledges it (the event is sent with an ack id) once it
+has applied it. Since merge patches use ``null`` to delete keys, the
+document itself should not contain ``null`` values.
+"""
+
+from __future__ import absolute_import, unicode_literals
+
+import weakref
+from collections import OrderedDict
+
+import anyjson as json
+
+from socketio import packets
+
+
+from logging import getLogger
+logger = getLogger("socketio.statesync")
+
+
+def merge_diff(old, new):
+    """Return the JSON merge patch that turns ``old`` into ``new``."""
+    if not isinstance(old, dict) or not isinstance(new, dict):
+        return new
+    patch = {}
+    for key, value in new.items():
+        if key not in old:
+            patch[key] = value
+        elif old[key] != value:
+            patch[key] = merge_diff(old[key], value)
+    for key in old:
+        if key not in new:
+            patch[key] = None
+    return patch
+
+
+def merge_patch(target, patch):
+    """Apply a JSON merge patch to ``target`` and return the result."""
+    if not isinstance(patch, dict):
+        return patch
+    result = dict(target) if isinstance(target, dict) else {}
+    for key, value in patch.items():
+        if value is None:
+            result.pop(key, None)
+        else:
+            result[key] = merge_patch(result.get(key), value)
+    return result
+
+
+class StateChannel(object):
+    """
+    A versioned JSON document synchronized to sessions with merge patches.
+
+    The last ``history`` versions are kept; a session whose acknowledged
+    version is older than that, or that never acknowledged one (a new or
+    reconnected session), gets the full document. So does a session whose
+    patch would be larger than ``max_patch_ratio`` times the full document.
+
+    Messages are computed once per base version and shared by all sessions
+    at that version.
+    """
+
+    def __init__(self, event, history=32, max_patch_ratio=0.5):
+        self.event = event
+        self.history = history
+        self.max_patch_ratio = max_patch_ratio
+        self.version = 0
+        self.state = None
+        self._states = OrderedDict()  # version -> document
+        self._messages = {}  # base version -> message for the current version
+        self._full_size = 0
+        self._acked = weakref.WeakKeyDictionary()  # session -> acknowledged version
+        self._pending = weakref.WeakKeyDictionary()  # session -> {version: AsyncResult}
+
+    def update(self, state):
+        """Publish a new version of the document. Returns its version number."""
+        encoded = json.dumps(state)
+        state = json.loads(encoded)  # private copy the caller can't modify
+        if self.version and state == self.state:
+            return self.version
+        self.version += 1
+        self.state = state
+        self._states[self.version] = state
+        while len(self._states) > self.history:
+            self._states.popitem(last=False)
+        self._messages = {}
+        self._full_size = len(encoded)
+        return self.version
+
+    def message_for(self, base):
+        """The message that brings a client at version ``base`` up to date."""
+        message = self._messages.get(base)
+        if message is None:
+            message = {"v": self.version, "state": self.state}
+            old = self._states.get(base)
+            if old is not None:
+                patch = merge_diff(old, self.state)
+                if len(json.dumps(patch)) <= self.max_patch_ratio * self._full_size:
+                    message = {"v": self.version, "base": base, "patch": patch}
+            self._messages[base] = message
+        return message
+
+    def acked_version(self, session):
+        return self._acked.get(session)
+
+    def sync(self, io):
+        """
+        Send the current version to the session behind the protocol object
+        ``io``, unless it already has it. Returns the message sent or
+        ``None``. A newer message replaces an older one still queued.
+        """
+        session = io.session
+        if self.version == 0 or session.closed or self._acked.get(session) == self.version:
+            return None
+        message = self.message_for(self._acked.get(session))
+        packet = packets.EventPacket(session.packet_id(), "data", io.endpoint, self.event, [message])
+        acked = session.send_async(packet, conflate=(io.endpoint, "statesync", self.event))
+
+        pending = self._pending.get(session)
+        if pending is None:
+            pending = self._pending[session] = {}
+        for version in [v for v in pending if v not in self._states]:
+            del pending[version]
+        pending[self.version] = acked
+        acked.rawlink(self._ack_callback(session, self.version))
+        if "state" in message:
+            session.server.metrics.incr("statesync.full")
+        else:
+            session.server.metrics.incr("statesync.patch")
+        return message
+
+    def _ack_callback(self, session, version):
+        ref = weakref.ref(session)
+
+        def acknowledged(result):
+            session = ref()
+            if session is None:
+                return
+            if not result.successful():  # replaced by a newer version before it was sent
+                pending = self._pending.get(session)
+                if pending is not None:
+                    pending.pop(version, None)
+                return
+            if version > self._acked.get(session, 0):
+                self._acked[session] = version
+            pending = self._pending.get(session)
+            if pending is not None:
+                for v in [v for v in pending if v <= version]:
+                    del pending[v]
+        return acknowledged
+
+    def reset(self, session):
+        """Forget what ``session`` has, e.g. when its client asks for a resync."""
+        self._acked.pop(session, None)
+        self._pending.pop(session, None)
+
+    def publish(self, state, ios):
+        """:meth:`update` the document and :meth:`sync` it to every protocol object in ``ios``."""
+        self.update(state)
+        for io in ios:
+            self.sync(io)
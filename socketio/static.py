@@ -0,0 +1,127 @@
+"""
+In-memory serving of the bundled socket.io client.
+"""
+
+from __future__ import absolute_import, unicode_literals
+
+import gzip
+import hashlib
+import io
+import os
+
+from logging import getLogger
+logger = getLogger("socketio.static")
+
+
+CLIENT_DIST = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                           "lib", "socket.io-client", "dist")
+
+CLIENT_FILES = ("socket.io.js", "socket.io.min.js")
+
+
+def _header_tokens(value):
+    """
+    Split a comma separated header into ``(token, params)`` pairs, with
+    ``token`` lowercased and ``params`` a dict of its ``;name=value``
+    parameters.
+    """
+    for item in value.split(","):
+        parts = item.split(";")
+        token = parts[0].strip().lower()
+        if not token:
+            continue
+        params = {}
+        for param in parts[1:]:
+            name, _, param_value = param.partition("=")
+            params[name.strip().lower()] = param_value.strip()
+        yield token, params
+
+
+def _accepts_gzip(accept_encoding):
+    """Whether an ``Accept-Encoding`` header allows a gzipped response."""
+    qualities = {}
+    for coding, params in _header_tokens(accept_encoding):
+        try:
+            qualities[coding] = float(params.get("q", 1))
+        except ValueError:
+            qualities[coding] = 0
+    for coding in ("gzip", "x-gzip", "*"):
+        if coding in qualities:
+            return qualities[coding] > 0
+    return False
+
+
+def _etag_matches(if_none_match, etag):
+    """
+    Whether ``etag`` is one of the entity tags of an ``If-None-Match``
+    header, compared weakly as RFC 7232 asks for that header.
+    """
+    for tag in if_none_match.split(","):
+        tag = tag.strip()
+        if tag == "*" or tag == etag:
+            return True
+        if tag.startswith("W/") and tag[2:] == etag:
+            return True
+    return False
+
+
+class StaticFile(object):
+    """
+    A file held in memory together with its gzipped variant and an ETag,
+    so that serving it costs no disk access or compression.
+    """
+
+    _cache = {}
+
+    def __init__(self, data, content_type, max_age=365 * 24 * 3600):
+        self.data = data
+        self.content_type = content_type
+        self.max_age = max_age
+        self.etag = '"%s"' % hashlib.md5(data).hexdigest()
+
+        buf = io.BytesIO()
+        with gzip.GzipFile(fileobj=buf, mode="wb", compresslevel=9, mtime=0) as f:
+            f.write(data)
+        self.gzipped = buf.getvalue()
+
+    @classmethod
+    def load(cls, path, content_type="application/javascript", max_age=365 * 24 * 3600):
+        """
+        Return the :class:`StaticFile` for ``path``, reading it only on the
+        first call. Returns ``None`` if the file does not exist; that is
+        remembered too, so a missing file costs no disk access either.
+        """
+        path = os.path.abspath(path)
+        key = path, content_type, max_age
+        try:
+            return cls._cache[key]
+        except KeyError:
+            pass
+        try:
+            with open(path, "rb") as f:
+                static = cls(f.read(), content_type, max_age)
+        except IOError:
+            logger.warning("Static file %s not found", path)
+            static = None
+        cls._cache[key] = static
+        return static
+
+    def serve(self, environ):
+        """Return ``(status, headers, body)`` answering the request."""
+        headers = [
+            ("ETag", self.etag),
+            ("Cache-Control", "public, max-age=%d" % self.max_age),
+            ("Vary", "Accept-Encoding"),
+        ]
+        if _etag_matches(environ.get("HTTP_IF_NONE_MATCH", ""), self.etag):
+            return "304 Not Modified", headers, b""
+
+        body = self.data
+        if _accepts_gzip(environ.get("HTTP_ACCEPT_ENCODING", "")):
+            body = self.gzipped
+            headers.append(("Content-Encoding", "gzip"))
+        headers += [
+            ("Content-Type", self.content_type),
+            ("Content-Length", str(len(body))),
+        ]
+        return "200 OK", headers, body
@@ -7,3 +7,20 @@ https://github.com/LearnBoost/socket.io-client/tree/master/test
 """
 
 from __future__ import absolute_import, unicode_literals
+
+
+class FakeClock(object):
+    """
+    Manually advanced replacement for :class:`socketio.clock.CoarseClock`.
+    """
+
+    def __init__(self, now=0.0):
+        self._now = now
+
+    def now(self):
+        return self._now
+
+    precise = now
+
+    def advance(self, seconds):
+        self._now += seconds
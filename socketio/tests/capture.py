@@ -0,0 +1,96 @@
+from __future__ import absolute_import, unicode_literals
+
+import os
+import tempfile
+
+from unittest import TestCase
+
+from socketio.capture import CaptureWriter, read_capture, replay, NEW_SESSION, INBOUND, OUTBOUND
+from socketio.server import SocketIOServer
+from socketio.tests.handler import HandlerTestCase, _echo_app
+
+
+class FakeSession(object):
+
+    def __init__(self, session_id):
+        self.session_id = session_id
+
+
+class CaptureFileTest(TestCase):
+
+    def setUp(self):
+        fd, self.path = tempfile.mkstemp()
+        os.close(fd)
+        self.addCleanup(os.unlink, self.path)
+
+    def test_roundtrip(self):
+        now = [10.0]
+        writer = CaptureWriter(self.path, clock=lambda: now[0])
+        writer.record(FakeSession("a"), INBOUND, "3:::ñ")
+        now[0] = 10.5
+        writer.record(FakeSession("b"), OUTBOUND, b"1::")
+        writer.record(FakeSession("a"), OUTBOUND, b"3:::x")
+        writer.close()
+        self.assertEqual(list(read_capture(self.path)), [
+            (0.0, "a", NEW_SESSION, b"a"),
+            (0.0, "a", INBOUND, "3:::ñ".encode("utf-8")),
+            (0.5, "b", NEW_SESSION, b"b"),
+            (0.5, "b", OUTBOUND, b"1::"),
+            (0.5, "a", OUTBOUND, b"3:::x"),
+        ])
+
+    def test_truncated_record(self):
+        writer = CaptureWriter(self.path)
+        writer.record(FakeSession("a"), INBOUND, b"3:::one")
+        writer.record(FakeSession("a"), INBOUND, b"3:::two")
+        writer.close()
+        with open(self.path, "rb+") as f:
+            f.truncate(os.path.getsize(self.path) - 2)
+        self.assertEqual([r[3] for r in read_capture(self.path)], [b"a", b"3:::one"])
+
+    def test_replay(self):
+        writer = CaptureWriter(self.path)
+        for i in range(10):
+            writer.record(FakeSession("s%d" % (i % 3)), INBOUND, b"3:::%d" % i)
+        writer.close()
+        server = SocketIOServer(("127.0.0.1", 0), _echo_app, policy_server=False)
+        result = replay(server, read_capture(self.path), speed=0)
+        self.assertEqual(result.sent, 10)
+        self.assertEqual(result.received, 10)
+        self.assertEqual(result.latency.count, 10)
+
+
+class ServerCaptureTest(HandlerTestCase):
+
+    def setUp(self):
+        fd, self.path = tempfile.mkstemp()
+        os.close(fd)
+        self.addCleanup(os.unlink, self.path)
+        self.server_options = {"capture": self.path}
+        super(ServerCaptureTest, self).setUp()
+
+    def test_websocket_traffic(self):
+        session_id = self.handshake()
+        client = self.websocket(session_id)
+        client.send(b"3:::hello")
+        client.receive()
+        client.send(b"\x00", opcode=8)
+        client.receive()
+        self.server.stop()
+        records = [(sid, kind, data) for offset, sid, kind, data in read_capture(self.path)]
+        sid = session_id.decode("ascii")
+        self.assertEqual(records, [
+            (sid, NEW_SESSION, session_id),
+            (sid, INBOUND, b"3:::hello"),
+            (sid, OUTBOUND, b"3:::hello"),
+        ])
+
+    def test_xhr_traffic(self):
+        session_id = self.handshake()
+        path = "/socket.io/1/xhr-polling/%s" % session_id.decode("ascii")
+        self.request(path)  # connect
+        self.request(path, method="POST", body=b"3:::hi")
+        self.assertEqual(self.request(path)[2], b"3:::hi")
+        self.server.stop()
+        self.assertEqual([(r[2], r[3]) for r in read_capture(self.path)][1:],
+                         [(INBOUND, b"3:::hi"), (OUTBOUND, b"3:::hi")])
@@ -0,0 +1,547 @@
+from __future__ import absolute_import, unicode_literals
+
+import base64
+import gc
+import gzip
+import io
+import os
+import shutil
+import struct
+import tempfile
+
+from unittest import TestCase
+
+import gevent
+from gevent import socket
+
+from socketio.packets import MessagePacket, Packet
+from socketio.ratelimit import TokenBucket, InboundLimiter
+from socketio.router import Resource
+from socketio.server import SocketIOServer
+from socketio.session import Session
+from socketio.static import StaticFile
+from socketio.tests import FakeClock
+from socketio.transports import WebsocketConnection
+
+
+def _echo_app(environ, start_response):
+    io = environ.get("socketio")
+    if io is None:
+        start_response("404 Not Found", [])
+        return [b"not found"]
+    while True:
+        packet = io.receive()
+        if packet is None:
+            return []
+        if packet.kind == "message":
+            io.send_data(packet.data)
+
+
+class WebSocketClient(object):
+    """
+    Just enough of a websocket client to talk to the server in tests.
+    """
+
+    def __init__(self, port, path, source=None):
+        self.sock = socket.create_connection(("127.0.0.1", port),
+                                             source_address=(source, 0) if source else None)
+        key = base64.b64encode(os.urandom(16))
+        self.sock.sendall(b"GET %s HTTP/1.1\r\nHost: localhost\r\nUpgrade: websocket\r\n"
+                          b"Connection: Upgrade\r\nSec-WebSocket-Key: %s\r\n"
+                          b"Sec-WebSocket-Version: 13\r\n\r\n" % (path.encode("ascii"), key))
+        self.rfile = self.sock.makefile("rb")
+        self.status = self.rfile.readline().split(b" ")[1]
+        while self.rfile.readline() not in (b"\r\n", b""):
+            pass
+
+    def send(self, payload, opcode=1):
+        self.sock.sendall(self.frame(payload, opcode))
+
+    def frame(self, payload, opcode=1):
+        mask = os.urandom(4)
+        length = len(payload)
+        if length < 126:
+            header = struct.pack(b"!BB", 0x80 | opcode, 0x80 | length)
+        else:
+            header = struct.pack(b"!BBQ", 0x80 | opcode, 0x80 | 127, length)
+        masked = bytearray(payload)
+        for i in range(length):
+            masked[i] ^= ord(mask[i % 4])
+        return header + mask + bytes(masked)
+
+    def receive(self):
+        """Return ``(opcode, payload)`` of the next frame."""
+        first, second = struct.unpack(b"!BB", self.rfile.read(2))
+        length = second & 0x7f
+        if length == 126:
+            length, = struct.unpack(b"!H", self.rfile.read(2))
+        elif length == 127:
+            length, = struct.unpack(b"!Q", self.rfile.read(8))
+        return first & 0x0f, self.rfile.read(length)
+
+    def close(self):
+        self.rfile.close()
+        self.sock.close()
+
+
+class HandlerTestCase(TestCase):
+    server_options = {}
+
+    def setUp(self):
+        self.server = SocketIOServer(("127.0.0.1", 0), _echo_app, policy_server=False,
+                                     **self.server_options)
+        self.server.start()
+
+    def tearDown(self):
+        self.server.stop()
+
+    def request(self, path, method="GET", body=b"", headers=()):
+        conn = socket.create_connection(("127.0.0.1", self.server.server_port))
+        try:
+            extra = b"".join(b"%s: %s\r\n" % header for header in headers)
+            conn.sendall(b"%s %s HTTP/1.0\r\nContent-Length: %d\r\n%s\r\n%s" % (
+                method.encode("ascii"), path.encode("ascii"), len(body), extra, body))
+            response = b""
+            while True:
+                chunk = conn.recv(65536)
+                if not chunk:
+                    break
+                response += chunk
+        finally:
+            conn.close()
+        head, _, body = response.partition(b"\r\n\r\n")
+        lines = head.split(b"\r\n")
+        headers = dict(line.split(b": ", 1) for line in lines[1:])
+        return lines[0].split(b" ", 2)[1], headers, body
+
+    def handshake(self, query=""):
+        status, headers, body = self.request("/socket.io/1/" + query)
+        self.assertEqual(status, b"200")
+        return body.split(b":")[0]
+
+    def websocket(self, session_id, resource="socket.io"):
+        client = WebSocketClient(self.server.server_port, "/%s/1/websocket/%s" % (resource, session_id))
+        self.addCleanup(client.close)
+        self.assertEqual(client.status, b"101")
+        self.assertEqual(client.receive(), (1, b"1::"))
+        return client
+
+
+class AdmissionTest(HandlerTestCase):
+    server_options = {"max_sessions": 2, "reconnect_delay": 3}
+
+    def test_unknown_session_fast_reject(self):
+        status, headers, body = self.request("/socket.io/1/xhr-polling/deadbeef")
+        self.assertEqual(status, b"200")
+        self.assertEqual(body, b"7:::1+0")
+        self.assertTrue(3 <= int(headers[b"Retry-After"]) <= 6)
+        self.assertEqual(self.server.metrics.counters["session.unknown_rejected"], 1)
+
+    def test_session_cap(self):
+        self.handshake()
+        self.handshake()
+        status, headers, body = self.request("/socket.io/1/")
+        self.assertEqual(status, b"503")
+        self.assertIn(b"Retry-After", headers)
+        self.assertEqual(len(self.server._sessions), 2)
+        self.assertEqual(self.server.metrics.counters["handshake.rejected_capacity"], 1)
+
+
+class HandshakeRateTest(HandlerTestCase):
+    server_options = {"handshake_rate": 1, "handshake_burst": 1}
+
+    def test_rate_limited(self):
+        self.handshake()
+        status, headers, body = self.request("/socket.io/1/")
+        self.assertEqual(status, b"503")
+        self.assertEqual(self.server.metrics.counters["handshake.rejected_rate"], 1)
+
+
+class BinaryMessageTest(HandlerTestCase):
+
+    def test_negotiated_in_handshake(self):
+        status, headers, body = self.request("/socket.io/1/?binary=1")
+        self.assertTrue(body.endswith(b":binary"))
+        status, headers, body = self.request("/socket.io/1/")
+        self.assertFalse(body.endswith(b":binary"))
+
+    def test_binary_roundtrip(self):
+        client = self.websocket(self.handshake("?binary=1"))
+        payload = b"\x00\xff\xfe:\x80" * 50
+        client.send(b"3:::" + payload, opcode=2)
+        self.assertEqual(client.receive(), (2, b"3:::" + payload))
+
+    def test_binary_frames_ignored_without_negotiation(self):
+        client = self.websocket(self.handshake())
+        client.send(b"3:::\x00\xff", opcode=2)
+        client.send(b"3:::text")
+        self.assertEqual(client.receive(), (1, b"3:::text"))
+
+
+class WebsocketConnectionTest(HandlerTestCase):
+
+    def test_pipelined_frames(self):
+        client = self.websocket(self.handshake())
+        client.sock.sendall(b"".join(client.frame(b"3:::%d" % i) for i in range(5)))
+        self.assertEqual([client.receive()[1] for i in range(5)],
+                         [b"3:::%d" % i for i in range(5)])
+
+    def test_server_push_wakes_connection(self):
+        session_id = self.handshake()
+        client = self.websocket(session_id)
+        session = self.server.get_session(session_id)
+        session.send(MessagePacket(None, None, None, "pushed"))
+        self.assertEqual(client.receive(), (1, b"3:::pushed"))
+
+    def test_partial_frame_does_not_block_outbound(self):
+        session_id = self.handshake()
+        client = self.websocket(session_id)
+        session = self.server.get_session(session_id)
+        frame = client.frame(b"3:::" + b"x" * 300)
+        client.sock.sendall(frame[:len(frame) // 2])
+        gevent.sleep(0.01)
+        session.send(MessagePacket(None, None, None, "pushed"))
+        with gevent.Timeout(1):
+            self.assertEqual(client.receive(), (1, b"3:::pushed"))
+        client.sock.sendall(frame[len(frame) // 2:])
+        self.assertEqual(client.receive(), (1, b"3:::" + b"x" * 300))
+
+    def test_ping_answered_alone(self):
+        client = self.websocket(self.handshake())
+        client.send(b"hi", opcode=9)
+        with gevent.Timeout(1):
+            self.assertEqual(client.receive(), (10, b"hi"))
+
+    def test_throttled_flood_stays_in_socket(self):
+        self.server.inbound_packet_limit = (20, 20)
+        self.server.max_packet_size = 1024
+        unconsumed = []
+        fill = WebsocketConnection._fill
+
+        def spy(connection):
+            fill(connection)
+            unconsumed.append(len(connection.buffer) - connection.pos)
+        WebsocketConnection._fill = spy
+        self.addCleanup(setattr, WebsocketConnection, "_fill", fill)
+
+        session_id = self.handshake()
+        client = self.websocket(session_id)
+        flood = gevent.spawn(client.sock.sendall, client.frame(b"3:::x") * 2000000)
+        self.addCleanup(flood.kill)
+        gevent.sleep(0.5)
+        self.assertGreater(self.server.metrics.counters["inbound.limited.throttle"], 0)
+        self.assertFalse(flood.ready())  # the client is held back by TCP
+        self.assertLessEqual(max(unconsumed), 1024 + 4096)
+
+    def test_client_close_kills_session(self):
+        session_id = self.handshake()
+        client = self.websocket(session_id)
+        client.send(b"", opcode=8)
+        client.receive()
+        gevent.sleep(0.01)
+        self.assertIsNone(self.server.get_session(session_id))
+
+
+class DrainTest(HandlerTestCase):
+
+    def test_clients_told_to_reconnect(self):
+        client = self.websocket(self.handshake())
+        # a session nobody polls keeps the server draining until the timeout
+        stuck = self.server.get_session(self.handshake())
+        stuck.touch()
+        stuck.send(MessagePacket(None, None, None, "stuck"))
+        drainer = gevent.spawn(self.server.drain, timeout=0.5, stagger=0.2)
+        gevent.sleep(0)
+        self.assertEqual(self.request("/socket.io/1/")[0], b"503")
+        with gevent.Timeout(1):
+            opcode, data = client.receive()
+        packet = Packet.decode(data)
+        self.assertEqual((packet.kind, packet.reason, packet.advice), ("error", "", "reconnect"))
+        self.assertEqual(stuck._fetch_client().data, "stuck")
+        with gevent.Timeout(1):
+            self.assertEqual(stuck._fetch_client().advice, "reconnect")
+        drainer.join(timeout=2)
+        self.assertEqual(self.server.metrics.counters["drain.reconnect_advised"], 2)
+
+    def test_advice_queued_behind_pending_data(self):
+        session = self.server.create_session({"QUERY_STRING": ""})
+        self.server.get_session(session.session_id)
+        for i in range(3):
+            session.send(MessagePacket(None, None, None, "pending%d" % i))
+        gevent.spawn(self.server._advise_reconnect, session.session_id, self.server.clock.precise() + 5)
+        gevent.sleep(0.01)
+        self.assertEqual(len(session.pending_packets()), 3)
+        received = []
+        with gevent.Timeout(1):
+            while not received or received[-1].kind != "error":
+                received.append(session._fetch_client())
+        self.assertEqual([p.encode() for p in received],
+                         [b"3:::pending0", b"3:::pending1", b"3:::pending2", b"7:::+0"])
+
+
+class ClientLibraryTest(HandlerTestCase):
+    CLIENT = b"var io = {};" * 100
+
+    def setUp(self):
+        self.dist = tempfile.mkdtemp()
+        with open(os.path.join(self.dist, "socket.io.js"), "wb") as f:
+            f.write(self.CLIENT)
+        self.server_options = {"client_dist": self.dist}
+        super(ClientLibraryTest, self).setUp()
+
+    def tearDown(self):
+        super(ClientLibraryTest, self).tearDown()
+        shutil.rmtree(self.dist)
+
+    def test_served_from_memory(self):
+        status, headers, body = self.request("/socket.io/socket.io.js")
+        self.assertEqual(status, b"200")
+        self.assertEqual(body, self.CLIENT)
+        self.assertIn(b"max-age=", headers[b"Cache-Control"])
+        os.unlink(os.path.join(self.dist, "socket.io.js"))
+        self.assertEqual(self.request("/socket.io/socket.io.js")[2], self.CLIENT)
+
+    def test_gzip(self):
+        status, headers, body = self.request("/socket.io/socket.io.js",
+                                             headers=[(b"Accept-Encoding", b"gzip, deflate")])
+        self.assertEqual(headers[b"Content-Encoding"], b"gzip")
+        self.assertLess(len(body), len(self.CLIENT))
+        self.assertEqual(gzip.GzipFile(fileobj=io.BytesIO(body)).read(), self.CLIENT)
+
+    def test_not_modified(self):
+        etag = self.request("/socket.io/socket.io.js")[1][b"ETag"]
+        status, headers, body = self.request("/socket.io/socket.io.js",
+                                             headers=[(b"If-None-Match", etag)])
+        self.assertEqual(status, b"304")
+        self.assertEqual(body, b"")
+
+    def test_missing_file_goes_to_application(self):
+        status, headers, body = self.request("/socket.io/socket.io.min.js")
+        self.assertEqual(status, b"404")
+
+    def test_gzip_refused(self):
+        for accept in (b"gzip;q=0, deflate", b"identity", b"*;q=0", b"gzipped"):
+            headers = self.request("/socket.io/socket.io.js", headers=[(b"Accept-Encoding", accept)])[1]
+            self.assertNotIn(b"Content-Encoding", headers, accept)
+        headers = self.request("/socket.io/socket.io.js", headers=[(b"Accept-Encoding", b"br, GZIP; q=0.5")])[1]
+        self.assertEqual(headers[b"Content-Encoding"], b"gzip")
+
+    def test_etag_list(self):
+        etag = self.request("/socket.io/socket.io.js")[1][b"ETag"]
+        for tags, status in ((b'"other", W/' + etag, b"304"), (b"*", b"304"),
+                             (b'"x' + etag[1:], b"200"), (etag[:-1] + b'x"', b"200")):
+            self.assertEqual(self.request("/socket.io/socket.io.js", headers=[(b"If-None-Match", tags)])[0],
+                             status, tags)
+
+    def test_missing_file_is_remembered(self):
+        path = os.path.join(self.dist, "socket.io.min.js")
+        self.assertIsNone(StaticFile.load(path))
+        with open(path, "wb") as f:
+            f.write(self.CLIENT)
+        self.assertIsNone(StaticFile.load(path))
+        self.assertIsNotNone(StaticFile.load(path, max_age=0))  # a different entry
+
+
+class TokenBucketTest(TestCase):
+
+    def test_refill(self):
+        clock = FakeClock()
+        bucket = TokenBucket(2, 4, clock)
+        self.assertTrue(bucket.consume(4))
+        self.assertFalse(bucket.consume())
+        self.assertEqual(bucket.delay(), 0.5)
+        clock.advance(1)
+        self.assertTrue(bucket.consume(2))
+        clock.advance(100)
+        self.assertEqual(bucket.delay(4), 0)
+        self.assertFalse(bucket.consume(5))
+
+
+class InboundLimiterTest(TestCase):
+
+    def test_combined_limits(self):
+        clock = FakeClock()
+        limiter = InboundLimiter(clock, packets=(10, 10), bytes=(100, 100), endpoint_packets=(1, 2))
+        self.assertEqual(limiter.delay("/chat", 50), 0)
+        limiter.consume("/chat", 50)
+        limiter.consume("/chat", 10)
+        self.assertEqual(limiter.delay("/chat", 10), 1.0)  # endpoint bucket is empty
+        self.assertEqual(limiter.delay(None, 80), 0.4)  # 40 bytes left
+        self.assertEqual(limiter.delay(None, 10), 0)
+
+    def test_oversized_packet_waits_for_full_bucket(self):
+        clock = FakeClock()
+        limiter = InboundLimiter(clock, bytes=(100, 100))
+        self.assertEqual(limiter.delay(None, 1000), 0)
+        limiter.consume(None, 1000)
+        self.assertEqual(limiter.delay(None, 1000), 1.0)
+
+    def test_endpoint_buckets_capped(self):
+        limiter = InboundLimiter(FakeClock(), endpoint_packets=(1, 1), max_endpoints=2)
+        for i in range(1000):
+            limiter.consume("/ns%d" % i, 1)
+        self.assertEqual(len(limiter.endpoints), 2)
+        self.assertEqual(limiter.delay("/ns1", 1), 1.0)
+        self.assertEqual(limiter.delay("/new", 1), 1.0)  # shares the exhausted overflow bucket
+
+    def test_unknown_action(self):
+        self.assertRaises(ValueError, InboundLimiter, FakeClock(), action="ignore")
+
+
+class InboundLimitTest(HandlerTestCase):
+    server_options = {"inbound_packet_limit": (1, 2), "inbound_limit_action": "drop",
+                      "inbound_yield_every": 2}
+
+    def test_excess_packets_dropped(self):
+        client = self.websocket(self.handshake())
+        client.sock.sendall(b"".join(client.frame(b"3:::%d" % i) for i in range(5)))
+        client.send(b"2::")
+        self.assertEqual(client.receive(), (1, b"3:::0"))
+        self.assertEqual(client.receive(), (1, b"3:::1"))
+        gevent.sleep(0.05)
+        self.assertEqual(self.server.metrics.counters["inbound.limited.drop"], 4)
+
+
+class InboundDisconnectTest(HandlerTestCase):
+    server_options = {"inbound_byte_limit": (100, 100), "inbound_limit_action": "disconnect"}
+
+    def test_flooding_client_disconnected(self):
+        session_id = self.handshake()
+        client = self.websocket(session_id)
+        client.send(b"3:::" + b"x" * 90)
+        client.send(b"3:::" + b"x" * 90)
+        self.assertEqual(client.receive()[1], b"3:::" + b"x" * 90)
+        gevent.sleep(0.05)
+        self.assertIsNone(self.server.get_session(session_id))
+        self.assertEqual(self.server.metrics.counters["inbound.limited.disconnect"], 1)
+
+
+class SizeLimitTest(HandlerTestCase):
+    server_options = {"max_packet_size": 100, "max_payload_size": 100}
+
+    def test_oversized_websocket_message(self):
+        session_id = self.handshake()
+        client = self.websocket(session_id)
+        client.send(b"3:::" + b"x" * 96)
+        self.assertEqual(client.receive(), (1, b"3:::" + b"x" * 96))
+        client.send(b"3:::" + b"x" * 97)
+        self.assertEqual(client.receive(), (1, b"7:::3"))
+        opcode, payload = client.receive()
+        self.assertEqual((opcode, struct.unpack(b"!H", payload[:2])[0]), (8, 1009))
+        gevent.sleep(0.01)
+        self.assertIsNone(self.server.get_session(session_id))
+        self.assertEqual(self.server.metrics.counters["inbound.oversized"], 1)
+
+    def test_oversized_post(self):
+        session_id = self.handshake().decode("ascii")
+        path = "/socket.io/1/xhr-polling/%s" % session_id
+        self.request(path)  # connect
+        status, headers, body = self.request(path, method="POST", body=b"3:::" + b"x" * 200)
+        self.assertEqual((status, body), (b"413", b"7:::3"))
+        self.assertEqual(self.request(path, method="POST", body=b"3:::ok")[2], b"1")
+        self.assertEqual(self.request(path)[2], b"3:::ok")
+
+
+class PendingHandshakeTest(HandlerTestCase):
+    server_options = {"max_pending_handshakes": 2, "handshake_timeout": 0.05}
+
+    def test_pending_cap(self):
+        first = self.handshake()
+        self.handshake()
+        status, headers, body = self.request("/socket.io/1/")
+        self.assertEqual(status, b"503")
+        self.assertEqual(self.server.metrics.counters["handshake.rejected_pending"], 1)
+        self.websocket(first)
+        self.handshake()
+
+    def test_handshake_flood_is_reaped(self):
+        gc.collect()
+        baseline = sum(1 for o in gc.get_objects() if isinstance(o, Session))
+        for i in range(10):
+            for j in range(2):
+                self.handshake()
+            gevent.sleep(0.1)
+        self.assertEqual(self.server._sessions, {})
+        self.assertEqual(self.server.pending_handshakes, set())
+        gc.collect()
+        self.assertEqual(sum(1 for o in gc.get_objects() if isinstance(o, Session)), baseline)
+
+
+class UpgradeTest(HandlerTestCase):
+    server_options = {"upgrade_timeout": 0.1}
+
+    def polling_session(self):
+        session_id = self.handshake()
+        self.assertEqual(self.request("/socket.io/1/xhr-polling/%s" % session_id)[2], b"1::")
+        return session_id, self.server.get_session(session_id)
+
+    def test_poll_released_and_delivery_moved(self):
+        session_id, session = self.polling_session()
+        poll = gevent.spawn(self.request, "/socket.io/1/xhr-polling/%s" % session_id)
+        gevent.sleep(0.05)
+        client = WebSocketClient(self.server.server_port, "/socket.io/1/websocket/%s" % session_id)
+        self.addCleanup(client.close)
+        self.assertEqual(poll.get(timeout=1)[2], b"8::")
+        for data in ("a", "b"):
+            session.send(MessagePacket(None, None, None, data))
+        self.assertEqual([client.receive() for i in range(2)], [(1, b"3:::a"), (1, b"3:::b")])
+        # a late poll gets nothing
+        session.send(MessagePacket(None, None, None, "c"))
+        self.assertEqual(self.request("/socket.io/1/xhr-polling/%s" % session_id)[2], b"8::")
+        self.assertEqual(client.receive(), (1, b"3:::c"))
+        counters = self.server.metrics.counters
+        self.assertEqual((counters["upgrade.attempted"], counters["upgrade.succeeded"]), (1, 1))
+
+    def test_upgrade_aborted_while_poll_unanswered(self):
+        session_id, session = self.polling_session()
+        session.begin_poll()  # a poll stuck writing its response
+        client = WebSocketClient(self.server.server_port, "/socket.io/1/websocket/%s" % session_id)
+        self.addCleanup(client.close)
+        self.assertEqual(client.receive()[0], 8)  # close frame
+        self.assertEqual(session.transport, "xhr-polling")
+        self.assertEqual(self.server.metrics.counters["upgrade.failed"], 1)
+        session.end_poll()
+        session.send(MessagePacket(None, None, None, "still polling"))
+        self.assertEqual(self.request("/socket.io/1/xhr-polling/%s" % session_id)[2], b"3:::still polling")
+
+    def test_requeued_packet_goes_first(self):
+        session_id, session = self.polling_session()
+        for data in ("a", "b"):
+            session.send(MessagePacket(None, None, None, data))
+        taken = session._fetch_client()
+        session.send(MessagePacket(None, None, None, "c"))
+        session.requeue(taken)
+        self.assertEqual([p.data for p in session.pending_packets()], ["a", "b", "c"])
+
+
+def _shout_app(environ, start_response):
+    io = environ["socketio"]
+    while True:
+        packet = io.receive()
+        if packet is None:
+            return []
+        io.send_data(packet.data.upper())
+
+
+class ResourcesTest(HandlerTestCase):
+    server_options = {"resources": [Resource("shout", _shout_app, transports=["websocket"], heartbeat=30)]}
+
+    def test_separate_apps_and_settings(self):
+        status, headers, body = self.request("/shout/1/")
+        session_id, heartbeat, expire, transports = body.split(b":")
+        self.assertEqual((heartbeat, transports), (b"30", b"websocket"))
+        client = self.websocket(session_id, "shout")
+        client.send(b"3:::hello")
+        self.assertEqual(client.receive(), (1, b"3:::HELLO"))
+
+        client = self.websocket(self.handshake())
+        client.send(b"3:::hello")
+        self.assertEqual(client.receive(), (1, b"3:::hello"))
+
+    def test_sessions_stay_in_their_resource(self):
+        session_id = self.handshake()
+        status, headers, body = self.request("/shout/1/websocket/%s" % session_id.decode("ascii"))
+        self.assertEqual(body, b"7:::1+0")
+        # the resource only offers websockets
+        status, headers, body = self.request("/shout/1/xhr-polling/%s" % session_id.decode("ascii"))
+        self.assertEqual(status, b"404")
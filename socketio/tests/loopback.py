@@ -0,0 +1,107 @@
+from __future__ import absolute_import, unicode_literals
+
+from unittest import TestCase
+
+import gevent
+
+from socketio.exceptions import PacketConflated
+from socketio.packets import AckPacket, EventPacket, HeartbeatPacket
+from socketio.queues import PRIORITY_LOW
+from socketio.server import SocketIOServer
+from socketio.transports import LoopbackTransport
+
+
+def echo_events(environ, start_response):
+    io = environ["socketio"]
+    while True:
+        packet = io.receive()
+        if packet is None:
+            return []
+        if packet.kind == "event" and packet.name == "burst":
+            for i in range(packet.args[0]):
+                io.emit("tick", [i], conflate="tick")
+                io.emit("cursor", [i], volatile=True)
+            io.emit("done")
+        elif packet.kind == "event":
+            io.emit(packet.name, packet.args)
+
+
+class LoopbackTransportTest(TestCase):
+
+    def setUp(self):
+        self.server = SocketIOServer(("127.0.0.1", 0), echo_events, policy_server=False)
+
+    def test_roundtrip(self):
+        client = LoopbackTransport(self.server)
+        client.connect()
+        client.send(EventPacket(None, None, None, "ping", [1, {"a": "ñ"}]))
+        packet = client.receive(timeout=1)
+        self.assertEqual((packet.name, packet.args), ("ping", [1, {"a": "ñ"}]))
+
+    def test_many_clients(self):
+        clients = [LoopbackTransport(self.server, query="n=%d" % i) for i in range(100)]
+        for i, client in enumerate(clients):
+            client.connect()
+            client.send(EventPacket(None, None, None, "n", [i]))
+        self.assertEqual([c.receive(timeout=1).args for c in clients], [[i] for i in range(100)])
+        self.assertEqual(len(self.server._sessions), 100)
+
+    def test_heartbeats_are_answered(self):
+        client = LoopbackTransport(self.server)
+        session = client.connect()
+        session.send(HeartbeatPacket(None, None, None))
+        session.send(EventPacket(None, None, None, "after", None))
+        self.assertEqual(client.receive(timeout=1).name, "after")
+        self.assertIsNotNone(session.rtt)
+
+    def test_close(self):
+        client = LoopbackTransport(self.server)
+        session = client.connect()
+        app = session.wsgi_app_greenlet
+        client.close()
+        app.join(timeout=1)
+        self.assertFalse(session.connected)
+        self.assertTrue(app.successful())
+        self.assertIsNone(client.receive(timeout=1))
+        self.assertIsNone(client.receive(timeout=1))
+
+    def test_conflated_and_volatile(self):
+        client = LoopbackTransport(self.server)
+        session = client.connect()
+        client.send(EventPacket(None, None, None, "burst", [5]))
+        gevent.sleep(0)
+        received = [client.receive(timeout=1) for i in range(2)]
+        self.assertEqual([(p.name, p.args) for p in received], [("tick", [4]), ("done", [])])
+        self.assertEqual(self.server.metrics.counters["packets.conflated"], 4)
+        self.assertEqual(self.server.metrics.counters["packets.volatile_dropped"], 5)
+
+    def test_conflated_ack_fails(self):
+        client = LoopbackTransport(self.server)
+        session = client.connect()
+        first = session.send_async(EventPacket(session.packet_id(), "data", None, "tick", [1]), conflate="t")
+        second = session.send_async(EventPacket(session.packet_id(), "data", None, "tick", [2]),
+                                    priority=PRIORITY_LOW, conflate="t")
+        self.assertRaises(PacketConflated, first.get, timeout=0)
+        packet = client.receive(timeout=1)
+        self.assertEqual(packet.args, [2])
+        client.send(AckPacket(None, None, None, packet.id, ["ok"]))
+        self.assertEqual(second.get(timeout=1), ["ok"])
+
+    def test_volatile_delivered_to_waiting_client(self):
+        client = LoopbackTransport(self.server)
+        session = client.connect()
+        receiver = gevent.spawn(client.receive, timeout=1)
+        gevent.sleep(0)
+        session.send(EventPacket(None, None, None, "cursor", [1]), volatile=True)
+        self.assertEqual(receiver.get().name, "cursor")
+
+    def test_throttled_client(self):
+        server = SocketIOServer(("127.0.0.1", 0), echo_events, policy_server=False,
+                                inbound_packet_limit=(50, 1))
+        client = LoopbackTransport(server)
+        client.connect()
+        sender = gevent.spawn(lambda: [client.send(EventPacket(None, None, None, "n", [i]))
+                                       for i in range(3)])
+        self.assertEqual([client.receive(timeout=1).args for i in range(3)], [[0], [1], [2]])
+        sender.join()
+        self.assertEqual(server.metrics.counters["inbound.limited.throttle"], 2)
@@ -0,0 +1,85 @@
+from __future__ import absolute_import, unicode_literals
+
+import time
+
+from unittest import TestCase
+
+import gevent
+
+from socketio.metrics import Metrics
+from socketio.monitor import LagMonitor, SHED_NONE, SHED_HANDSHAKES, SHED_VOLATILE, SHED_POLLS
+from socketio.packets import EventPacket
+from socketio.server import SocketIOServer
+from socketio.transports import LoopbackTransport
+from socketio.tests.loopback import echo_events
+
+
+class LagMonitorTest(TestCase):
+
+    def setUp(self):
+        self.metrics = Metrics()
+        self.monitor = LagMonitor(self.metrics, interval=0.01, thresholds=(0.05, 0.1, 0.25),
+                                  recovery=3, stall_threshold=0.03)
+        self.addCleanup(self.monitor.stop)
+
+    def test_stages(self):
+        self.monitor.observe(0.07)
+        self.assertEqual(self.monitor.stage, SHED_HANDSHAKES)
+        self.monitor.observe(0.3)
+        self.assertEqual(self.monitor.stage, SHED_POLLS)
+        self.assertEqual(self.monitor.poll_delay, 1.0)
+        for i in range(2):
+            self.monitor.observe(0.0)
+        self.monitor.observe(0.3)  # a relapse restarts the recovery
+        for i in range(3):
+            self.monitor.observe(0.0)
+        self.assertEqual(self.monitor.stage, SHED_VOLATILE)
+        self.assertEqual(self.monitor.poll_delay, 0)
+        for i in range(6):
+            self.monitor.observe(0.0)
+        self.assertEqual(self.monitor.stage, SHED_NONE)
+        self.assertEqual(self.metrics.counters["loop.shed.polls"], 1)
+        self.assertEqual(self.metrics.gauges["loop.shed_stage"], SHED_NONE)
+        self.assertEqual(self.metrics.histograms["loop.lag"].count, 14)
+
+    def test_measures_blocking(self):
+        self.monitor.start()
+        gevent.sleep(0.02)
+        time.sleep(0.15)  # blocks the hub
+        gevent.sleep(0.05)
+        self.assertGreaterEqual(self.metrics.histograms["loop.lag"].max, 0.1)
+        self.assertEqual(self.metrics.counters["loop.shed.volatile"], 1)
+
+    def test_stall_attribution(self):
+        def blocker():
+            time.sleep(0.05)
+            gevent.sleep(0)
+
+        self.monitor.start()
+        gevent.spawn(blocker).join()
+        self.monitor.stop()
+        gevent.spawn(blocker).join()  # no longer traced
+        self.assertEqual(self.metrics.counters["loop.stalls"], 1)
+        self.assertGreaterEqual(self.metrics.histograms["loop.stall"].max, 0.05)
+
+
+class SheddingTest(TestCase):
+
+    def setUp(self):
+        self.server = SocketIOServer(("127.0.0.1", 0), echo_events, policy_server=False,
+                                     lag_monitor=True, trace_stalls=False)
+
+    def test_handshakes_paused(self):
+        self.server.monitor.observe(0.06)
+        self.assertIsNotNone(self.server.admit_handshake())
+        self.assertEqual(self.server.metrics.counters["handshake.rejected_lag"], 1)
+
+    def test_volatile_dropped(self):
+        client = LoopbackTransport(self.server)
+        session = client.connect()
+        poll = gevent.spawn(client.receive)
+        self.addCleanup(poll.kill)
+        gevent.sleep(0)
+        self.server.monitor.observe(0.15)
+        session.send(EventPacket(None, None, None, "cursor", [1]), volatile=True)
+        self.assertEqual(self.server.metrics.counters["packets.volatile_dropped"], 1)
@@ -0,0 +1,49 @@
+from __future__ import absolute_import, unicode_literals
+
+from unittest import TestCase
+
+import gevent
+
+from socketio.exceptions import OffloadQueueFull
+from socketio.metrics import Metrics
+from socketio.offload import OffloadExecutor
+
+
+def _square(x):
+    return x * x
+
+
+def _fail():
+    raise KeyError("boom")
+
+
+class OffloadExecutorTest(TestCase):
+
+    def setUp(self):
+        self.metrics = Metrics()
+        self.executor = OffloadExecutor(2, queue_limit=1, metrics=self.metrics)
+
+    def tearDown(self):
+        self.executor.close()
+
+    def test_apply_returns_result(self):
+        self.assertEqual(self.executor.apply(_square, 7), 49)
+        self.assertEqual(self.metrics.counters["offload.completed"], 1)
+        self.assertEqual(self.executor.pending, 0)
+
+    def test_apply_reraises(self):
+        with self.assertRaises(KeyError):
+            self.executor.apply(_fail)
+        self.assertEqual(self.metrics.counters["offload.failed"], 1)
+
+    def test_queue_limit(self):
+        first = gevent.spawn(self.executor.apply, gevent.sleep, 0.1)
+        gevent.sleep(0)
+        with self.assertRaises(OffloadQueueFull):
+            self.executor.apply(_square, 2)
+        first.join()
+        self.assertEqual(self.metrics.counters["offload.rejected"], 1)
+
+    def test_unknown_mode(self):
+        with self.assertRaises(ValueError):
+            OffloadExecutor(mode="fiber")
@@ -11,7 +11,7 @@ from __future__ import absolute_import, unicode_literals
 from unittest import TestCase
 
 from socketio.protocol import SocketIOProtocol
-from socketio.packets import Packet, PACKET_BY_NAME
+from socketio.packets import Packet, MessagePacket, PACKET_BY_NAME
 from socketio.exceptions import DecodeError
 
 
@@ -68,6 +68,10 @@ class DecodeTest(TestCase):
         msg = Packet.decode(b'5:::{"name":"edwald","args":[{"a": "b"},2,"3"]}')
         self.assertMsg(msg, type="event", name="edwald", args=[{"a": "b"}, 2, "3"])
 
+    def test_event_with_id_and_ack(self):
+        msg = Packet.decode(b'5:1+:/chat:{"name":"tobi"}')
+        self.assertMsg(msg, type="event", id=b'1', ack="data", endpoint="/chat", name="tobi", args=[])
+
     def test_message(self):
         msg = Packet.decode(b'3:::woot')
         self.assertMsg(msg, type="message", data=b"woot")
@@ -118,6 +122,11 @@ class EncodeTest(TestCase):
         data = self._encode({"type": "error", "reason": "unauthorized", "advice": "reconnect"})
         self.assertEqual(data, b"7:::2+0")
 
+    def test_error_with_advice_only(self):
+        data = self._encode({"type": "error", "advice": "reconnect"})
+        self.assertEqual(data, b"7:::+0")
+        self.assertEqual(Packet.decode(data).advice, "reconnect")
+
     def test_error_with_endpoint(self):
         data = self._encode({"type": "error", "endpoint": "/woot"})
         self.assertEqual(data, b"7::/woot")
@@ -173,3 +182,21 @@ class EncodeTest(TestCase):
     def test_disconnect(self):
         data = self._encode({"type": "disconnect", "endpoint": "/woot"})
         self.assertEqual(data, b'0::/woot')
+
+
+class BinaryMessageTest(TestCase):
+
+    def test_roundtrip(self):
+        payload = b"\x00\x01:\xff"
+        msg = MessagePacket(b'7', "data", "/bin", payload)
+        raw = msg.encode_binary()
+        self.assertEqual(raw, b"3:7+:/bin:" + payload)
+        decoded = MessagePacket.decode_binary(bytearray(raw))
+        self.assertEqual(decoded._asdict(), msg._asdict())
+        self.assertIsInstance(decoded.data, bytes)
+
+    def test_malformed(self):
+        with self.assertRaises(DecodeError):
+            MessagePacket.decode_binary(bytearray(b"5:::\x00"))
+        with self.assertRaises(DecodeError):
+            MessagePacket.decode_binary(bytearray(b"3:"))
@@ -0,0 +1,91 @@
+from __future__ import absolute_import, unicode_literals
+
+import threading
+
+from unittest import TestCase
+
+import gevent
+
+from socketio.packets import EventPacket, MessagePacket
+from socketio.server import SocketIOServer
+from socketio.transports import LoopbackTransport
+
+
+def joining_app(environ, start_response):
+    io = environ["socketio"]
+    while True:
+        packet = io.receive()
+        if packet is None:
+            return []
+        if packet.kind == "event" and packet.name == "join":
+            io.join(packet.args[0])
+        elif packet.kind == "event" and packet.name == "leave":
+            io.leave(packet.args[0])
+
+
+def message(data):
+    return MessagePacket(None, None, None, data)
+
+
+class PushTest(TestCase):
+
+    def setUp(self):
+        self.server = SocketIOServer(("127.0.0.1", 0), joining_app, policy_server=False)
+        self.addCleanup(self.server.push_queue.close)
+        self.clients = [LoopbackTransport(self.server) for i in range(3)]
+        self.sessions = [client.connect() for client in self.clients]
+
+    def join(self, client, room):
+        client.send(EventPacket(None, None, None, "join", [room]))
+        gevent.sleep(0)
+
+    def wait_delivered(self, count):
+        counters = self.server.metrics.counters
+        with gevent.Timeout(2):
+            while counters["push.delivered"] < count:
+                gevent.sleep(0.001)
+
+    def pending(self, session):
+        return [p.data for p in session.pending_packets()]
+
+    def test_targets(self):
+        self.join(self.clients[0], "lobby")
+        self.join(self.clients[1], "lobby")
+        self.server.push(message("one"), session_id=self.sessions[2].session_id)
+        self.server.push(message("room"), room="lobby")
+        self.server.push(message("all"))
+        self.server.push(message("nobody"), session_id="unknown")
+        self.wait_delivered(4)
+        self.assertEqual([self.pending(s) for s in self.sessions],
+                         [["room", "all"], ["room", "all"], ["one", "all"]])
+        self.assertEqual(self.server.metrics.counters["push.dropped"], 1)
+        self.assertRaises(ValueError, self.server.push, EventPacket(1, "data", None, "acked", None))
+
+    def test_rooms_left_on_leave_and_kill(self):
+        self.join(self.clients[0], "lobby")
+        self.join(self.clients[1], "lobby")
+        self.clients[0].send(EventPacket(None, None, None, "leave", ["lobby"]))
+        gevent.sleep(0)
+        self.assertEqual(self.server.rooms, {"lobby": set([self.sessions[1].session_id])})
+        self.sessions[1].kill()
+        self.assertEqual(self.server.rooms, {})
+
+    def test_pushes_from_threads_are_batched(self):
+        self.join(self.clients[0], "lobby")
+
+        def pusher(n):
+            for i in range(1000):
+                self.server.push(message("%d-%d" % (n, i)), room="lobby")
+
+        threads = [threading.Thread(target=pusher, args=(n,)) for n in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.wait_delivered(4000)
+        received = self.pending(self.sessions[0])
+        self.assertEqual(len(received), 4000)
+        for n in range(4):  # every thread's pushes arrive in order
+            mine = [data for data in received if data.startswith("%d-" % n)]
+            self.assertEqual(mine, ["%d-%d" % (n, i) for i in range(1000)])
+        self.assertLess(self.server.metrics.counters["push.wakeups"], 10)
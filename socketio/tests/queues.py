@@ -0,0 +1,142 @@
+from __future__ import absolute_import, unicode_literals
+
+import os
+import shutil
+import tempfile
+
+from unittest import TestCase
+
+import gevent
+
+from socketio.packets import EventPacket, HeartbeatPacket, MessagePacket
+from socketio.queues import PacketQueue, PRIORITY_LOW, PRIORITY_NORMAL
+from socketio.spill import Segment, SegmentQueue
+
+
+def message(data):
+    return MessagePacket(None, None, None, data)
+
+
+class PacketQueueTest(TestCase):
+
+    def drain(self, queue):
+        result = []
+        while not queue.empty():
+            packet = queue.get()
+            result.append(packet.data if isinstance(packet, MessagePacket) else packet.kind)
+        return result
+
+    def test_control_packets_jump_ahead(self):
+        queue = PacketQueue()
+        queue.put_nowait(message("a"))
+        queue.put_nowait(message("b"))
+        queue.put_nowait(HeartbeatPacket(None, None, None))
+        self.assertEqual(queue.qsize(), 3)
+        self.assertEqual(self.drain(queue), ["heartbeat", "a", "b"])
+
+    def test_low_priority_is_not_starved(self):
+        queue = PacketQueue(low_priority_share=2)
+        queue.put_nowait(message("low1"), PRIORITY_LOW)
+        queue.put_nowait(message("low2"), PRIORITY_LOW)
+        for i in range(5):
+            queue.put_nowait(message(i))
+        self.assertEqual(self.drain(queue), [0, 1, "low1", 2, 3, "low2", 4])
+
+    def test_peek_matches_get(self):
+        queue = PacketQueue()
+        queue.put_nowait(message("a"))
+        queue.put_nowait(HeartbeatPacket(None, None, None))
+        self.assertIs(queue.peek(), queue.get())
+
+    def test_get_wakes_up_on_put(self):
+        queue = PacketQueue()
+        getter = gevent.spawn(queue.get)
+        gevent.sleep(0)
+        queue.put_nowait(None)
+        queue.put_nowait(message("x"))
+        self.assertIsNone(getter.get(timeout=1))
+        self.assertEqual(list(p.data for p in queue.queue), ["x"])
+
+    def test_conflation_replaces_in_place(self):
+        queue = PacketQueue()
+        queue.put_nowait(message("a"))
+        queue.put_nowait(message("tick1"), conflate="tick")
+        queue.put_nowait(message("b"))
+        self.assertTrue(queue.conflates("tick"))
+        queue.put_nowait(message("tick2"), conflate="tick")
+        self.assertEqual(queue.qsize(), 3)
+        self.assertEqual([p.data for p in queue.queue], ["a", "tick2", "b"])
+        self.assertEqual(self.drain(queue), ["a", "tick2", "b"])
+        self.assertFalse(queue.conflates("tick"))
+        queue.put_nowait(message("tick3"), conflate="tick")
+        self.assertEqual(self.drain(queue), ["tick3"])
+
+
+
+class SpillTest(TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.dir)
+
+    def test_segment_queue(self):
+        queue = SegmentQueue(self.dir, segment_size=64)
+        for i in range(20):
+            queue.append(b"record %d" % i)
+        self.assertGreater(len(queue.segments), 1)
+        self.assertEqual(list(queue), [b"record %d" % i for i in range(20)])
+        self.assertEqual(queue.peek(), b"record 0")
+        self.assertEqual([queue.popleft() for i in range(10)], [b"record %d" % i for i in range(10)])
+        queue.append(b"late")
+        self.assertEqual([queue.popleft() for i in range(11)][-1], b"late")
+        self.assertEqual((len(queue), len(queue.segments), queue.size), (0, 1, 0))
+        self.assertEqual(os.listdir(self.dir), [])  # files are unlinked up front
+
+    def test_interleaved_reads_remap_rarely(self):
+        segment = Segment(self.dir)
+        self.addCleanup(segment.close)
+        remaps = []
+        remap = segment._remap
+        segment._remap = lambda: remaps.append(segment.size) or remap()
+        for i in range(10):
+            segment.append(b"record %d" % i)
+        read = []
+        for i in range(10, 60):
+            read.append(segment.read())
+            segment.append(b"record %d" % i)
+        read += [segment.read() for i in range(10)]
+        self.assertEqual(read, [b"record %d" % i for i in range(60)])
+        self.assertTrue(segment.drained)
+        self.assertEqual(len(remaps), 6)  # once per backlog read, not once per read
+
+    def test_overflow_spills_in_order(self):
+        queue = PacketQueue()
+        queue.spill(3, self.dir)
+        for i in range(10):
+            queue.put_nowait(message("m%d" % i))
+        queue.put_nowait(HeartbeatPacket(None, None, None))
+        self.assertEqual((queue.qsize(), queue.spilled), (11, 7))
+        self.assertEqual(len(queue.queue.levels[PRIORITY_NORMAL].memory), 3)
+        self.assertEqual(self.drain(queue)[:4], ["heartbeat", "m0", "m1", "m2"])
+
+    def test_types_survive_spilling(self):
+        queue = PacketQueue()
+        queue.spill(0, self.dir)
+        queue.put_nowait(message("ñ"))
+        queue.put_nowait(message(b"\x00\xff"))
+        queue.put_nowait(EventPacket(5, "data", "/chat", "tick", [1]))
+        text, raw, event = [queue.get() for i in range(3)]
+        self.assertEqual((text.data, type(text.data)), ("ñ", unicode))
+        self.assertEqual(raw.data, b"\x00\xff")
+        self.assertEqual(event.encode(), b'5:5+:/chat:{"name": "tick", "args": [1]}')
+
+    def test_conflation_stops_at_disk(self):
+        queue = PacketQueue()
+        queue.spill(1, self.dir)
+        queue.put_nowait(message("a"), conflate="k")
+        queue.put_nowait(message("b"), conflate="k")
+        queue.put_nowait(message("c"), conflate="j")
+        queue.put_nowait(message("d"), conflate="j")
+        self.assertEqual(self.drain(queue), ["b", "c", "d"])
+
+    drain = PacketQueueTest.__dict__["drain"]
@@ -0,0 +1,121 @@
+from __future__ import absolute_import, unicode_literals
+
+from unittest import TestCase
+
+from socketio.packets import MessagePacket
+from socketio.replay import ReplayBuffer
+from socketio.server import SocketIOServer
+from socketio.tests import FakeClock
+
+
+def message(data):
+    return MessagePacket(None, None, None, data)
+
+
+class ReplayBufferTest(TestCase):
+
+    def setUp(self):
+        self.clock = FakeClock()
+
+    def test_since(self):
+        replay = ReplayBuffer(self.clock)
+        for i in range(5):
+            replay.append(message(i))
+        self.assertEqual([p.data for p in replay.since(2)], [2, 3, 4])
+        self.assertEqual(replay.since(5), [])
+        self.assertIsNone(replay.since(6))
+
+    def test_caps(self):
+        replay = ReplayBuffer(self.clock, max_packets=3)
+        for i in range(5):
+            replay.append(message(i))
+        self.assertEqual(len(replay), 3)
+        self.assertIsNone(replay.since(1))
+        self.assertEqual([p.data for p in replay.since(2)], [2, 3, 4])
+
+        replay = ReplayBuffer(self.clock, max_bytes=len(message("x").encode()) * 2)
+        for i in range(5):
+            replay.append(message("x"))
+        self.assertEqual(len(replay), 2)
+
+    def test_ttl(self):
+        replay = ReplayBuffer(self.clock, ttl=10)
+        replay.append(message("old"))
+        self.clock.advance(6)
+        replay.append(message("new"))
+        self.clock.advance(6)
+        self.assertIsNone(replay.since(0))
+        self.assertEqual([p.data for p in replay.since(1)], ["new"])
+
+    def test_rewind(self):
+        replay = ReplayBuffer(self.clock)
+        for i in range(4):
+            replay.append(message(i), delivered=i < 2)
+        self.assertEqual(replay.delivered_seq, 2)
+        self.assertEqual([p.data for p in replay.rewind(2)], [2, 3])
+        self.assertEqual((replay.last_seq, len(replay)), (2, 2))
+        self.assertEqual(replay.append(message(2)), 3)
+
+    def test_append_with_known_size(self):
+        replay = ReplayBuffer(self.clock)
+        replay.append(message("x" * 100), size=5)
+        self.assertEqual(replay.size, 5)
+
+
+class ResumeTest(TestCase):
+
+    def setUp(self):
+        self.server = SocketIOServer(("127.0.0.1", 0), None, policy_server=False,
+                                     clock=FakeClock(), replay_buffer=10)
+
+    def connect(self, query=""):
+        session = self.server.create_session({"QUERY_STRING": query})
+        self.server.get_session(session.session_id)
+        return session
+
+    def deliver(self, session):
+        """Hand the next queued packet to the client, as a transport would."""
+        packet = session._fetch_client()
+        session.record_sent(packet, len(packet.encode()))
+
+    def test_resume_replays_missed_packets(self):
+        old = self.connect()
+        for i in range(3):
+            old.send(message(i))
+        self.deliver(old)
+        old.kill()
+
+        new = self.connect("resume=%s&seq=1" % old.session_id)
+        self.assertTrue(new.handshake_info["resumed"])
+        self.assertTrue(new.handshake_string().endswith(":resumed"))
+        self.assertEqual([p.data for p in new.pending_packets()], [1, 2])
+        self.assertEqual(self.server.metrics.counters["replay.replayed_packets"], 2)
+
+    def test_resume_with_explicit_seq_of_live_session(self):
+        old = self.connect()
+        for i in range(3):
+            old.send(message(i))
+            self.deliver(old)
+
+        new = self.connect("resume=%s&seq=1" % old.session_id)
+        self.assertNotIn(old.session_id, self.server._sessions)
+        self.assertEqual([p.data for p in new.pending_packets()], [1, 2])
+        self.deliver(new)  # redelivered packets keep their numbers
+        self.assertEqual(new.replay.last_seq, 2)
+
+    def test_resume_without_seq_needs_full_state(self):
+        old = self.connect()
+        old.send(message(0))
+        self.deliver(old)
+
+        new = self.connect("resume=%s" % old.session_id)
+        self.assertFalse(new.handshake_info["resumed"])
+        self.assertFalse(new.handshake_string().endswith(":resumed"))
+        self.assertEqual(new.pending_packets(), [])
+        self.assertEqual(new.replay.last_seq, 0)
+
+    def test_unknown_session_needs_full_state(self):
+        new = self.connect("resume=nope")
+        self.assertFalse(new.handshake_info["resumed"])
+        self.assertEqual(new.pending_packets(), [])
+        self.assertEqual(self.server.metrics.counters["replay.resume_failed"], 1)
@@ -0,0 +1,35 @@
+from __future__ import absolute_import, unicode_literals
+
+from unittest import TestCase
+
+from socketio.router import Resource, Router, Route, HANDSHAKE, TRANSPORT, CLIENT
+
+WEBSOCKET, POLLING = object(), object()
+
+
+class RouterTest(TestCase):
+
+    def setUp(self):
+        self.router = Router({"websocket": WEBSOCKET, "xhr-polling": POLLING})
+        self.default = self.router.add(Resource("socket.io"))
+        self.games = self.router.add(Resource("/games/socket.io/", transports=["websocket"]))
+
+    def test_routes(self):
+        match = self.router.match
+        self.assertEqual(match("/socket.io/1/"), Route(HANDSHAKE, self.default, None, None, None))
+        self.assertEqual(match("/socket.io/1/xhr-polling/abc"), Route(TRANSPORT, self.default, POLLING, "abc", None))
+        self.assertEqual(match("/socket.io/1/websocket/abc/"), Route(TRANSPORT, self.default, WEBSOCKET, "abc", None))
+        self.assertEqual(match("/socket.io/socket.io.min.js"), Route(CLIENT, self.default, None, None, "socket.io.min.js"))
+        self.assertEqual(match("/games/socket.io/1/"), Route(HANDSHAKE, self.games, None, None, None))
+        self.assertEqual(match("/games/socket.io/1/websocket/abc").resource, self.games)
+
+    def test_no_match(self):
+        for path in ("/", "", "socket.io/1/", "/socket.io", "/socket.io/1", "/socket.io/2/",
+                     "/socket.io/1/websocket/", "/socket.io/1/flashsocket/abc",
+                     "/socket.io/1/websocket/abc/extra", "/socket.io/other.js", "/games/1/",
+                     "/games/socket.io/1/xhr-polling/abc", "/index.html"):
+            self.assertIsNone(self.router.match(path), path)
+
+    def test_invalid_resources(self):
+        self.assertRaises(ValueError, self.router.add, Resource("socket.io"))
+        self.assertRaises(ValueError, self.router.add, Resource("other", transports=["flashsocket"]))
@@ -0,0 +1,282 @@
+from __future__ import absolute_import, unicode_literals
+
+import os
+import shutil
+import tempfile
+
+from unittest import TestCase
+
+import gevent
+import anyjson as json
+
+from socketio.clock import CoarseClock
+from socketio.metrics import Metrics
+from socketio.packets import EventPacket, HeartbeatPacket, MessagePacket, Packet
+from socketio.protocol import PySocketProtocol
+from socketio.queues import PRIORITY_NORMAL
+from socketio.server import SocketIOServer
+from socketio.session import Session
+from socketio.tests import FakeClock
+
+
+class FakeServer(object):
+
+    def __init__(self, clock):
+        self.clock = clock
+        self.metrics = Metrics()
+        self._sessions = {}
+        self.pending_handshakes = set()
+        self.monitor = None
+
+    def add_session(self, **kwargs):
+        session = Session(self, {"query": {}}, **kwargs)
+        self._sessions[session.session_id] = session
+        return session
+
+
+class SessionExpiryTest(TestCase):
+
+    def setUp(self):
+        self.clock = FakeClock(1000.0)
+        self.server = FakeServer(self.clock)
+        self.session = self.server.add_session(expire=10)
+        self.session.touch()
+
+    def tearDown(self):
+        greenlet = getattr(self.session, "expire_greenlet", None)
+        if greenlet is not None:
+            greenlet.kill()
+
+    def test_alive_session_reports_remaining_time(self):
+        self.clock.advance(4)
+        self.assertEqual(self.session.expire_greenlet.check(self.session), 6)
+        self.assertTrue(self.session.connected)
+
+    def test_touch_extends_lifetime(self):
+        self.clock.advance(8)
+        self.session.touch()
+        self.clock.advance(8)
+        self.assertEqual(self.session.expire_greenlet.check(self.session), 2)
+
+    def test_idle_session_expires(self):
+        greenlet = self.session.expire_greenlet
+        self.clock.advance(11)
+        self.assertIsNone(greenlet.check(self.session))
+        self.assertEqual(self.session.state, Session.STATE_DISCONNECTING)
+        self.assertNotIn(self.session.session_id, self.server._sessions)
+
+
+class HandshakeTimeoutTest(TestCase):
+
+    def setUp(self):
+        self.clock = FakeClock(1000.0)
+        self.server = FakeServer(self.clock)
+        self.session = self.server.add_session(expire=10, handshake_timeout=3)
+        self.server.pending_handshakes.add(self.session.session_id)
+
+    def tearDown(self):
+        greenlet = getattr(self.session, "expire_greenlet", None)
+        if greenlet is not None:
+            greenlet.kill()
+
+    def test_unconnected_session_reaped(self):
+        greenlet = self.session.expire_greenlet
+        self.clock.advance(2)
+        self.assertEqual(greenlet.check(self.session), 1)
+        self.clock.advance(2)
+        self.assertIsNone(greenlet.check(self.session))
+        self.assertTrue(self.session.closed)
+        self.assertEqual(self.server._sessions, {})
+        self.assertEqual(self.server.pending_handshakes, set())
+
+    def test_connected_session_uses_expire(self):
+        self.clock.advance(2)
+        self.session.touch()
+        self.assertEqual(self.server.pending_handshakes, set())
+        self.clock.advance(2)
+        self.assertEqual(self.session.expire_greenlet.check(self.session), 8)
+
+
+class CoarseClockTest(TestCase):
+
+    def test_cached_within_loop_iteration(self):
+        ticks = iter(range(100))
+        clock = CoarseClock(source=lambda: next(ticks))
+        first = clock.now()
+        self.assertEqual(clock.now(), first)
+        gevent.sleep(0)
+        self.assertGreater(clock.now(), first)
+        self.assertGreater(clock.precise(), clock.now())
+
+
+class SessionSnapshotTest(TestCase):
+
+    def setUp(self):
+        self.clock = FakeClock()
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_snapshot_roundtrip(self):
+        session = FakeServer(self.clock).add_session(expire=30, heartbeat=20)
+        session.touch()
+        session.send(MessagePacket(None, None, None, "hello"))
+        session.send(EventPacket(None, None, "/chat", "tick", [1, 2]))
+
+        data = json.loads(json.dumps(session.snapshot()))
+        restored = Session.from_snapshot(FakeServer(self.clock), data)
+
+        self.assertEqual(restored.session_id, session.session_id)
+        self.assertEqual((restored.expire, restored.heartbeat), (30, 20))
+        self.assertTrue(restored.connected and restored.connection_confirmed)
+        self.assertEqual([p.encode() for p in restored.pending_packets()],
+                         [p.encode() for p in session.pending_packets()])
+
+    def test_snapshot_binary_message(self):
+        session = FakeServer(self.clock).add_session()
+        payload = bytes(bytearray(range(256)))
+        session.send(MessagePacket(None, None, None, payload))
+        session.send(MessagePacket(None, None, None, "text"))
+
+        data = json.loads(json.dumps(session.snapshot()))
+        self.assertIn("base64", data["packets"][0])
+        restored = Session.from_snapshot(FakeServer(self.clock), data)
+        self.assertEqual([p.data for p in restored.pending_packets()], [payload, "text"])
+
+    def test_server_save_and_restore(self):
+        path = os.path.join(self.tmpdir, "sessions.jsonl")
+        options = dict(policy_server=False, binary_messages=True, inbound_packet_limit=(10, 10),
+                       spill_threshold=100, spill_dir=self.tmpdir, replay_buffer=10, handshake_timeout=3)
+        old = SocketIOServer(("127.0.0.1", 0), None, **options)
+        session = old.create_session({"QUERY_STRING": "user=1&binary=1"})
+        old.get_session(session.session_id)
+        session.send(MessagePacket(None, None, None, "delivered"))
+        session.record_sent(session._fetch_client(block=False), 12)
+        session.send(MessagePacket(None, None, None, b"\xff\x00"))
+        old.create_session({"QUERY_STRING": ""})  # never connected, not saved
+        self.assertEqual(old.save_sessions(path), 1)
+
+        new = SocketIOServer(("127.0.0.1", 0), None, **options)
+        self.assertEqual(new.restore_sessions(path), 1)
+        restored = new.get_session(session.session_id)
+        self.assertEqual(restored.handshake_info, {"query": {"user": "1", "binary": "1"}})
+        self.assertTrue(restored.binary)
+        self.assertIsNotNone(restored.limiter)
+        self.assertIsNotNone(restored.client_queue.queue.levels[PRIORITY_NORMAL].spilled)
+        self.assertEqual(restored.replay.last_seq, 1)  # the client's numbering goes on
+        self.assertEqual(restored.handshake_timeout, 3)
+        packet = restored._fetch_client(block=False)
+        self.assertEqual(packet.data, b"\xff\x00")
+        restored.record_sent(packet, 6)
+        self.assertEqual(restored.replay.last_seq, 2)
+
+
+class EndpointQueuesTest(TestCase):
+
+    def setUp(self):
+        self.server = FakeServer(FakeClock())
+        self.session = self.server.add_session()
+        self.session.touch()
+
+    def test_packets_routed_per_endpoint(self):
+        self.session.endpoint_queue("/chat")
+        self.session.packet_received(Packet.decode(b"1::/chat"))
+        self.session.packet_received(Packet.decode(b"3::/chat:hello"))
+        self.session.packet_received(Packet.decode(b"3:::default"))
+
+        self.assertEqual(self.session.receive(block=False).data, "default")
+        self.assertEqual(self.session.receive("/chat", block=False).kind, "connect")
+        self.assertEqual(self.session.receive("/chat", block=False).data, "hello")
+        # the namespace connection is confirmed to the client
+        self.assertEqual(self.session._fetch_client(block=False).encode(), b"1::/chat")
+
+    def test_unconnected_endpoint_falls_back_to_default(self):
+        self.session.packet_received(Packet.decode(b"3::/other:x"))
+        self.assertEqual(self.session.receive(block=False).endpoint, "/other")
+
+    def test_connected_but_unconsumed_endpoints(self):
+        for i in range(1000):
+            self.session.packet_received(Packet.decode(b"1::/ns%d" % i))
+            self.session.packet_received(Packet.decode(b"3::/ns%d:x" % i))
+        self.assertEqual(list(self.session._endpoint_queues), [None])
+        self.assertEqual(self.session.server_queue.qsize(), 2000)
+        self.assertEqual(self.session.pending_packets(), [])  # nobody serves them, no confirmation
+
+    def test_of_serves_endpoint(self):
+        chat = PySocketProtocol(self.session).of("/chat")
+        self.session.packet_received(Packet.decode(b"1::/chat"))
+        self.assertEqual(chat.receive(timeout=0.1).kind, "connect")
+        self.assertEqual(self.session._fetch_client(block=False).encode(), b"1::/chat")
+
+    def test_endpoint_disconnect_keeps_session(self):
+        self.session.endpoint_queue("/chat")
+        self.session.packet_received(Packet.decode(b"0::/chat"))
+        self.assertEqual(self.session.receive("/chat", block=False).kind, "disconnect")
+        self.assertTrue(self.session.connected)
+
+    def test_kill_wakes_all_consumers(self):
+        consumers = [gevent.spawn(self.session.receive, endpoint) for endpoint in (None, "/a", "/b")]
+        gevent.sleep(0)
+        self.session.kill()
+        self.assertEqual([c.get(timeout=1) for c in consumers], [None, None, None])
+
+
+class RoundTripTimeTest(TestCase):
+
+    def setUp(self):
+        self.clock = FakeClock()
+        self.server = FakeServer(self.clock)
+        self.session = self.server.add_session()
+        self.session.touch()
+
+    def heartbeat(self, rtt):
+        self.session.send(HeartbeatPacket(None, None, None))
+        self.session._fetch_client(block=False)
+        self.clock.advance(rtt)
+        self.session.packet_received(HeartbeatPacket(None, None, None))
+
+    def test_smoothed_estimate(self):
+        self.assertIsNone(self.session.rtt)
+        self.heartbeat(0.2)
+        self.assertAlmostEqual(self.session.rtt, 0.2)
+        self.assertAlmostEqual(self.session.rtt_jitter, 0.1)
+        self.heartbeat(0.6)
+        self.assertAlmostEqual(self.session.rtt, 0.25)
+        self.assertAlmostEqual(self.session.rtt_jitter, 0.175)
+        self.assertEqual(self.server.metrics.histograms["session.rtt"].count, 2)
+
+    def test_lost_reply(self):
+        self.session.send(HeartbeatPacket(None, None, None))
+        self.session._fetch_client(block=False)
+        self.clock.advance(10)  # the reply never comes
+        self.heartbeat(0.2)
+        self.assertAlmostEqual(self.session.rtt, 0.2)
+
+    def test_unsolicited_heartbeat_is_ignored(self):
+        self.session.packet_received(HeartbeatPacket(None, None, None))
+        self.assertIsNone(self.session.rtt)
+
+
+class AdaptiveHeartbeatTest(TestCase):
+
+    def setUp(self):
+        self.clock = FakeClock()
+        self.server = FakeServer(self.clock)
+        self.session = self.server.add_session(heartbeat=10)
+        self.session.touch()
+
+    def test_quiet_session_gets_heartbeat(self):
+        self.clock.advance(5)
+        self.assertEqual(self.session.next_heartbeat(), 5)
+        self.assertEqual(self.session._fetch_client(block=False).kind, "heartbeat")
+        self.assertEqual(self.server.metrics.counters["heartbeat.sent"], 1)
+
+    def test_heartbeat_suppressed_by_traffic(self):
+        self.clock.advance(3)
+        self.session.send(MessagePacket(None, None, None, "data"))
+        self.session._fetch_client(block=False)
+        self.clock.advance(3)
+        self.assertEqual(self.session.next_heartbeat(), 2)
+        self.assertTrue(self.session.client_queue.empty())
+        self.assertEqual(self.server.metrics.counters["heartbeat.suppressed"], 1)
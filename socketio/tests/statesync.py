@@ -0,0 +1,120 @@
+from __future__ import absolute_import, unicode_literals
+
+from unittest import TestCase
+
+import gevent
+
+from socketio.packets import AckPacket
+from socketio.protocol import SocketIOProtocol
+from socketio.server import SocketIOServer
+from socketio.statesync import StateChannel, merge_diff, merge_patch
+from socketio.transports import LoopbackTransport
+
+
+def idle_app(environ, start_response):
+    io = environ["socketio"]
+    while io.receive() is not None:
+        pass
+    return []
+
+
+class MergePatchTest(TestCase):
+
+    def test_diff_roundtrip(self):
+        old = {"a": 1, "b": {"c": 2, "d": 3}, "e": [1, 2], "gone": True}
+        new = {"a": 1, "b": {"c": 2, "d": 4}, "e": [1, 2, 3], "added": "x"}
+        patch = merge_diff(old, new)
+        self.assertEqual(patch, {"b": {"d": 4}, "e": [1, 2, 3], "added": "x", "gone": None})
+        self.assertEqual(merge_patch(old, patch), new)
+
+    def test_non_object_replaces(self):
+        self.assertEqual(merge_diff({"a": 1}, [1]), [1])
+        self.assertEqual(merge_patch({"a": 1}, [1]), [1])
+
+
+class StateChannelTest(TestCase):
+
+    def setUp(self):
+        self.server = SocketIOServer(("127.0.0.1", 0), idle_app, policy_server=False)
+        self.channel = StateChannel("dashboard")
+        self.state = dict(("metric%d" % i, i) for i in range(50))
+
+    def connect(self):
+        client = LoopbackTransport(self.server)
+        return client, SocketIOProtocol(client.connect())
+
+    def receive(self, client, ack=True):
+        packet = client.receive(timeout=1)
+        self.assertEqual(packet.name, "dashboard")
+        if ack:
+            client.send(AckPacket(None, None, None, packet.id, []))
+            gevent.sleep(0)
+        return packet.args[0]
+
+    def test_full_then_patch(self):
+        client, io = self.connect()
+        self.channel.update(self.state)
+        self.channel.sync(io)
+        self.assertEqual(self.receive(client), {"v": 1, "state": self.state})
+        self.assertEqual(self.channel.acked_version(io.session), 1)
+
+        self.state["metric3"] = 300
+        self.channel.update(self.state)
+        self.channel.sync(io)
+        self.assertEqual(self.receive(client), {"v": 2, "base": 1, "patch": {"metric3": 300}})
+        self.assertIsNone(self.channel.sync(io))
+
+    def test_unacked_base_gets_patch_from_last_ack(self):
+        client, io = self.connect()
+        self.channel.update(self.state)
+        self.channel.sync(io)
+        self.receive(client)
+        for i in range(2):
+            self.state["metric0"] = i + 10
+            self.channel.update(self.state)
+            self.channel.sync(io)
+            message = self.receive(client, ack=False)
+        self.assertEqual(message, {"v": 3, "base": 1, "patch": {"metric0": 11}})
+
+    def test_reconnect_gets_full_state(self):
+        client, io = self.connect()
+        self.channel.update(self.state)
+        self.channel.sync(io)
+        self.receive(client)
+        client.close()
+        client, io = self.connect()
+        self.channel.sync(io)
+        self.assertEqual(self.receive(client), {"v": 1, "state": self.state})
+
+    def test_large_patch_falls_back_to_full(self):
+        client, io = self.connect()
+        self.channel.update(self.state)
+        self.channel.sync(io)
+        self.receive(client)
+        self.channel.update(dict((k, v + 1) for k, v in self.state.items()))
+        self.channel.sync(io)
+        self.assertIn("state", self.receive(client))
+        self.assertEqual(self.server.metrics.counters["statesync.full"], 2)
+
+    def test_messages_shared_between_sessions(self):
+        ios = [self.connect() for i in range(3)]
+        self.channel.publish(self.state, [io for client, io in ios])
+        for client, io in ios:
+            self.receive(client)
+        self.state["metric1"] = -1
+        sent = []
+        self.channel.update(self.state)
+        for client, io in ios:
+            sent.append(self.channel.sync(io))
+        self.assertIs(sent[0], sent[1])
+        self.assertIs(sent[1], sent[2])
+        self.assertEqual(self.server.metrics.counters["statesync.patch"], 3)
+
+    def test_queued_update_is_replaced(self):
+        client, io = self.connect()
+        for i in range(3):
+            self.state["metric0"] = i
+            self.channel.update(self.state)
+            self.channel.sync(io)
+        self.assertEqual(self.receive(client)["v"], 3)
+        self.assertEqual(io.session.client_queue.qsize(), 0)
@@ -11,6 +11,7 @@ TODO: use selenium to auto-open the browsers.
 """
 
 from socketio.server import SocketIOServer
+from socketio.static import StaticFile, CLIENT_DIST
 import gevent.pywsgi
 import gevent.pool
 import os.path
@@ -27,9 +28,13 @@ def serve_statics(env, start_response):
         start_response("200 OK", [("Content-Type", "text/html")])
         return [INDEX_PAGE]
     elif path == "/socket.io/socket.io.js":
-        start_response("200 OK", [("Content-Type", "text/javascript")])
-        DIST = os.path.join(PROJECT_BASE, "lib", "socket.io-client", "dist")
-        return open(os.path.join(DIST, "socket.io.js"))
+        static = StaticFile.load(os.path.join(CLIENT_DIST, "socket.io.js"))
+        if static is None:
+            start_response("404 Not Found", [("Content-Type", "text/plain")])
+            return [b"socket.io.js not built"]
+        status, headers, body = static.serve(env)
+        start_response(status, headers)
+        return [body]
     elif path == "/favicon.ico":
         start_response("404 Not Found", [("Content-Type", "text/plain")])
     else:
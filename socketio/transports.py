@@ -1,12 +1,19 @@
 from __future__ import absolute_import, unicode_literals
 
+import errno
+import struct
+
 import gevent
 import weakref
+from socket import error as socket_error
 from logging import getLogger
 
+from gevent.event import Event
 from gevent.queue import Empty
-from socketio import packets
-from geventwebsocket.exceptions import WebSocketError
+from socketio import packets, protocol
+from socketio.capture import INBOUND, OUTBOUND, BINARY
+from socketio.exceptions import PacketTooLarge
+from geventwebsocket.exceptions import ProtocolError, WebSocketError
 
 
 logger = getLogger("socketio.transports")
@@ -30,11 +37,14 @@ class BaseTransport(object):
         self.write(packet.encode())
 
     def write(self, data):
-        if 'Content-Length' not in self.handler().response_headers_list:
-            self.handler().response_headers.append(('Content-Length', len(data)))
-            self.handler().response_headers_list.append('Content-Length')
+        handler = self.handler()
+        if not isinstance(data, bytes):
+            data = data.encode("utf-8")
+        if not handler.headers_sent and handler.provided_content_length is None:
+            handler.provided_content_length = str(len(data))
+            handler.response_headers.append((str('Content-Length'), handler.provided_content_length))
 
-        self.handler().write(data)
+        handler.write(data)
 
     def start_response(self, status, headers, **kwargs):
         if "Content-Type" not in [x[0] for x in headers]:
@@ -56,21 +66,81 @@ class XHRPollingTransport(BaseTransport):
     def get(self, session):
         session.touch();
 
+        if session.transport == "websocket":
+            # the session was upgraded, packets go to the other transport
+            self.start_response("200 OK", [("Connection", "close")])
+            self.write_packet(packets.NoopPacket(None, None, None))
+            return []
+
+        session.begin_poll()
+        try:
+            return self._poll(session)
+        finally:
+            session.end_poll()
+
+    def _poll(self, session):
+        monitor = session.server.monitor
+        if monitor is not None and monitor.poll_delay:
+            gevent.sleep(monitor.poll_delay)
+
         try:
             message = session._fetch_client(timeout=5.0)
         except Empty:
-            message = packets.NoopPacket()
+            message = packets.NoopPacket(None, None, None)
+
+        data = message.encode()
+        capture = session.server.capture
+        if capture is not None:
+            capture.record(session, OUTBOUND, data)
 
-        self.start_response("200 OK", [])
-        self.write_packet(message)
+        try:
+            self.start_response("200 OK", [])
+            self.write(data)
+            session.record_sent(message, len(data))
+        except socket_error:
+            # the client went away, e.g. it upgraded and gave up on this poll
+            if message is not None and not isinstance(message, packets.NoopPacket):
+                session.requeue(message)
+                session.server.metrics.incr("packets.requeued")
+            raise
         return []
 
-    def _request_body(self):
-        return self.handler().wsgi_input.readline()
+    def _request_body(self, limit):
+        """
+        Read the posted packet, raising :class:`PacketTooLarge` without
+        reading it if it is larger than ``limit`` bytes.
+        """
+        handler = self.handler()
+        if limit is None:
+            return handler.wsgi_input.readline()
+        length = handler.environ.get("CONTENT_LENGTH")
+        if length and length.isdigit() and int(length) > limit:
+            raise PacketTooLarge(int(length))
+        data = handler.wsgi_input.readline(limit + 1)
+        if len(data) > limit:
+            raise PacketTooLarge(len(data))
+        return data
+
+    def _reject_payload(self, session, error):
+        logger.warning("Rejecting %d byte payload for session %r", error.args[0], session)
+        session.server.metrics.incr("inbound.oversized")
+        handler = self.handler()
+        handler.close_connection = True  # the rest of the body is never read
+        self.start_response("413 Request Entity Too Large", [("Connection", "close")])
+        self.write_packet(packets.ErrorPacket(None, None, None, "packet too large", None))
+        return []
 
     def post(self, session):
-        packet = packets.Packet.decode(self._request_body())
-        session.packet_received(packet)
+        try:
+            data = self._request_body(session.server.max_payload_size)
+        except PacketTooLarge as e:
+            return self._reject_payload(session, e)
+        capture = session.server.capture
+        if capture is not None:
+            capture.record(session, INBOUND, data)
+
+        packet = packets.Packet.decode(data)
+        session.packet_received(packet, len(data))
 
         self.start_response("200 OK", [
             ("Connection", "close"),
@@ -81,6 +151,8 @@ class XHRPollingTransport(BaseTransport):
         return []
 
     def connect(self, session, request_method):
+        if session.transport is None:
+            session.transport = "xhr-polling"
         if not session.connection_confirmed:
             session.connection_confirmed = True
             self.start_response("200 OK", [
@@ -95,93 +167,385 @@ class XHRPollingTransport(BaseTransport):
             raise Exception("No support for the method: " + request_method)
 
 
-class WSGreenlet(gevent.Greenlet):
-
-    def __init__(self, session, websocket):
-        gevent.Greenlet.__init__(self)
-        self._session = session
-        self._websocket = websocket
+# what _buffered_frames found at the start of the buffer
+_MESSAGE = "message"  # a whole message, or a close frame
+_CONTROL = "control"  # a ping or pong frame
+_OVERSIZED = "oversized"  # the start of a message larger than allowed
+
+
+def _buffered_frames(buf, pos, limit):
+    """
+    Look at the websocket frames in ``buf`` from ``pos`` on, without
+    consuming them. Returns what can be read without blocking, or
+    ``None``, and the payload size of the data frames seen. A message
+    larger than ``limit`` is reported from its frame headers alone.
+    """
+    end = len(buf)
+    size = 0
+    first = True
+    while pos + 2 <= end:
+        opcode = buf[pos] & 0x0f
+        fin = buf[pos] & 0x80
+        length = buf[pos + 1] & 0x7f
+        head = 2
+        if length == 126:
+            if pos + 4 > end:
+                break
+            length, = struct.unpack_from(b"!H", buf, pos + 2)
+            head = 4
+        elif length == 127:
+            if pos + 10 > end:
+                break
+            length, = struct.unpack_from(b"!Q", buf, pos + 2)
+            head = 10
+        if buf[pos + 1] & 0x80:
+            head += 4  # masking key
+        if opcode < 0x8:
+            size += length
+            if limit is not None and size > limit:
+                return _OVERSIZED, size
+        pos += head + length
+        if pos > end:
+            break
+        if opcode == 0x8 or (opcode < 0x8 and fin):
+            return _MESSAGE, size
+        if opcode > 0x8 and first:
+            return _CONTROL, size
+        first = False
+    return None, size
+
+
+class WebsocketConnection(object):
+    """
+    Drives a websocket connection from a single greenlet: one loop sends
+    whatever is queued for the client, reads from the socket when it
+    becomes readable and sends heartbeats when the connection goes quiet.
+
+    Incoming bytes are buffered and a message is only parsed once all of
+    its frames are there, so a client sending a partial frame never blocks
+    the loop. The socket is only read when the buffer holds no complete
+    message, and never past ``buffer_limit`` unconsumed bytes, so a
+    throttled client is held back by TCP instead of filling the buffer.
+    """
+
+    def __init__(self, session, websocket, socket, rfile):
+        self.session = session
+        self.websocket = websocket
+        self.socket = socket
+        self.capture = session.server.capture
+        self.readable = False
+        self.eof = False
+        self.wakeup = Event()
+
+        self.max_packet_size = session.server.max_packet_size
+        self.message_size = 0
+        # room for the frame headers of a message and a few control frames
+        self.buffer_limit = self.max_packet_size + 4096 if self.max_packet_size is not None else None
+
+        self._recv = getattr(socket, "_sock", socket).recv  # the non-blocking socket under gevent's
+        self.buffer = bytearray()
+        self.pos = 0  # bytes of the buffer consumed
+        rbuf = getattr(rfile, "_rbuf", None)  # socket._fileobject on Python 2
+        if rbuf is not None and rbuf.tell() > 0:
+            # frames that arrived together with the HTTP request
+            self.buffer += rbuf.getvalue()
+            rbuf.seek(0)
+            rbuf.truncate()
+        websocket.stream.read = websocket.raw_read = self._read_buffered
 
     def __str__(self):
-        return "<%s of %r>" % (type(self).__name__, self._session)
-
-
-class WSInboundGreenlet(WSGreenlet):
-
-    def _run(self):
+        return "<%s of %r>" % (type(self).__name__, self.session)
+
+    def _on_readable(self):
+        self.readable = True
+        self.wakeup.set()
+
+    def _fill(self):
+        """
+        Move what the socket has to the buffer, without blocking and without
+        going over ``buffer_limit``.
+        """
+        size = 65536
+        if self.buffer_limit is not None:
+            size = min(size, self.buffer_limit - (len(self.buffer) - self.pos))
+        try:
+            data = self._recv(size)
+        except socket_error as e:
+            if e.args[0] in (errno.EAGAIN, errno.EWOULDBLOCK, errno.EINTR):
+                return
+            data = b""
+        if data:
+            self.buffer += data
+        else:
+            self.eof = True
+
+    def _read_buffered(self, size):
+        data = bytes(self.buffer[self.pos:self.pos + size])
+        self.pos += len(data)
+        return data
+
+    def _compact(self):
+        if self.pos >= len(self.buffer):
+            del self.buffer[:]
+            self.pos = 0
+        elif self.pos >= 65536:
+            del self.buffer[:self.pos]
+            self.pos = 0
+
+    def _reject_message(self):
+        logger.warning("Rejecting %d byte message for session %r", self.message_size, self.session)
+        self.session.server.metrics.incr("inbound.oversized")
+        try:
+            self.websocket.send(packets.ErrorPacket(None, None, None, "packet too large", None).encode())
+            self.websocket.close(1009)  # message too big
+        except WebSocketError:
+            pass
+
+    def send(self, message):
+        if self.session.binary and isinstance(message, packets.MessagePacket) \
+                and isinstance(message.data, (bytes, bytearray)):
+            data, kind = message.encode_binary(), OUTBOUND | BINARY
+            self.websocket.send(data, binary=True)
+        else:
+            data, kind = message.encode(), OUTBOUND
+            self.websocket.send(data)
+        self.session.record_sent(message, len(data))
+        if self.capture is not None:
+            self.capture.record(self.session, kind, data)
+
+    def flush(self):
+        """Send all queued packets. Returns False once the session is closing."""
         while True:
-            message = self._websocket.receive()
-            logger.debug("Received message from WS: %r", message)
-
-            if not message:
-                logger.debug("Websocket closed by client. Killing session: %r", self._session)
-                self._session.kill()
-                break
-
             try:
-                packet = packets.Packet.decode(message)
-            except Exception:
-                logger.exception("Failed to decode packet: %r", message)
-                continue
-
-            if packet is not None:
-                self._session.packet_received(packet)
-
-
-class WSOutboundGreenlet(WSGreenlet):
-
-    def _run(self):
-        while True:
-            message = self._session._fetch_client()
-
+                message = self.session._fetch_client(block=False)
+            except Empty:
+                return True
             if message is None:
-                logger.debug("Closing outbound communication for session: %r", self._session)
-                self._session.kill()
-                break
-
-            try:
-                logger.debug("Sending outbound message: %r", message)
-                self._websocket.send(message.encode())
-                logger.debug("Message %r sent.", message)
-            except WebSocketError:
-                logger.exception("Outbound greenlet crashed.")
-                break
-
-
-class HeartbeatGreenlet(gevent.Greenlet):
-
-    def __init__(self, session):
-        gevent.Greenlet.__init__(self)
-        self._session_ref = weakref.ref(session)
-
-    def __str__(self):
-        return "<%s for %r>" % (type(self).__name__, self._session_ref)
+                logger.debug("Closing outbound communication for session: %r", self.session)
+                return False
+            logger.debug("Sending outbound message: %r", message)
+            self.send(message)
+
+    def _read_message(self):
+        """
+        ``websocket.receive()`` on the buffered frames, which hold a whole
+        message.
+        """
+        websocket = self.websocket
+        try:
+            return websocket.read_message()
+        except UnicodeError:
+            websocket.close(1007)
+        except ProtocolError:
+            websocket.close(1002)
+        except socket_error:
+            websocket.close()
+        finally:
+            self._compact()
+        return None
+
+    def _read_control(self):
+        websocket = self.websocket
+        try:
+            header, payload = websocket.read_frame()
+        except ProtocolError:
+            websocket.close(1002)
+            return False
+        finally:
+            self._compact()
+        if header.opcode == websocket.OPCODE_PING:
+            websocket.handle_ping(header, payload)
+        return True
+
+    def receive(self, ready):
+        """
+        Handle a buffered message or control frame, as reported by
+        :func:`_buffered_frames`. Returns False when the client is gone.
+        """
+        if ready is _OVERSIZED:
+            # the payload is never read, so the connection can't be used any more
+            self._reject_message()
+            return False
+        if ready is _CONTROL:
+            return self._read_control()
+
+        message = self._read_message()
+        logger.debug("Received message from WS: %r", message)
+
+        if not message:
+            logger.debug("Websocket closed by client. Killing session: %r", self.session)
+            return False
+
+        if self.capture is not None:
+            kind = INBOUND | BINARY if isinstance(message, bytearray) else INBOUND
+            self.capture.record(self.session, kind, message)
 
-    def _run(self):
-        while True:
-            session = self._session_ref()
-            if session is None or session.state != "CONNECTED":
-                return
-            logger.debug("Sending heartbeat for %r", session)
-            session.send(packets.HeartbeatPacket(None, None, None))
+        try:
+            if isinstance(message, bytearray):
+                if not self.session.binary:
+                    logger.warning("Binary frame on a session that did not negotiate it: %r", self.session)
+                    return True
+                packet = packets.MessagePacket.decode_binary(message)
+            else:
+                packet = packets.Packet.decode(message)
+        except Exception:
+            logger.exception("Failed to decode packet: %r", message)
+            return True
+
+        if packet is not None:
+            self.session.packet_received(packet, len(message))
+        return True
+
+    def run(self):
+        session = self.session
+        queue = session.client_queue
+        reader = gevent.get_hub().loop.io(self.socket.fileno(), 1)
+        reader.start(self._on_readable)
+        queue.on_put = self.wakeup.set
+        heartbeat_at = session.clock.now() + session.heartbeat / 2.0
+        yield_every = session.server.inbound_yield_every
+        budget = yield_every
+        try:
+            while session.connected:
+                self.wakeup.clear()
+                if not self.flush():
+                    break
+                ready, self.message_size = _buffered_frames(self.buffer, self.pos, self.max_packet_size)
+                if ready is None:
+                    if not reader.active:
+                        reader.start(self._on_readable)
+                    if self.readable:
+                        if self.buffer_limit is not None and len(self.buffer) - self.pos >= self.buffer_limit:
+                            # frame headers alone fill the buffer
+                            ready = _OVERSIZED
+                        else:
+                            self.readable = False
+                            self._fill()
+                            ready, self.message_size = _buffered_frames(self.buffer, self.pos,
+                                                                        self.max_packet_size)
+                elif self.readable and reader.active:
+                    # leave further data in the socket until the buffered
+                    # messages are handled; the watcher would fire until then
+                    reader.stop()
+                if ready is not None:
+                    if not self.receive(ready):
+                        break
+                    # a client with a full socket buffer never makes us
+                    # wait, so let other connections run now and then
+                    budget -= 1
+                    if budget <= 0:
+                        budget = yield_every
+                        gevent.sleep(0)
+                    continue
+                if self.eof:
+                    logger.debug("Websocket closed by client. Killing session: %r", session)
+                    break
+                budget = yield_every
+
+                timeout = heartbeat_at - session.clock.now()
+                if timeout <= 0:
+                    heartbeat_at = session.clock.now() + session.next_heartbeat()
+                    continue
+                self.wakeup.wait(timeout)
+        except WebSocketError:
+            logger.exception("Websocket connection crashed: %r", session)
+        finally:
+            reader.stop()
+            queue.on_put = None
+            session.kill()
 
-            # go back to sleep
-            duration = session.heartbeat
-            del session
-            gevent.sleep(duration // 2)
 
 class WebsocketTransport(BaseTransport):
 
     def connect(self, session, request_method):
-        websocket = self.handler().environ['wsgi.websocket']
-        websocket.send("1::")
+        handler = self.handler()
+        websocket = handler.environ['wsgi.websocket']
+        if session.transport == "xhr-polling":
+            if not self._upgrade(session, websocket):
+                return []
+        else:
+            session.transport = "websocket"
+        if not session.connection_confirmed:
+            session.connection_confirmed = True
+            websocket.send("1::")
 
-        in_ = WSOutboundGreenlet(session, websocket)
-        in_.start()
-        out_ = WSInboundGreenlet(session, websocket)
-        out_.start()
+        WebsocketConnection(session, websocket, handler.socket, handler.rfile).run()
+        return []
 
-        heartbeat = HeartbeatGreenlet(session)
-        heartbeat.start_later(session.heartbeat // 2)
+    def _upgrade(self, session, websocket):
+        """
+        Take over a session from polling. If the outstanding polls are not
+        answered in time, the websocket is closed and the client keeps
+        polling.
+        """
+        metrics = session.server.metrics
+        metrics.incr("upgrade.attempted")
+        if not session.upgrade("websocket", session.server.upgrade_timeout):
+            logger.warning("Outstanding polls of %r not answered, upgrade aborted", session)
+            metrics.incr("upgrade.failed")
+            websocket.close()
+            return False
+        logger.debug("Session %r upgraded to websocket", session)
+        metrics.incr("upgrade.succeeded")
+        return True
+
+
+class LoopbackTransport(object):
+    """
+    In-process client connected straight to a session's queues, for
+    benchmarks and tests of application code. Packets are encoded and
+    decoded exactly as on the wire, but no sockets or HTTP are involved.
+
+    ``connect()`` does the handshake and starts the application of the
+    resource named ``resource`` (by default the server's) for the session,
+    like the first request of a real client would.
+    """
+
+    def __init__(self, server, query="", application=None, resource=None):
+        self.server = server
+        self.query = query
+        self.resource = server.router.resources[resource] if resource is not None else server.resource
+        self.application = application or self.resource.application or server.application
+        self.session = None
+
+    def connect(self):
+        environ = {"QUERY_STRING": self.query, "REQUEST_METHOD": "GET"}
+        session = self.server.create_session(environ, self.resource)
+        self.server.get_session(session.session_id)
+        session.connection_confirmed = True
+        environ["PATH_INFO"] = "/%s/1/loopback/%s" % (self.resource.name, session.session_id)
+        environ["socketio"] = protocol.PySocketProtocol(session)
+        session.wsgi_app_greenlet = gevent.spawn(self.application, environ,
+                                                 lambda status, headers, exc=None: None)
+        self.session = session
+        return session
+
+    def send(self, packet):
+        """Deliver a packet from the client to the server."""
+        self.send_raw(packet.encode())
+
+    def send_raw(self, data):
+        self.session.packet_received(packets.Packet.decode(data), len(data))
+
+    def receive(self, timeout=None):
+        """
+        Wait for the next packet from the server. Heartbeats are answered
+        and skipped; ``None`` means the session was closed.
+        """
+        while True:
+            if self.session.closed:  # its queues are gone
+                return None
+            message = self.session._fetch_client(timeout=timeout)
+            if message is None:
+                return None
+            data = message.encode()
+            self.session.record_sent(message, len(data))
+            packet = packets.Packet.decode(data)
+            if packet.kind != "heartbeat":
+                return packet
+            self.send(packets.HeartbeatPacket(None, None, None))
+
+    def close(self):
+        if self.session is not None and self.session.connected:
+            self.send(packets.DisconnectPacket(None, None, None))
 
-        return [in_, out_, heartbeat]